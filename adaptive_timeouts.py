@@ -0,0 +1,240 @@
+# adaptive_timeouts.py
+# 画面操作・ダウンロードのタイムアウトを、過去の所要時間から決める
+#
+# これまでタイムアウトは固定値（ページ移動・ダウンロード 60000ms、ログインフォーム 10000ms、
+# CSVリンク 30000ms、候補セレクターごとに 3000ms など）で、Prescoが速い日は候補の試行に時間を
+# 使いすぎ、エクスポートが重い日は足りずに失敗していた。ここでは手順（レポートの種類 × 手順名）
+# ごとに成功したときの所要時間を記録し、直近の p95 / p99 に余裕を掛けた値をタイムアウトにする。
+#   ・記録が MIN_SAMPLES 件未満の手順は、これまでの固定値を使う
+#   ・タイムアウトは固定値の FLOOR_RATIO 倍〜CEILING_RATIO 倍の範囲に収める
+#     （本当に壊れているときは早めに失敗し、重い日は固定値より長く待つ）
+#   ・タイムアウトで失敗した手順は、かかった時間を「これ以上かかる」記録（censored）として残し、
+#     次の試行は固定値の CEILING_RATIO 倍まで待つ（重い日に短いタイムアウトのまま失敗し続けないように）
+#   ・候補セレクターの試行（probe=True）は、見つからないのが普通なので失敗を記録しない
+#   ・固定の time.sleep で待っていた箇所は settle() でページの通信が落ち着くまで待つ
+#     （待つ上限＝ポーリングの予算も、同じように過去の所要時間から決める）
+#
+#   with adaptive_timeouts.step('actionLog', 'csv_link', 30000) as timeout:
+#       page.wait_for_selector('#csv-link', state='visible', timeout=timeout)
+#   adaptive_timeouts.settle(page, 'login', 'login_settle', 3000)
+#
+#   python adaptive_timeouts.py                 # 手順ごとの所要時間とタイムアウトを表示
+#   PRESCO_ADAPTIVE_TIMEOUTS=0 python sync_presco.py   # 固定値に戻す
+
+import os
+import time
+import sqlite3
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+HISTORY_PATH  = os.environ.get('PRESCO_LATENCY_PATH', '/tmp/presco_latency.db')
+ENABLED       = os.environ.get('PRESCO_ADAPTIVE_TIMEOUTS', '1') != '0'
+
+HISTORY_SIZE  = 50     # 手順ごとに残す直近の記録数
+MIN_SAMPLES   = 5      # これ未満なら固定値を使う
+P95_MARGIN    = 2.0    # p95 の何倍まで待つか
+P99_MARGIN    = 1.5    # p99 の何倍まで待つか
+FLOOR_RATIO   = 0.25   # 固定値に対する下限
+CEILING_RATIO = 3.0    # 固定値に対する上限
+IDLE_MS       = 50     # settle() がこれより早く戻ったら、最初から通信が落ち着いていたとみなす
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS step_latency (
+        report      TEXT NOT NULL,
+        step        TEXT NOT NULL,
+        duration_ms REAL NOT NULL,
+        default_ms  INTEGER NOT NULL,
+        recorded_at TEXT NOT NULL,
+        censored    INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS step_latency_step ON step_latency (report, step, recorded_at);
+"""
+
+
+# ============================================================
+#  所要時間の記録
+# ============================================================
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+class History:
+    """手順ごとの直近の所要時間（ms）。記録は SQLite に残し、読み込みは最初の1回だけ行う"""
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path      = path
+        self._samples  = None
+        self._defaults = {}   # 手順ごとの固定値（一覧の表示用）
+        self._lock     = threading.Lock()
+        self._migrated = False   # スキーマの作成・列の追加を済ませたか
+
+    def _connect(self):
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=10)
+        if not self._migrated:
+            db.executescript(SCHEMA)
+            # censored 列がない古い記録（接続のたびではなく、最初の1回だけ確かめる）
+            columns = [row[1] for row in db.execute("PRAGMA table_info(step_latency)")]
+            if 'censored' not in columns:
+                db.execute("ALTER TABLE step_latency ADD COLUMN censored INTEGER NOT NULL DEFAULT 0")
+            self._migrated = True
+        return db
+
+    def _load(self):
+        if self._samples is not None:
+            return self._samples
+        self._samples = {}
+        try:
+            db = self._connect()
+            try:
+                for report, step, duration, default, censored in db.execute(
+                        "SELECT report, step, duration_ms, default_ms, censored FROM step_latency ORDER BY recorded_at"):
+                    self._samples.setdefault((report, step), []).append((duration, bool(censored)))
+                    self._defaults[(report, step)] = default
+            finally:
+                db.close()
+        except sqlite3.Error as e:
+            print(f"[{datetime.now()}] 警告: 所要時間の記録を読み込めませんでした（固定のタイムアウトを使います） - {str(e)}")
+        for key, values in self._samples.items():
+            self._samples[key] = values[-HISTORY_SIZE:]
+        return self._samples
+
+    def samples(self, report, step):
+        """[(所要時間, censored)]（古い順）"""
+        with self._lock:
+            return list(self._load().get((report, step), []))
+
+    def record(self, report, step, duration_ms, default, censored=False):
+        """
+        手順の所要時間を記録する（ワーカースレッドから呼べる）
+        censored=True はタイムアウトで打ち切った時間（実際はこれ以上かかる）
+        """
+        with self._lock:
+            values = self._load().setdefault((report, step), [])
+            values.append((duration_ms, censored))
+            del values[:-HISTORY_SIZE]
+            self._defaults[(report, step)] = default
+            try:
+                db = self._connect()
+                try:
+                    with db:
+                        db.execute("INSERT INTO step_latency VALUES (?, ?, ?, ?, ?, ?)",
+                                   (report, step, duration_ms, default,
+                                    datetime.now().isoformat(timespec='milliseconds'), int(censored)))
+                        # 古い記録は消す（手順ごとに HISTORY_SIZE 件まで）
+                        db.execute(
+                            "DELETE FROM step_latency WHERE report = ? AND step = ? AND rowid NOT IN ("
+                            "SELECT rowid FROM step_latency WHERE report = ? AND step = ? "
+                            "ORDER BY recorded_at DESC LIMIT ?)",
+                            (report, step, report, step, HISTORY_SIZE))
+                finally:
+                    db.close()
+            except sqlite3.Error as e:
+                # 記録の失敗で同期処理自体を失敗させない
+                print(f"[{datetime.now()}] 警告: 所要時間の記録に失敗しました（{report}/{step}） - {str(e)}")
+
+    def timeout(self, report, step, default):
+        """
+        直近の p95 / p99 から決めたタイムアウト（ms）。記録が少なければ default
+        直前の試行がタイムアウトしていたら、上限（default の CEILING_RATIO 倍）まで待つ
+        """
+        samples = self.samples(report, step)
+        if not ENABLED:
+            return default
+        if samples and samples[-1][1]:
+            return int(default * CEILING_RATIO)
+        if len(samples) < MIN_SAMPLES:
+            return default
+        # 打ち切った記録も「少なくともこれだけかかった」値として含める
+        values   = [duration for duration, _ in samples]
+        adaptive = max(_percentile(values, 0.95) * P95_MARGIN, _percentile(values, 0.99) * P99_MARGIN)
+        return int(min(max(adaptive, default * FLOOR_RATIO), default * CEILING_RATIO))
+
+
+_history = History()
+
+
+# ============================================================
+#  各スクリプト用
+# ============================================================
+
+def timeout(report, step, default):
+    return _history.timeout(report, step, default)
+
+
+def _is_timeout(e):
+    """Playwright の TimeoutError・urllib / socket のタイムアウト"""
+    return (isinstance(e, TimeoutError) or type(e).__name__ == 'TimeoutError'
+            or isinstance(getattr(e, 'reason', None), TimeoutError))
+
+
+@contextlib.contextmanager
+def step(report, name, default, probe=False):
+    """
+    手順のタイムアウト（ms）を渡し、ブロックが成功したら所要時間を記録する
+    タイムアウトで失敗したら打ち切った時間を censored として記録する（次の試行は上限まで待つ）
+    probe=True（候補セレクターの試行）は、失敗しても記録しない
+    """
+    started = time.perf_counter()
+    try:
+        yield timeout(report, name, default)
+    except Exception as e:
+        if not probe and _is_timeout(e):
+            _history.record(report, name, (time.perf_counter() - started) * 1000, default, censored=True)
+        raise
+    _history.record(report, name, (time.perf_counter() - started) * 1000, default)
+
+
+def settle(page, report, name, default):
+    """
+    固定の time.sleep の代わりに、ページの通信が落ち着く（networkidle）まで待つ
+    待つ上限（ms）は step() と同じく過去の所要時間から決める。上限まで落ち着かなくても
+    エラーにはせず（固定の待ち時間と同じ扱い）、打ち切った時間は記録しない
+    （通信が止まらない画面で上限が伸び続けないように）
+    最初から落ち着いていた（すぐに戻った）ときも記録しない（0ms の記録で上限が下限に張り付かないように）
+    ページ移動を伴う操作の後はこれでは足りない（移動が始まる前に戻る）ので、expect_navigation で待つ
+    """
+    budget  = timeout(report, name, default)
+    started = time.perf_counter()
+    try:
+        page.wait_for_load_state('networkidle', timeout=budget)
+    except Exception as e:
+        if not _is_timeout(e):
+            raise
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+    if elapsed >= IDLE_MS:
+        _history.record(report, name, elapsed, default)
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="手順ごとの所要時間とタイムアウト")
+    parser.add_argument('--db', default=HISTORY_PATH)
+    args = parser.parse_args()
+
+    history = History(args.db)
+    print(f"{'レポート':<14}{'手順':<18}{'件数':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'固定値':>10}{'timeout':>10}")
+    for (report, name), samples in sorted(history._load().items()):
+        values  = [duration for duration, _ in samples]
+        default = history._defaults[(report, name)]
+        print(f"{report:<14}{name:<18}{len(values):>6}"
+              f"{_percentile(values, 0.5):>10.0f}{_percentile(values, 0.95):>10.0f}{_percentile(values, 0.99):>10.0f}"
+              f"{default:>10}{history.timeout(report, name, default):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# ads_export.py
+# Google広告のオフラインコンバージョン取り込み形式のCSVをローカルに書き出す（Sheetsを経由しない）
+#
+#   Parameters:TimeZone=Asia/Tokyo,,,,
+#   Google Click ID,Conversion Name,Conversion Time,Conversion Value,Conversion Currency
+#   Cj0KCQ...,看護オフラインCV,2025/01/01 12:34:56,1500,JPY
+#
+# ・gzip 圧縮（.csv.gz）に対応
+# ・max_bytes を指定すると、その大きさ（圧縮前）を超えないように複数ファイルに分割する
+#   分割した各ファイルの先頭にも Parameters 行と列ヘッダーを入れる（1ファイルずつ取り込めるように）
+# ・書き込み中は .part に出力し、全ファイルを書き終えてから名前を変える
+#   （取り込み側が書きかけのファイルを読むことはない）
+
+import io
+import os
+import csv
+import gzip
+from datetime import datetime
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+ADS_OUTPUT_DIR = os.environ.get('PRESCO_ADS_OUTPUT_DIR', '/tmp/presco_ads')
+HEADER_ROWS    = 2   # Parameters 行 + 列ヘッダー
+ENCODING       = 'utf-8'
+
+SINKS = ('sheets', 'ads-csv', 'both')
+
+
+# ============================================================
+#  書き出し
+# ============================================================
+
+class SplitWriter:
+
+    def __init__(self, path, header_rows, compress=False, max_bytes=None):
+        if compress and not path.endswith('.gz'):
+            path += '.gz'
+        self.path         = path
+        self.header_rows  = [list(row) for row in header_rows]
+        self.compress     = compress
+        self.max_bytes    = max_bytes
+        self.rows         = 0
+        self._parts       = []     # (書き込み中のパス, 完成後のパス)
+        self._file        = None
+        self._size        = 0
+        self._buffer      = io.StringIO()
+        self._csv         = csv.writer(self._buffer)
+        self._header_size = sum(len(self._encode(row)) for row in self.header_rows)
+
+    def _encode(self, row):
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._csv.writerow(row)
+        return self._buffer.getvalue().encode(ENCODING)
+
+    def _final_path(self, index):
+        if self.max_bytes is None:
+            return self.path
+        stem, ext = self.path, ''
+        for suffix in ('.csv.gz', '.csv', '.gz'):
+            if stem.endswith(suffix):
+                stem, ext = stem[:-len(suffix)], suffix
+                break
+        return f"{stem}-{index:03d}{ext}"
+
+    def _open_next(self):
+        self._close_current()
+        final = self._final_path(len(self._parts) + 1)
+        part  = final + '.part'
+        directory = os.path.dirname(os.path.abspath(final))
+        os.makedirs(directory, exist_ok=True)
+        self._file = gzip.open(part, 'wb') if self.compress else open(part, 'wb')
+        self._parts.append((part, final))
+        self._size = 0
+        for row in self.header_rows:
+            data = self._encode(row)
+            self._file.write(data)
+            self._size += len(data)
+
+    def _close_current(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def writerow(self, row):
+        data = self._encode(row)
+        # 上限を超える場合は次のファイルへ（1行も入っていないファイルは分けない）
+        if self._file is None or (
+            self.max_bytes is not None and self._size + len(data) > self.max_bytes and self._size > self._header_size
+        ):
+            self._open_next()
+        self._file.write(data)
+        self._size += len(data)
+        self.rows  += 1
+
+    def close(self):
+        """書き込み中のファイルを完成後の名前に変えて、そのパスの一覧を返す"""
+        if self._file is None and not self._parts:
+            self._open_next()   # データが0件でもヘッダーだけのファイルを作る
+        self._close_current()
+        for part, final in self._parts:
+            os.replace(part, final)
+        return [final for _, final in self._parts]
+
+    def abort(self):
+        self._close_current()
+        for part, _ in self._parts:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+
+
+def write(values, path, compress=False, max_bytes=None, header_rows=HEADER_ROWS):
+    """
+    values（先頭 header_rows 行が Parameters 行と列ヘッダー）を書き出し、作成したファイルのパス一覧を返す
+    """
+    writer = SplitWriter(path, values[:header_rows], compress=compress, max_bytes=max_bytes)
+    try:
+        for row in values[header_rows:]:
+            writer.writerow(row)
+        paths = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+    for p in paths:
+        print(f"[{datetime.now()}] Google広告用CSVを書き出しました: {p}（{os.path.getsize(p)} bytes）")
+    print(f"[{datetime.now()}] コンバージョン {writer.rows}件 / {len(paths)}ファイル")
+    return paths
+
+
+def default_path(pipeline):
+    return os.path.join(ADS_OUTPUT_DIR, f"{pipeline}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+
+
+# ============================================================
+#  コマンドライン引数
+# ============================================================
+
+def add_arguments(parser):
+    """sync_presco.py / presco_gamesverse.py の argparse に出力先の指定を追加する"""
+    parser.add_argument('--sink', choices=SINKS, default='sheets',
+                        help="出力先（sheets: スプレッドシート / ads-csv: Google広告用CSV / both: 両方）")
+    parser.add_argument('--ads-output', metavar='PATH',
+                        help=f"Google広告用CSVのパス（省略時は {ADS_OUTPUT_DIR} に日時付きで作成）")
+    parser.add_argument('--ads-gzip', action='store_true', help="Google広告用CSVを gzip 圧縮する")
+    parser.add_argument('--ads-max-bytes', type=int, metavar='BYTES',
+                        help="1ファイルの上限サイズ（圧縮前）。超える場合は -001, -002 ... に分割する")
@@ -0,0 +1,340 @@
+# backfill.py
+# 成果（actionLog）の過去分を、任意の期間で取得し直す（sync_presco.py / presco_gamesverse.py 用）
+#
+# 通常の同期は「昨日〜今日」しか取得しないため、障害で取りこぼした期間や、新しく追加した成果地点の
+# 過去分を作り直せなかった。ここでは期間を1日または1週間ずつの区間に分けて取得する。
+#   ・ログインは1回だけ行い、最初の区間をブラウザで検索したときのCSVリンクの期間を書き換えて、
+#     残りの区間をログイン済みのCookieで並列にダウンロードする
+#     （リンクが取れない画面では、ブラウザで1区間ずつ取得する）
+#   ・取得した区間は進捗ファイル（journal.json）に記録し、途中で止まっても次回は続きから取得する
+#   ・全区間がそろったら古い順に並べ、gclid の重複を除いてから「<シート名>_過去分」に出力する
+#     （生データは通常の同期と同じく、アーカイブ・検索用DB・日別集計にも取り込む）
+#
+#   python backfill.py sync_presco --from 2025-01-01 --to 2025-03-31
+#   python backfill.py presco_gamesverse --from 2025-01-01 --to 2025-12-31 --chunk week --workers 6
+#   python backfill.py sync_presco --from 2025-01-01 --to 2025-01-31 --dry-run --output backfill.csv
+
+import os
+import json
+import shutil
+import argparse
+import importlib
+import threading
+import urllib.parse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import run_metrics
+import partner_sites
+import presco_browser
+import local_output
+import raw_archive
+import query_store
+import daily_rollup
+import network_accounting
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+PIPELINES    = ('sync_presco', 'presco_gamesverse')
+BACKFILL_DIR = os.environ.get('PRESCO_BACKFILL_DIR', '/tmp/presco_backfill')
+WORKERS      = int(os.environ.get('PRESCO_BACKFILL_WORKERS', '4'))
+CHUNKS       = {'day': timedelta(days=1), 'week': timedelta(days=7)}
+
+CSV_SELECTORS = ['#csv-link']
+DATE_PARAMS   = ('dateTimeFrom', 'dateTimeTo')
+REPORT_TYPE   = 'actionLog'
+
+ACTION_AT = 3    # D列: 成果発生日時（古い順に並べて、gclid は最初の成果を残す）
+
+
+# ============================================================
+#  区間
+# ============================================================
+
+def chunks(date_from, date_to, size):
+    """date_from〜date_to（両端を含む）を size ごとの (開始日, 終了日) に分ける"""
+    result = []
+    start  = date_from
+    while start <= date_to:
+        end = min(start + size - timedelta(days=1), date_to)
+        result.append((start, end))
+        start = end + timedelta(days=1)
+    return result
+
+
+def chunk_key(start, end):
+    return start.strftime('%Y-%m-%d') if start == end else f"{start:%Y-%m-%d}_{end:%Y-%m-%d}"
+
+
+def with_period(url, start, end):
+    """CSVリンクの検索期間（dateTimeFrom / dateTimeTo）を書き換える"""
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    query[DATE_PARAMS[0]] = start.strftime('%Y/%m/%d')
+    query[DATE_PARAMS[1]] = end.strftime('%Y/%m/%d')
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+# ============================================================
+#  進捗ファイル
+# ============================================================
+
+class Journal:
+    """
+    区間ごとの取得状況を journal.json に記録する（区間のCSVも同じディレクトリに置く）
+    期間・区間の長さごとに別のディレクトリになり、同じ条件で実行し直すと続きから取得する
+    """
+
+    def __init__(self, pipeline, params, resume=True, base_dir=BACKFILL_DIR):
+        self.pipeline  = pipeline
+        self.params    = params
+        self.directory = os.path.join(base_dir, f"{pipeline}_{params['from']}_{params['to']}_{params['chunk']}")
+        self.entries   = self._load() if resume else {}
+        self._lock     = threading.Lock()
+
+    @property
+    def _path(self):
+        return os.path.join(self.directory, 'journal.json')
+
+    def _load(self):
+        try:
+            with open(self._path, encoding='utf-8') as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if journal.get('params') != self.params:
+            return {}
+        return journal.get('chunks', {})
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'pipeline': self.pipeline, 'params': self.params, 'chunks': self.entries},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self._path)
+
+    def csv_path(self, key):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{key}.csv")
+
+    def downloaded(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and os.path.exists(self.csv_path(key))
+
+    def loaded(self, key):
+        return self.downloaded(key) and self.entries[key].get('loaded', False)
+
+    def record(self, key, **values):
+        """区間の状態を更新して保存する（ワーカースレッドから呼べる）"""
+        with self._lock:
+            entry = self.entries.setdefault(key, {})
+            entry.update(values, saved_at=datetime.now().isoformat(timespec='seconds'))
+            self._save()
+
+    def complete(self):
+        """出力まで終わったので進捗ファイルと区間のCSVを削除する"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+# ============================================================
+#  ダウンロード
+# ============================================================
+
+def download_chunks(module, pending, journal, workers=WORKERS):
+    """未取得の区間をダウンロードして journal に記録する"""
+    email    = os.environ.get('PRESCO_EMAIL')
+    password = os.environ.get('PRESCO_PASSWORD')
+    if not email or not password:
+        raise Exception("環境変数 PRESCO_EMAIL, PRESCO_PASSWORD が設定されていません")
+
+    # Playwright はブラウザを起動するときだけ読み込む
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        with run_metrics.span('browser_launch'):
+            print(f"[{datetime.now()}] ブラウザを起動します")
+            browser = p.chromium.launch(headless=True, args=presco_browser.LAUNCH_ARGS)
+            context = browser.new_context(viewport=presco_browser.VIEWPORT, user_agent=presco_browser.USER_AGENT)
+            context.set_default_timeout(presco_browser.DEFAULT_TIMEOUT)
+            network_accounting.watch(context)
+            page = context.new_page()
+
+        try:
+            with run_metrics.span('login'):
+                presco_browser.login(page, email, password)
+            fetch_chunks(page, module, pending, journal, workers)
+        except Exception:
+            try:
+                page.screenshot(path='/tmp/error_backfill.png')
+            except Exception:
+                pass
+            raise
+        finally:
+            browser.close()
+            print(f"[{datetime.now()}] ブラウザを閉じました")
+
+
+def fetch_chunks(page, module, pending, journal, workers=WORKERS):
+    """ログイン済みの page を使って pending の区間を取得する"""
+    def browser_download(start, end):
+        key  = chunk_key(start, end)
+        path = module.download_csv(page, start.strftime('%Y/%m/%d'), end.strftime('%Y/%m/%d'),
+                                   journal.csv_path(key))
+        journal.record(key, file=os.path.basename(path), bytes=os.path.getsize(path))
+
+    # 最初の区間はブラウザで検索し、そのときのCSVリンクを残りの区間に使う
+    first, rest = pending[0], pending[1:]
+    with run_metrics.span('navigate', chunk=chunk_key(*first)):
+        browser_download(*first)
+        link = partner_sites.csv_link(page, CSV_SELECTORS, REPORT_TYPE) if rest else None
+
+    if not rest:
+        return
+    query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(link).query)) if link else {}
+    if not all(param in query for param in DATE_PARAMS):
+        print(f"[{datetime.now()}] CSVリンクに期間が含まれていないため、ブラウザで1区間ずつダウンロードします")
+        for start, end in rest:
+            browser_download(start, end)
+        return
+
+    headers = partner_sites.session_headers(page, link)
+
+    def download(start, end):
+        key  = chunk_key(start, end)
+        path = partner_sites.download(with_period(link, start, end), journal.csv_path(key), headers, REPORT_TYPE)
+        journal.record(key, file=os.path.basename(path), bytes=os.path.getsize(path))
+
+    with run_metrics.span('export', chunks=len(rest), workers=workers):
+        print(f"[{datetime.now()}] {len(rest)}区間のCSVを並列でダウンロードします（同時 {workers}件）")
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = [pool.submit(download, start, end) for start, end in rest]
+            errors  = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        # 取得できた区間は journal に残っているので、再実行すると失敗した区間だけを取得する
+        raise Exception(f"{len(errors)}区間のダウンロードに失敗しました（再実行すると続きから取得します） - {str(errors[0])}")
+
+
+# ============================================================
+#  取り込み・出力
+# ============================================================
+
+def merge(module, journal, periods):
+    """全区間のCSVを古い順に並べて1つの表（先頭行はヘッダー）にする"""
+    header, rows = None, []
+    for start, end in periods:
+        data = module.read_csv(journal.csv_path(chunk_key(start, end)))
+        if not data:
+            continue
+        header = header or data[0]
+        rows  += data[1:]
+    rows.sort(key=lambda row: row[ACTION_AT] if len(row) > ACTION_AT else '')
+    return ([header] if header else []) + rows
+
+
+def load_history(module, journal, periods, args):
+    """未取り込みの区間の生データを、アーカイブ・検索用DB・日別集計に取り込む"""
+    for start, end in periods:
+        key = chunk_key(start, end)
+        if journal.loaded(key):
+            continue
+        data = module.read_csv(journal.csv_path(key))
+        if not args.no_archive:
+            raw_archive.archive_quietly('actionLog', data)
+        if not args.no_store:
+            query_store.load_quietly('actionLog', data)
+        if not args.no_rollup:
+            daily_rollup.update_quietly(data)
+        journal.record(key, loaded=True, rows=max(len(data) - 1, 0))
+
+
+def backfill(args):
+    module    = importlib.import_module(args.pipeline)
+    date_from = datetime.strptime(args.date_from, '%Y-%m-%d')
+    date_to   = datetime.strptime(args.date_to, '%Y-%m-%d')
+    if date_from > date_to:
+        raise Exception(f"期間の指定が正しくありません: {args.date_from} 〜 {args.date_to}")
+
+    periods = chunks(date_from, date_to, CHUNKS[args.chunk])
+    journal = Journal(args.pipeline, {'from': args.date_from, 'to': args.date_to, 'chunk': args.chunk,
+                                      'report': 'actionLog', 'date_type': 'judgeDate'},
+                      resume=not args.restart)
+    pending = [(start, end) for start, end in periods if not journal.downloaded(chunk_key(start, end))]
+
+    with run_metrics.pipeline('backfill', target=args.pipeline, chunks=len(periods), pending=len(pending)):
+        print(f"[{datetime.now()}] {args.date_from} 〜 {args.date_to} を {len(periods)}区間に分けて取得します"
+              f"（取得済み {len(periods) - len(pending)}区間）")
+
+        if pending:
+            with run_metrics.span('scrape'):
+                download_chunks(module, pending, journal, args.workers)
+
+        with run_metrics.span('load'):
+            load_history(module, journal, periods, args)
+
+        with run_metrics.span('merge') as s:
+            data = merge(module, journal, periods)
+            s.set('rows', len(data))
+
+        # 区間をまたいだ同じ gclid は最初の成果だけを残す（transform_rows が gclid で重複を除く）
+        new_data = module.transform_rows(data, set(), cutoff_datetime=datetime.min)
+
+        if args.dry_run:
+            with run_metrics.span('dry_run'):
+                local_output.write(new_data, args.output)
+            return new_data
+
+        with run_metrics.span('upload'):
+            module.upload_backfill(new_data)
+        journal.complete()
+        return new_data
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="成果の過去分の取得")
+    parser.add_argument('pipeline', choices=PIPELINES)
+    parser.add_argument('--from', dest='date_from', required=True, help="YYYY-MM-DD（成果判定日時）")
+    parser.add_argument('--to', dest='date_to', required=True, help="YYYY-MM-DD")
+    parser.add_argument('--chunk', choices=sorted(CHUNKS), default='day', help="1回に検索する期間")
+    parser.add_argument('--workers', type=int, default=WORKERS, metavar='N', help="区間を同時にダウンロードする数")
+    parser.add_argument('--restart', action='store_true', help="進捗ファイルを使わず最初から取得する")
+    parser.add_argument('--dry-run', action='store_true', help="シートには書き込まず、変換結果をローカルに出力する")
+    parser.add_argument('--output', metavar='PATH', help="--dry-run の出力先CSV（省略時は先頭行を表示）")
+    raw_archive.add_arguments(parser)
+    query_store.add_arguments(parser)
+    daily_rollup.add_arguments(parser)
+    network_accounting.add_arguments(parser)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    network_accounting.enable_from_args(args)
+
+    try:
+        print("=" * 60)
+        print(f"[{datetime.now()}] 過去分の取得を開始します（{args.pipeline}）")
+        print("=" * 60)
+
+        backfill(args)
+
+        print("=" * 60)
+        print(f"[{datetime.now()}] すべての処理が正常に完了しました")
+        print("=" * 60)
+
+    except Exception as e:
+        print("=" * 60)
+        print(f"[{datetime.now()}] エラーが発生しました: {str(e)}")
+        print("=" * 60)
+        raise
+
+
+if __name__ == "__main__":
+    main()
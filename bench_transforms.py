@@ -0,0 +1,269 @@
+# bench_transforms.py
+# 変換処理のベンチマーク（合成データ）
+#
+# 対象:
+#   sync_presco.transform_csv_data / presco_gamesverse.transform_csv_data
+#   extract_gclid / format_datetime_for_google
+#   presco_kango.extract_columns / presco_kango_item5.extract_columns
+#   presco_kango_cv.process_data
+#
+# 関数ごとにスループット（行/秒）とピークメモリを測り、結果をJSONに保存する。
+# --baseline で前回の結果と比較し、指定した割合以上遅くなった関数があれば終了コード1を返す。
+#
+# 使い方:
+#   python bench_transforms.py --sizes 10000 100000 1000000 --output bench.json
+#   python bench_transforms.py --sizes 10000 100000 --baseline bench.json --max-regression 0.2
+
+import os
+import csv
+import sys
+import json
+import hashlib
+import time
+import platform
+import argparse
+import tracemalloc
+import contextlib
+import subprocess
+from datetime import datetime
+
+import synthetic_presco
+
+
+# ============================================================
+#  ベンチマーク対象
+# ============================================================
+
+def _load_targets():
+    import sync_presco
+    import presco_gamesverse
+    import presco_kango
+    import presco_kango_cv
+    import presco_kango_item5
+
+    def sample(load, column):
+        return [row[column] for row in load()[1:] if len(row) > column]
+
+    # (名前, CSV種別, 入力の準備, 計測する処理)
+    # 入力の準備（CSVの読み込みなど）は計測に含めない
+    return [
+        ('sync_presco.transform_csv_data', 'actionLog',
+         lambda path, load: path,
+         lambda path: sync_presco.transform_csv_data(path, set())),
+        ('presco_gamesverse.transform_csv_data', 'actionLog',
+         lambda path, load: path,
+         lambda path: presco_gamesverse.transform_csv_data(path, set())),
+        ('sync_presco.extract_gclid', 'actionLog',
+         lambda path, load: sample(load, 12),
+         lambda urls: [sync_presco.extract_gclid(u) for u in urls]),
+        ('sync_presco.format_datetime_for_google', 'actionLog',
+         lambda path, load: sample(load, 3),
+         lambda values: [sync_presco.format_datetime_for_google(v) for v in values]),
+        ('presco_kango.extract_columns', 'report',
+         lambda path, load: load(),
+         presco_kango.extract_columns),
+        ('presco_kango_item5.extract_columns', 'report',
+         lambda path, load: load(),
+         presco_kango_item5.extract_columns),
+        ('presco_kango_cv.extract_gclid', 'clickLog',
+         lambda path, load: sample(load, 10),
+         lambda urls: [presco_kango_cv.extract_gclid(u) for u in urls]),
+        ('presco_kango_cv.process_data', 'clickLog',
+         lambda path, load: load(),
+         presco_kango_cv.process_data),
+    ]
+
+
+# ============================================================
+#  データ
+# ============================================================
+
+def _dataset(data_dir, kind, rows, encoding, site_mix, gclid_rate, seed):
+    """合成CSVを作成（同じ条件のファイルがあれば再利用）してパスを返す"""
+    mix_tag = hashlib.sha1(json.dumps(sorted(site_mix.items()), ensure_ascii=False).encode()).hexdigest()[:8]
+    # 成果一覧は「昨日0時以降」で絞り込まれるため、日付が変わったら作り直す
+    name = f"{kind}_{rows}_{encoding}_m{mix_tag}_g{gclid_rate:g}_s{seed}_{datetime.now():%Y%m%d}.csv"
+    path = os.path.join(data_dir, name)
+    if not os.path.exists(path):
+        print(f"[{datetime.now()}] 合成データを作成します: {path}")
+        tmp = path + '.tmp'
+        synthetic_presco.write_csv(tmp, kind, rows, encoding=encoding, site_mix=site_mix,
+                                   gclid_rate=gclid_rate, seed=seed)
+        os.replace(tmp, path)
+    return path
+
+
+def _loader(path, encoding):
+    def load():
+        with open(path, 'r', encoding=encoding, newline='') as f:
+            return list(csv.reader(f))
+    return load
+
+
+# ============================================================
+#  計測
+# ============================================================
+
+@contextlib.contextmanager
+def _quiet():
+    """変換処理のログ出力は計測の邪魔になるので捨てる"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _measure(fn, arg, repeat, memory):
+    best = None
+    for _ in range(repeat):
+        with _quiet():
+            started = time.perf_counter()
+            fn(arg)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        # tracemalloc は処理を遅くするので、時間とは別に1回だけ計測する
+        tracemalloc.start()
+        try:
+            with _quiet():
+                fn(arg)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def run(sizes, encodings, site_mix, gclid_rate, data_dir, repeat=3, memory=True, only=None, seed=0):
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+
+    for name, kind, prepare, fn in _load_targets():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        for encoding in encodings:
+            for rows in sizes:
+                path  = _dataset(data_dir, kind, rows, encoding, site_mix, gclid_rate, seed)
+                arg   = prepare(path, _loader(path, encoding))
+                items = len(arg) if isinstance(arg, list) else rows
+
+                seconds, peak = _measure(fn, arg, repeat, memory)
+                result = {
+                    'function':     name,
+                    'kind':         kind,
+                    'rows':         rows,
+                    'items':        items,
+                    'encoding':     encoding,
+                    'seconds':      round(seconds, 6),
+                    'items_per_sec': round(items / seconds, 1) if seconds else None,
+                    'peak_bytes':   peak,
+                }
+                results.append(result)
+                print(f"[{datetime.now()}] {name} rows={rows} {encoding}: "
+                      f"{seconds:.3f}秒 ({result['items_per_sec']}件/秒)"
+                      + (f" ピークメモリ {peak / 1024 / 1024:.1f}MB" if peak is not None else ""))
+    return results
+
+
+# ============================================================
+#  比較
+# ============================================================
+
+def _key(result):
+    return (result['function'], result['rows'], result['encoding'])
+
+
+def compare(results, baseline, max_regression):
+    """ベースラインより max_regression 以上遅い（またはメモリが多い）結果を返す"""
+    base = {_key(r): r for r in baseline['results']}
+    regressions = []
+
+    print(f"[{datetime.now()}] ベースラインとの比較:")
+    for result in results:
+        old = base.get(_key(result))
+        if old is None:
+            continue
+        time_ratio = result['seconds'] / old['seconds'] if old['seconds'] else 1.0
+        line = f"  - {result['function']} rows={result['rows']} {result['encoding']}: 時間 {time_ratio - 1:+.1%}"
+        mem_ratio = None
+        if result.get('peak_bytes') and old.get('peak_bytes'):
+            mem_ratio = result['peak_bytes'] / old['peak_bytes']
+            line += f" / メモリ {mem_ratio - 1:+.1%}"
+        print(line)
+        if time_ratio > 1 + max_regression or (mem_ratio and mem_ratio > 1 + max_regression):
+            regressions.append(result)
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _parse_site_mix(value):
+    """'Fast Baito 看護特化=0.5,GAMES VERSE=0.5' → dict"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.rpartition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="変換処理のベンチマーク")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--encodings', nargs='+', default=['shift_jis', 'utf-8'])
+    parser.add_argument('--site-mix', type=_parse_site_mix, default=synthetic_presco.DEFAULT_SITE_MIX,
+                        help="サイト名=比率 をカンマ区切りで指定")
+    parser.add_argument('--gclid-rate', type=float, default=synthetic_presco.DEFAULT_GCLID_RATE)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="ピークメモリを計測しない")
+    parser.add_argument('--only', nargs='+', help="関数名に含まれる文字列で対象を絞る")
+    parser.add_argument('--data-dir', default='/tmp/presco_bench')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="結果を保存するJSONファイル")
+    parser.add_argument('--baseline', help="比較するJSONファイル")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(
+        args.sizes, args.encodings, args.site_mix, args.gclid_rate, args.data_dir,
+        repeat=args.repeat, memory=not args.no_memory, only=args.only, seed=args.seed,
+    )
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git':        _git_revision(),
+            'python':     platform.python_version(),
+            'platform':   platform.platform(),
+            'site_mix':   args.site_mix,
+            'gclid_rate': args.gclid_rate,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[{datetime.now()}] 結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"[{datetime.now()}] {len(regressions)}件の性能劣化が見つかりました（許容 {args.max_regression:.0%}）")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# checkpoints.py
+# パイプラインの各ステージ（download → parse → transform → publish）の結果を保存し、
+# 失敗後の再実行で完了済みのステージを飛ばす
+#
+#   run = checkpoints.open_run('presco_kango', args, date_from=DATE_FROM, date_to=date_to)
+#   csv_path = run.stage('download', login_and_download_csv, kind='file')
+#   data     = run.stage('parse', read_csv, csv_path)
+#   values   = run.stage('transform', extract_columns, data)
+#   run.stage('publish', sheets_publisher.publish, worksheet, values, kind='marker')
+#   run.complete()
+#
+# チェックポイントはパイプライン名とレポート条件（期間など）ごとに保存する。
+# 保存から CHECKPOINT_TTL 以上経ったもの、または前のステージを実行し直した後のものは使わない。
+# 全ステージが完了したら削除する（次回の定期実行は最初から行う）。
+
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime, timedelta
+
+import run_metrics
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+CHECKPOINT_DIR = os.environ.get('PRESCO_CHECKPOINT_DIR', '/tmp/presco_checkpoints')
+CHECKPOINT_TTL = timedelta(minutes=int(os.environ.get('PRESCO_CHECKPOINT_TTL_MINUTES', '60')))
+
+KINDS = ('json', 'file', 'marker')
+
+
+# ============================================================
+#  チェックポイント
+# ============================================================
+
+class Checkpoints:
+
+    def __init__(self, pipeline, params, ttl=CHECKPOINT_TTL, resume=True, base_dir=CHECKPOINT_DIR):
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+        self.pipeline    = pipeline
+        self.params      = params
+        self.ttl         = ttl
+        self.directory   = os.path.join(base_dir, f"{pipeline}_{digest}")
+        self.manifest    = self._load_manifest() if resume else {}
+        self._recomputed = False   # 一度でも実行し直したら、以降のチェックポイントは使わない
+        self._results    = {}      # 今回の実行で得た結果（同じステージを2回呼んでも1回で済ませる）
+
+    # ── マニフェスト ──
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('params') != self.params:
+            return {}
+        return manifest.get('stages', {})
+
+    def _save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'pipeline': self.pipeline, 'params': self.params, 'stages': self.manifest},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self._manifest_path)
+
+    def _fresh(self, name):
+        entry = self.manifest.get(name)
+        if entry is None or self._recomputed:
+            return None
+        saved_at = datetime.fromisoformat(entry['saved_at'])
+        if datetime.now() - saved_at > self.ttl:
+            return None
+        if entry['kind'] != 'marker' and not os.path.exists(os.path.join(self.directory, entry['file'])):
+            return None
+        return entry
+
+    def fresh(self, name):
+        """name のステージに、再開に使えるチェックポイントがあれば True"""
+        return self._fresh(name) is not None
+
+    # ── ステージ ──
+
+    def stage(self, name, fn, *args, kind='json', **kwargs):
+        """
+        ステージを実行して結果を保存する。新しいチェックポイントがあれば実行せずにそれを返す
+          kind='json'   : 戻り値をJSONで保存（CSVの行など）
+          kind='file'   : 戻り値のファイルパスのファイルをコピーして保存
+          kind='marker' : 完了したことだけを記録（publish など）
+        """
+        if kind not in KINDS:
+            raise Exception(f"不明なチェックポイント種別です: {kind}")
+        if name in self._results:
+            return self._results[name]
+
+        entry = self._fresh(name)
+        if entry is not None:
+            with run_metrics.span('resume', stage=name, saved_at=entry['saved_at']):
+                print(f"[{datetime.now()}] チェックポイントから再開します: {name}（{entry['saved_at']} に保存）")
+                result = self._results[name] = self._load(entry)
+                return result
+
+        self._recomputed = True
+        result = self._results[name] = fn(*args, **kwargs)
+        try:
+            self._save(name, kind, result)
+        except OSError as e:
+            # チェックポイントの保存失敗で同期処理自体を失敗させない
+            print(f"[{datetime.now()}] 警告: チェックポイントの保存に失敗しました（{name}） - {str(e)}")
+        return result
+
+    def _load(self, entry):
+        if entry['kind'] == 'marker':
+            return None
+        path = os.path.join(self.directory, entry['file'])
+        if entry['kind'] == 'file':
+            return path
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, name, kind, result):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = {'kind': kind, 'saved_at': datetime.now().isoformat(timespec='seconds')}
+
+        if kind == 'file':
+            entry['file'] = f"{name}{os.path.splitext(result)[1]}"
+            tmp = os.path.join(self.directory, entry['file'] + '.tmp')
+            shutil.copyfile(result, tmp)
+            os.replace(tmp, os.path.join(self.directory, entry['file']))
+        elif kind == 'json':
+            entry['file'] = f"{name}.json"
+            tmp = os.path.join(self.directory, entry['file'] + '.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.directory, entry['file']))
+
+        self.manifest[name] = entry
+        self._save_manifest()
+
+    def complete(self):
+        """全ステージが完了したのでチェックポイントを削除する"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class NoCheckpoints:
+    """チェックポイントを使わない場合（関数を単体で呼んだとき、--from-csv のときなど）"""
+    params = {}
+
+    def fresh(self, name):
+        return False
+
+    def stage(self, name, fn, *args, kind='json', **kwargs):
+        return fn(*args, **kwargs)
+
+    def complete(self):
+        pass
+
+
+NONE = NoCheckpoints()
+
+
+# ============================================================
+#  コマンドライン引数
+# ============================================================
+
+def add_arguments(parser):
+    """各スクリプトの argparse に --no-resume / --checkpoint-ttl を追加する"""
+    parser.add_argument('--no-resume', action='store_true',
+                        help="チェックポイントを使わず最初から実行する")
+    parser.add_argument('--checkpoint-ttl', type=int, metavar='MINUTES',
+                        default=int(CHECKPOINT_TTL.total_seconds() // 60),
+                        help="この分数以内に保存されたチェックポイントから再開する")
+
+
+def open_run(pipeline, args, **params):
+    """args（add_arguments で追加した引数）に従って Checkpoints を作る"""
+    return Checkpoints(pipeline, params, ttl=timedelta(minutes=args.checkpoint_ttl),
+                       resume=not args.no_resume)
@@ -0,0 +1,214 @@
+# daily_rollup.py
+# 成果（actionLog）の日別・サイト別・成果地点別の集計表を、実行ごとに差分だけで更新する
+#
+# ダッシュボードが開くたびに生データ全体から日別の件数・成果報酬（row[17]）を集計し直していたため、
+# 集計済みの表をここで持ち、各実行では新しく来た行・内容が変わった行の分だけを足し引きする。
+#   ・成果IDごとに「どの日・サイト・成果地点にいくら計上したか」を覚えておく
+#     → 期間が重なって同じ行が何度来ても二重に数えない（内容が同じ行は何もしない）
+#     → ステータスや報酬が変わった行は、前回の計上を取り消してから計上し直す
+#   ・集計表は小さい（日数 × サイト数 × 成果地点数）ので、そのままシートに出力する
+#
+#   python daily_rollup.py --site "Fast Baito 看護特化"
+#   python daily_rollup.py --load /tmp/presco_data_20250101_120000.csv
+
+import os
+import csv
+import sys
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime
+
+import sheets_client
+import sheets_publisher
+import query_store
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+# 検索用DB（query_store.py）と同じファイルに表を作る
+ROLLUP_PATH = os.environ.get('PRESCO_ROLLUP_PATH', query_store.STORE_PATH)
+
+ACTION_ID = 0    # A列: 成果ID
+ACTION_AT = 3    # D列: 成果発生日時
+SITE      = 5    # F列: サイト名
+POINT     = 8    # I列: 成果地点
+REWARD    = 17   # R列: 成果報酬
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rollup_daily (
+        day         TEXT NOT NULL,
+        site_name   TEXT NOT NULL,
+        point       TEXT NOT NULL,
+        conversions INTEGER NOT NULL,
+        reward      INTEGER NOT NULL,
+        updated_at  TEXT NOT NULL,
+        PRIMARY KEY (day, site_name, point)
+    );
+    CREATE TABLE IF NOT EXISTS rollup_rows (
+        action_id TEXT PRIMARY KEY,
+        day       TEXT NOT NULL,
+        site_name TEXT NOT NULL,
+        point     TEXT NOT NULL,
+        reward    INTEGER NOT NULL
+    );
+"""
+
+HEADER = ['日付', 'サイト名', '成果地点', '成果件数', '成果報酬合計']
+
+
+# ============================================================
+#  行 → 計上内容
+# ============================================================
+
+def _contribution(row):
+    """(成果ID, 日付, サイト名, 成果地点, 成果報酬)。集計できない行は None"""
+    if len(row) <= REWARD:
+        return None
+    try:
+        day = datetime.strptime(row[ACTION_AT].strip(), '%Y/%m/%d %H:%M:%S').strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+    try:
+        reward = int(float(row[REWARD]))
+    except (ValueError, TypeError):
+        reward = 0
+    action_id = row[ACTION_ID].strip() or 'sha1:' + hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest()[:16]
+    return action_id, day, row[SITE].strip(), row[POINT].strip(), reward
+
+
+# ============================================================
+#  集計表
+# ============================================================
+
+class Rollup:
+
+    def __init__(self, path=ROLLUP_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, rows):
+        """
+        CSVの行（先頭行はヘッダー）で集計表を更新し、計上し直した行数を返す
+        すでに同じ内容で計上済みの行は読み飛ばす
+        """
+        incoming = {}
+        for row in rows[1:]:
+            contribution = _contribution(row)
+            if contribution is not None:
+                incoming[contribution[0]] = contribution
+
+        with self._db:
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS incoming (action_id TEXT PRIMARY KEY)")
+            self._db.execute("DELETE FROM incoming")
+            self._db.executemany("INSERT INTO incoming VALUES (?)", [(key,) for key in incoming])
+            previous = {
+                row[0]: row for row in self._db.execute(
+                    "SELECT r.action_id, r.day, r.site_name, r.point, r.reward "
+                    "FROM rollup_rows r JOIN incoming USING (action_id)")
+            }
+
+            deltas  = {}
+            changed = []
+            for key, contribution in incoming.items():
+                before = previous.get(key)
+                if before == contribution:
+                    continue
+                if before is not None:
+                    _add(deltas, before, -1)
+                _add(deltas, contribution, 1)
+                changed.append(contribution)
+
+            now = datetime.now().isoformat(timespec='seconds')
+            self._db.executemany(
+                "INSERT INTO rollup_daily (day, site_name, point, conversions, reward, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (day, site_name, point) DO UPDATE SET "
+                "conversions = conversions + excluded.conversions, reward = reward + excluded.reward, "
+                "updated_at = excluded.updated_at",
+                [(day, site, point, count, reward, now)
+                 for (day, site, point), (count, reward) in deltas.items() if count or reward])
+            self._db.execute("DELETE FROM rollup_daily WHERE conversions = 0 AND reward = 0")
+            self._db.executemany("INSERT OR REPLACE INTO rollup_rows VALUES (?, ?, ?, ?, ?)", changed)
+
+        print(f"[{datetime.now()}] 日別集計を更新しました: {len(incoming)}行中 {len(changed)}行を計上"
+              f"（集計表 {len(deltas)}行に反映）")
+        return len(changed)
+
+    def values(self, site=None, date_from=None):
+        """シートに出力する2次元リスト（ヘッダー + 日付の新しい順）"""
+        sql    = "SELECT day, site_name, point, conversions, reward FROM rollup_daily WHERE day >= ?"
+        params = [date_from or '']
+        if site:
+            sql += " AND site_name = ?"
+            params.append(site)
+        sql += " ORDER BY day DESC, site_name, point"
+        return [list(HEADER)] + [list(row) for row in self._db.execute(sql, params)]
+
+
+def _add(deltas, contribution, sign):
+    _, day, site, point, reward = contribution
+    count, total = deltas.get((day, site, point), (0, 0))
+    deltas[(day, site, point)] = (count + sign, total + sign * reward)
+
+
+# ============================================================
+#  各スクリプト用
+# ============================================================
+
+def add_arguments(parser):
+    parser.add_argument('--no-rollup', action='store_true',
+                        help="日別集計の更新とシートへの出力を行わない")
+
+
+def update_quietly(rows, path=ROLLUP_PATH):
+    """同期処理から呼ぶ用。集計の失敗で同期自体は失敗させない"""
+    try:
+        with Rollup(path) as rollup:
+            return rollup.update(rows)
+    except Exception as e:
+        print(f"[{datetime.now()}] 警告: 日別集計の更新に失敗しました - {str(e)}")
+        return 0
+
+
+def publish(spreadsheet_id, sheet_name, site, path=ROLLUP_PATH):
+    """site の集計表を sheet_name に出力する"""
+    with Rollup(path) as rollup:
+        values = rollup.values(site)
+    worksheet = sheets_client.open_worksheet(spreadsheet_id, sheet_name, rows=1000, cols=len(HEADER))
+    sheets_publisher.publish(worksheet, values)
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="日別集計表の確認")
+    parser.add_argument('--db', default=ROLLUP_PATH)
+    parser.add_argument('--site', help="サイト名で絞り込む")
+    parser.add_argument('--from', dest='date_from', help="YYYY-MM-DD")
+    parser.add_argument('--load', metavar='CSV', help="保存済みの成果CSVで集計表を更新する")
+    args = parser.parse_args()
+
+    with Rollup(args.db) as rollup:
+        if args.load:
+            rollup.update(query_store.read_csv(args.load))
+        csv.writer(sys.stdout).writerows(rollup.values(args.site, args.date_from))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# download_cache.py
+# ダウンロードしたCSVの内容ハッシュによる「変更なし」判定と、/tmp のCSVの整理
+#
+#   digest = download_cache.content_key(csv_path, run.params)
+#   if download_cache.unchanged('presco_kango', digest):
+#       ...  # 変換・書き込みを丸ごと省略
+#   ...
+#   download_cache.mark_published('presco_kango', digest)
+#
+# キーは「CSVの中身 + レポート条件」の sha256。前回シートに書き込んだときのキーと同じなら、
+# シートの内容も同じになるので変換と書き込みを行わない。
+# 状態は PRESCO_CACHE_DIR/published.json にパイプラインごとに保存する。
+
+import os
+import glob
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+import run_metrics
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+CACHE_DIR = os.environ.get('PRESCO_CACHE_DIR', '/tmp/presco_cache')
+
+# ダウンロードしたCSV（/tmp/presco_*.csv）の合計サイズの上限。超えたら古いものから削除する
+ARTIFACT_PATTERN = '/tmp/presco_*.csv'
+ARTIFACT_CAP     = int(os.environ.get('PRESCO_ARTIFACT_CAP_MB', '200')) * 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()   # published.json の読み書き（複数アカウントの並列実行用）
+
+
+# ============================================================
+#  内容ハッシュ
+# ============================================================
+
+def content_key(csv_path, params):
+    """CSVの中身（バイト列）とレポート条件からキーを作る"""
+    h = hashlib.sha256()
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    h.update(b'\0')
+    with open(csv_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _state_path():
+    return os.path.join(CACHE_DIR, 'published.json')
+
+
+def _load_state():
+    try:
+        with open(_state_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def unchanged(pipeline, key):
+    """前回シートに書き込んだときと同じ内容なら True"""
+    entry = _load_state().get(pipeline)
+    same  = entry is not None and entry.get('key') == key
+    run_metrics.set_attr('content_key', key[:12])
+    run_metrics.set_attr('unchanged', same)
+    if same:
+        print(f"[{datetime.now()}] 前回の書き込み（{entry['published_at']}）とCSVの内容が同じです")
+    return same
+
+
+def mark_published(pipeline, key):
+    """シートへの書き込みが完了したキーを記録する"""
+    with _lock:
+        state = _load_state()
+        state[pipeline] = {'key': key, 'published_at': datetime.now().isoformat(timespec='seconds')}
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = _state_path() + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, _state_path())
+        except OSError as e:
+            # 記録に失敗しても次回は書き込みを行うだけなので、同期処理は失敗させない
+            print(f"[{datetime.now()}] 警告: 書き込み済みキーの保存に失敗しました - {str(e)}")
+
+
+# ============================================================
+#  /tmp のCSVの整理
+# ============================================================
+
+def rotate_artifacts(keep=(), pattern=ARTIFACT_PATTERN, cap=ARTIFACT_CAP):
+    """
+    pattern に一致するファイルの合計が cap バイトを超えたら、更新日時の古いものから削除する
+    keep に含まれるパス（今回ダウンロードしたCSVなど）は削除しない
+    """
+    keep  = {os.path.abspath(p) for p in keep}
+    files = []
+    for path in glob.glob(pattern):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+
+    total   = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= cap:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total   -= size
+        removed += 1
+
+    if removed:
+        print(f"[{datetime.now()}] 古いCSVを {removed} 件削除しました（残り {total / 1024 / 1024:.1f}MB）")
+    return removed
+
+
+# ============================================================
+#  コマンドライン引数
+# ============================================================
+
+def add_arguments(parser):
+    """各スクリプトの argparse に --force-publish を追加する"""
+    parser.add_argument('--force-publish', action='store_true',
+                        help="CSVの内容が前回と同じでもシートに書き込む")
@@ -0,0 +1,684 @@
+# fake_sheets.py
+# オフライン検証用の Google Sheets 互換バックエンド（SQLite）
+#
+# gspread の Client / Spreadsheet / Worksheet のうち、このリポジトリで使う
+# worksheet / add_worksheet / clear / update / batch_update / append_rows
+# などを同じ意味で再現する。擬似的なAPI遅延と 429 エラーを注入できる。
+#
+# 使い方:
+#   SHEETS_BACKEND=fake                 メモリ上のSQLite
+#   SHEETS_BACKEND=sqlite:/tmp/sheets.db ファイルに保存（実行をまたいで中身を確認できる）
+#
+#   FAKE_SHEETS_LATENCY            API呼び出し1回あたりの遅延（秒）
+#   FAKE_SHEETS_LATENCY_PER_1K     1000セルあたりの追加遅延（秒）
+#   FAKE_SHEETS_ERROR_RATE         429 を返す確率（0〜1）
+#   FAKE_SHEETS_SEED               エラー注入の乱数シード
+#
+# アップロード方式のベンチマーク:
+#   python fake_sheets.py --rows 20000 --cols 20 --latency 0.3 --error-rate 0.05
+
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import argparse
+import threading
+
+try:
+    from gspread.exceptions import APIError, WorksheetNotFound
+except ImportError:
+    class APIError(Exception):
+        def __init__(self, response):
+            super().__init__(response.json()['error'])
+            self.response = response
+
+    class WorksheetNotFound(Exception):
+        pass
+
+
+# ============================================================
+#  エラー（gspread の APIError と同じ形で投げる）
+# ============================================================
+
+class FakeResponse:
+    def __init__(self, status_code, message, status):
+        self.status_code = status_code
+        self._body = {'error': {'code': status_code, 'message': message, 'status': status}}
+        self.text = json.dumps(self._body)
+
+    def json(self):
+        return self._body
+
+
+def _api_error(status_code, message, status='INVALID_ARGUMENT'):
+    return APIError(FakeResponse(status_code, message, status))
+
+
+# ============================================================
+#  A1表記
+# ============================================================
+
+_A1_RE = re.compile(r'^([A-Za-z]*)(\d*)$')
+
+
+def _a1_to_rowcol(label):
+    """'B3' → (2, 1)（0始まり）。列・行が省略された場合は 0"""
+    match = _A1_RE.match(label)
+    if not match:
+        raise _api_error(400, f"Unable to parse range: {label}")
+    letters, digits = match.groups()
+    col = 0
+    for ch in letters.upper():
+        col = col * 26 + (ord(ch) - ord('A') + 1)
+    return (int(digits) - 1 if digits else 0), (col - 1 if letters else 0)
+
+
+def _range_start(range_name):
+    if not range_name:
+        return 0, 0
+    if '!' in range_name:
+        range_name = range_name.rsplit('!', 1)[1]
+    return _a1_to_rowcol(range_name.split(':')[0])
+
+
+# ============================================================
+#  クライアント
+# ============================================================
+
+class FakeClient:
+    """gspread.Client の代わり。1つのSQLiteに複数のスプレッドシートを保存する"""
+
+    def __init__(self, path=':memory:', latency=0.0, latency_per_1k=0.0, error_rate=0.0, seed=None):
+        self.path           = path
+        self.latency        = latency
+        self.latency_per_1k = latency_per_1k
+        self.error_rate     = error_rate
+        self.auth           = None
+        self.calls          = []   # (API名, 対象シート名, 開始時刻, 終了時刻, 成功したか)
+        self.on_commit      = None # 成功した呼び出しの直後に呼ぶ関数 fn(対象シート名, 終了時刻)（ベンチマーク用）
+
+        self._random = random.Random(seed)
+        self._lock   = threading.RLock()
+        self._db     = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS spreadsheets (
+                id    TEXT PRIMARY KEY,
+                title TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sheets (
+                sheet_id       INTEGER PRIMARY KEY,
+                spreadsheet_id TEXT NOT NULL,
+                title          TEXT NOT NULL,
+                idx            INTEGER NOT NULL,
+                row_count      INTEGER NOT NULL,
+                col_count      INTEGER NOT NULL,
+                hidden         INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (spreadsheet_id, title)
+            );
+            CREATE TABLE IF NOT EXISTS cells (
+                sheet_id INTEGER NOT NULL,
+                r        INTEGER NOT NULL,
+                c        INTEGER NOT NULL,
+                v        TEXT NOT NULL,
+                PRIMARY KEY (sheet_id, r, c)
+            ) WITHOUT ROWID;
+        """)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """SHEETS_BACKEND の値（fake / fake:PATH / sqlite:PATH）からクライアントを作る"""
+        name, _, path = spec.partition(':')
+        if name not in ('fake', 'sqlite'):
+            raise Exception(f"不明なシートバックエンドです: {spec}")
+        seed = os.environ.get('FAKE_SHEETS_SEED')
+        return cls(
+            path=path or ':memory:',
+            latency=float(os.environ.get('FAKE_SHEETS_LATENCY', '0')),
+            latency_per_1k=float(os.environ.get('FAKE_SHEETS_LATENCY_PER_1K', '0')),
+            error_rate=float(os.environ.get('FAKE_SHEETS_ERROR_RATE', '0')),
+            seed=int(seed) if seed else None,
+        )
+
+    # ── API呼び出しの共通処理（遅延・429注入・トランザクション） ──
+
+    def _call(self, name, target, fn, cells=0):
+        started = time.perf_counter()
+        delay = self.latency + self.latency_per_1k * cells / 1000
+        if delay:
+            time.sleep(delay)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.calls.append((name, target, started, time.perf_counter(), False))
+            raise _api_error(429, "Quota exceeded for quota metric 'Write requests'", 'RESOURCE_EXHAUSTED')
+
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                result = fn()
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                self.calls.append((name, target, started, time.perf_counter(), False))
+                raise
+            self._db.execute('COMMIT')
+            ended = time.perf_counter()
+            if self.on_commit:
+                self.on_commit(target, ended)
+
+        self.calls.append((name, target, started, ended, True))
+        return result
+
+    def open_by_key(self, key):
+        def fn():
+            row = self._db.execute('SELECT title FROM spreadsheets WHERE id = ?', (key,)).fetchone()
+            if row is None:
+                self._db.execute('INSERT INTO spreadsheets (id, title) VALUES (?, ?)', (key, key))
+                self._add_sheet(key, 'Sheet1', 1000, 26)
+            return FakeSpreadsheet(self, key, row[0] if row else key)
+        return self._call('open_by_key', None, fn)
+
+    # ── 以下は _call の中から呼ぶ内部処理 ──
+
+    def _add_sheet(self, spreadsheet_id, title, rows, cols, index=None):
+        exists = self._db.execute(
+            'SELECT 1 FROM sheets WHERE spreadsheet_id = ? AND title = ?', (spreadsheet_id, title)
+        ).fetchone()
+        if exists:
+            raise _api_error(400, f'A sheet with the name "{title}" already exists.')
+        if index is None:
+            index = self._db.execute(
+                'SELECT COUNT(*) FROM sheets WHERE spreadsheet_id = ?', (spreadsheet_id,)
+            ).fetchone()[0]
+        sheet_id = self._db.execute('SELECT COALESCE(MAX(sheet_id), 0) + 1 FROM sheets').fetchone()[0]
+        self._db.execute(
+            'INSERT INTO sheets (sheet_id, spreadsheet_id, title, idx, row_count, col_count) VALUES (?, ?, ?, ?, ?, ?)',
+            (sheet_id, spreadsheet_id, title, index, rows, cols),
+        )
+        return self._properties(sheet_id)
+
+    def _properties(self, sheet_id):
+        row = self._db.execute(
+            'SELECT title, idx, row_count, col_count, hidden FROM sheets WHERE sheet_id = ?', (sheet_id,)
+        ).fetchone()
+        if row is None:
+            raise _api_error(400, f"No grid with id: {sheet_id}")
+        title, idx, rows, cols, hidden = row
+        return {
+            'sheetId':        sheet_id,
+            'title':          title,
+            'index':          idx,
+            'sheetType':      'GRID',
+            'hidden':         bool(hidden),
+            'gridProperties': {'rowCount': rows, 'columnCount': cols},
+        }
+
+    def _write(self, sheet_id, start_row, start_col, values, clear_blanks=True):
+        """values を (start_row, start_col) から書き込む。グリッド外ならエラー"""
+        props = self._properties(sheet_id)
+        grid  = props['gridProperties']
+        width = max((len(row) for row in values), default=0)
+        if start_row + len(values) > grid['rowCount'] or start_col + width > grid['columnCount']:
+            raise _api_error(
+                400,
+                f"Range ('{props['title']}') exceeds grid limits. "
+                f"Max rows: {grid['rowCount']}, max columns: {grid['columnCount']}",
+            )
+        upserts, deletes = [], []
+        for r, row in enumerate(values, start=start_row):
+            for c, value in enumerate(row, start=start_col):
+                if value is None or value == '':
+                    if clear_blanks:
+                        deletes.append((sheet_id, r, c))
+                else:
+                    upserts.append((sheet_id, r, c, str(value)))
+        if deletes:
+            self._db.executemany('DELETE FROM cells WHERE sheet_id = ? AND r = ? AND c = ?', deletes)
+        if upserts:
+            self._db.executemany('INSERT OR REPLACE INTO cells (sheet_id, r, c, v) VALUES (?, ?, ?, ?)', upserts)
+
+    def _clear_range(self, sheet_id, r0=0, r1=None, c0=0, c1=None):
+        sql, params = 'DELETE FROM cells WHERE sheet_id = ? AND r >= ? AND c >= ?', [sheet_id, r0, c0]
+        if r1 is not None:
+            sql += ' AND r < ?'
+            params.append(r1)
+        if c1 is not None:
+            sql += ' AND c < ?'
+            params.append(c1)
+        self._db.execute(sql, params)
+
+    def _values(self, sheet_id):
+        cells = self._db.execute('SELECT r, c, v FROM cells WHERE sheet_id = ?', (sheet_id,)).fetchall()
+        if not cells:
+            return []
+        height = max(r for r, _, _ in cells) + 1
+        width  = max(c for _, c, _ in cells) + 1
+        grid   = [[''] * width for _ in range(height)]
+        for r, c, v in cells:
+            grid[r][c] = v
+        return grid
+
+    def _resize(self, sheet_id, rows=None, cols=None):
+        if rows is not None:
+            if rows < 1:
+                raise _api_error(400, "Invalid requests: rowCount must be at least 1")
+            self._db.execute('UPDATE sheets SET row_count = ? WHERE sheet_id = ?', (rows, sheet_id))
+            self._db.execute('DELETE FROM cells WHERE sheet_id = ? AND r >= ?', (sheet_id, rows))
+        if cols is not None:
+            if cols < 1:
+                raise _api_error(400, "Invalid requests: columnCount must be at least 1")
+            self._db.execute('UPDATE sheets SET col_count = ? WHERE sheet_id = ?', (cols, sheet_id))
+            self._db.execute('DELETE FROM cells WHERE sheet_id = ? AND c >= ?', (sheet_id, cols))
+
+
+# ============================================================
+#  スプレッドシート
+# ============================================================
+
+class FakeSpreadsheet:
+
+    def __init__(self, client, spreadsheet_id, title):
+        self.client = client
+        self.id     = spreadsheet_id
+        self.title  = title
+
+    def __repr__(self):
+        return f"<FakeSpreadsheet {self.title!r} id:{self.id}>"
+
+    def worksheets(self, exclude_hidden=False):
+        def fn():
+            ids = self.client._db.execute(
+                'SELECT sheet_id FROM sheets WHERE spreadsheet_id = ? ORDER BY idx', (self.id,)
+            ).fetchall()
+            return [FakeWorksheet(self, self.client._properties(i)) for (i,) in ids]
+        sheets = self.client._call('fetch_sheet_metadata', None, fn)
+        return [ws for ws in sheets if not (exclude_hidden and ws.isSheetHidden)]
+
+    def worksheet(self, title):
+        def fn():
+            row = self.client._db.execute(
+                'SELECT sheet_id FROM sheets WHERE spreadsheet_id = ? AND title = ?', (self.id, title)
+            ).fetchone()
+            return FakeWorksheet(self, self.client._properties(row[0])) if row else None
+        # gspread と同じく、メタデータの取得自体は成功してクライアント側で WorksheetNotFound を投げる
+        worksheet = self.client._call('fetch_sheet_metadata', title, fn)
+        if worksheet is None:
+            raise WorksheetNotFound(title)
+        return worksheet
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        fn = lambda: FakeWorksheet(self, self.client._add_sheet(self.id, title, rows, cols, index))
+        return self.client._call('batch_update', title, fn)
+
+    def del_worksheet(self, worksheet):
+        return self.batch_update({'requests': [{'deleteSheet': {'sheetId': worksheet.id}}]})
+
+    def batch_update(self, body):
+        """spreadsheets.batchUpdate（全リクエストを1トランザクションで適用）"""
+        requests = body.get('requests', [])
+        cells    = sum(
+            len(row.get('values', []))
+            for req in requests
+            for row in req.get('updateCells', {}).get('rows', [])
+        )
+        targets = sorted({self._request_target(req) for req in requests} - {None})
+        fn = lambda: {'spreadsheetId': self.id, 'replies': [self._apply(req) for req in requests]}
+        return self.client._call('batch_update', ','.join(targets) or None, fn, cells=cells)
+
+    def _request_target(self, req):
+        (kind, params), = req.items()
+        sheet_id = (
+            params.get('sheetId')
+            or params.get('properties', {}).get('sheetId')
+            or params.get('range', {}).get('sheetId')
+            or params.get('start', {}).get('sheetId')
+            or params.get('destination', {}).get('sheetId')
+        )
+        if sheet_id is None:
+            return params.get('properties', {}).get('title')
+        row = self.client._db.execute('SELECT title FROM sheets WHERE sheet_id = ?', (sheet_id,)).fetchone()
+        return row[0] if row else None
+
+    def _apply(self, req):
+        client = self.client
+        (kind, params), = req.items()
+
+        if kind == 'addSheet':
+            props = params.get('properties', {})
+            grid  = props.get('gridProperties', {})
+            added = client._add_sheet(
+                self.id, props['title'], grid.get('rowCount', 1000), grid.get('columnCount', 26), props.get('index')
+            )
+            return {'addSheet': {'properties': added}}
+
+        if kind == 'deleteSheet':
+            client._properties(params['sheetId'])
+            client._db.execute('DELETE FROM cells WHERE sheet_id = ?', (params['sheetId'],))
+            client._db.execute('DELETE FROM sheets WHERE sheet_id = ?', (params['sheetId'],))
+            return {}
+
+        if kind == 'updateSheetProperties':
+            props    = params['properties']
+            sheet_id = props['sheetId']
+            fields   = [f.strip().replace('/', '.') for f in params['fields'].split(',')]
+            grid     = props.get('gridProperties', {})
+            client._properties(sheet_id)
+            client._resize(
+                sheet_id,
+                rows=grid['rowCount'] if 'gridProperties.rowCount' in fields else None,
+                cols=grid['columnCount'] if 'gridProperties.columnCount' in fields else None,
+            )
+            if 'hidden' in fields:
+                client._db.execute('UPDATE sheets SET hidden = ? WHERE sheet_id = ?', (int(props['hidden']), sheet_id))
+            if 'title' in fields:
+                client._db.execute('UPDATE sheets SET title = ? WHERE sheet_id = ?', (props['title'], sheet_id))
+            if 'index' in fields:
+                client._db.execute('UPDATE sheets SET idx = ? WHERE sheet_id = ?', (props['index'], sheet_id))
+            return {}
+
+        if kind == 'appendDimension':
+            grid = client._properties(params['sheetId'])['gridProperties']
+            if params['dimension'] == 'ROWS':
+                client._resize(params['sheetId'], rows=grid['rowCount'] + params['length'])
+            else:
+                client._resize(params['sheetId'], cols=grid['columnCount'] + params['length'])
+            return {}
+
+        if kind == 'deleteDimension':
+            rng      = params['range']
+            sheet_id = rng['sheetId']
+            start, end = rng['startIndex'], rng['endIndex']
+            grid = client._properties(sheet_id)['gridProperties']
+            axis = 'r' if rng['dimension'] == 'ROWS' else 'c'
+            client._db.execute(f'DELETE FROM cells WHERE sheet_id = ? AND {axis} >= ? AND {axis} < ?', (sheet_id, start, end))
+            client._db.execute(f'UPDATE cells SET {axis} = {axis} - ? WHERE sheet_id = ? AND {axis} >= ?', (end - start, sheet_id, end))
+            if axis == 'r':
+                client._resize(sheet_id, rows=grid['rowCount'] - (end - start))
+            else:
+                client._resize(sheet_id, cols=grid['columnCount'] - (end - start))
+            return {}
+
+        if kind == 'updateCells':
+            fields = params.get('fields', '')
+            if fields not in ('*', 'userEnteredValue') and 'userEnteredValue' not in fields.split(','):
+                return {}
+            values = [
+                [_cell_text(cell) for cell in row.get('values', [])]
+                for row in params.get('rows', [])
+            ]
+            if 'range' in params:
+                rng = params['range']
+                sheet_id = rng['sheetId']
+                r0, c0 = rng.get('startRowIndex', 0), rng.get('startColumnIndex', 0)
+                client._clear_range(sheet_id, r0, rng.get('endRowIndex'), c0, rng.get('endColumnIndex'))
+            else:
+                start = params['start']
+                sheet_id = start['sheetId']
+                r0, c0 = start.get('rowIndex', 0), start.get('columnIndex', 0)
+            client._write(sheet_id, r0, c0, values)
+            return {}
+
+        if kind == 'copyPaste':
+            src, dst = params['source'], params['destination']
+            r0, r1 = src.get('startRowIndex', 0), src.get('endRowIndex')
+            c0, c1 = src.get('startColumnIndex', 0), src.get('endColumnIndex')
+            src_grid = client._properties(src['sheetId'])['gridProperties']
+            r1 = src_grid['rowCount'] if r1 is None else r1
+            c1 = src_grid['columnCount'] if c1 is None else c1
+            block = [[''] * (c1 - c0) for _ in range(r1 - r0)]
+            for r, c, v in client._db.execute(
+                'SELECT r, c, v FROM cells WHERE sheet_id = ? AND r >= ? AND r < ? AND c >= ? AND c < ?',
+                (src['sheetId'], r0, r1, c0, c1),
+            ):
+                block[r - r0][c - c0] = v
+            client._write(dst['sheetId'], dst.get('startRowIndex', 0), dst.get('startColumnIndex', 0), block)
+            return {}
+
+        raise _api_error(400, f"Unsupported request in fake backend: {kind}")
+
+
+def _cell_text(cell):
+    value = cell.get('userEnteredValue')
+    if not value:
+        return ''
+    (kind, v), = value.items()
+    if kind == 'boolValue':
+        return 'TRUE' if v else 'FALSE'
+    return str(v)
+
+
+# ============================================================
+#  ワークシート
+# ============================================================
+
+class FakeWorksheet:
+    """gspread.Worksheet と同じく、プロパティは取得時点のスナップショットを持つ"""
+
+    def __init__(self, spreadsheet, properties):
+        self.spreadsheet = spreadsheet
+        self.client      = spreadsheet.client
+        self._properties = properties
+
+    def __repr__(self):
+        return f"<FakeWorksheet {self.title!r} id:{self.id}>"
+
+    @property
+    def id(self):
+        return self._properties['sheetId']
+
+    @property
+    def title(self):
+        return self._properties['title']
+
+    @property
+    def index(self):
+        return self._properties['index']
+
+    @property
+    def isSheetHidden(self):
+        return self._properties.get('hidden', False)
+
+    @property
+    def row_count(self):
+        return self._properties['gridProperties']['rowCount']
+
+    @property
+    def col_count(self):
+        return self._properties['gridProperties']['columnCount']
+
+    def get_all_values(self, **kwargs):
+        return self.client._call('values_get', self.title, lambda: self.client._values(self.id))
+
+    def clear(self):
+        fn = lambda: self.client._clear_range(self.id)
+        return self.client._call('values_clear', self.title, fn)
+
+    def update(self, range_name=None, values=None, **kwargs):
+        # gspread と同じく update(values, range_name) の旧い引数順も受け付ける
+        if isinstance(range_name, list):
+            range_name, values = values, range_name
+        r0, c0 = _range_start(range_name)
+        values = values or []
+        cells  = sum(len(row) for row in values)
+
+        def fn():
+            self.client._write(self.id, r0, c0, values, clear_blanks=True)
+            return {'updatedRows': len(values), 'updatedCells': cells}
+        return self.client._call('values_update', self.title, fn, cells=cells)
+
+    def batch_update(self, data, **kwargs):
+        """values.batchUpdate（複数レンジへの書き込みを1回で）"""
+        cells = sum(len(row) for item in data for row in item['values'])
+
+        def fn():
+            for item in data:
+                r0, c0 = _range_start(item['range'])
+                self.client._write(self.id, r0, c0, item['values'])
+            return {'totalUpdatedCells': cells}
+        return self.client._call('values_batch_update', self.title, fn, cells=cells)
+
+    def append_rows(self, values, value_input_option='RAW', insert_data_option=None,
+                    table_range=None, include_values_in_response=False):
+        """表の最終行の後ろに追記する（グリッドが足りなければ広げる）"""
+        cells = sum(len(row) for row in values)
+
+        def fn():
+            client = self.client
+            last   = client._db.execute('SELECT MAX(r) FROM cells WHERE sheet_id = ?', (self.id,)).fetchone()[0]
+            start  = 0 if last is None else last + 1
+            grid   = client._properties(self.id)['gridProperties']
+            width  = max((len(row) for row in values), default=0)
+            client._resize(
+                self.id,
+                rows=max(grid['rowCount'], start + len(values)),
+                cols=max(grid['columnCount'], width),
+            )
+            client._write(self.id, start, 0, values)
+            self._properties['gridProperties'] = client._properties(self.id)['gridProperties']
+            return {'updates': {'updatedRows': len(values), 'updatedCells': cells}}
+        return self.client._call('values_append', self.title, fn, cells=cells)
+
+    def resize(self, rows=None, cols=None):
+        fn = lambda: self.client._resize(self.id, rows=rows, cols=cols)
+        result = self.client._call('batch_update', self.title, fn)
+        if rows is not None:
+            self._properties['gridProperties']['rowCount'] = rows
+        if cols is not None:
+            self._properties['gridProperties']['columnCount'] = cols
+        return result
+
+    def update_title(self, title):
+        fn = lambda: self.client._db.execute('UPDATE sheets SET title = ? WHERE sheet_id = ?', (title, self.id))
+        result = self.client._call('batch_update', self.title, fn)
+        self._properties['title'] = title
+        return result
+
+    def hide(self):
+        return self._set_hidden(True)
+
+    def show(self):
+        return self._set_hidden(False)
+
+    def _set_hidden(self, hidden):
+        fn = lambda: self.client._db.execute('UPDATE sheets SET hidden = ? WHERE sheet_id = ?', (int(hidden), self.id))
+        result = self.client._call('batch_update', self.title, fn)
+        self._properties['hidden'] = hidden
+        return result
+
+
+# ============================================================
+#  ベンチマーク
+# ============================================================
+
+def _synthetic_values(rows, cols, seed=0):
+    rng = random.Random(seed)
+    header = [f"列{c + 1}" for c in range(cols)]
+    return [header] + [
+        [f"{rng.randrange(10 ** 8):08d}" for _ in range(cols)]
+        for _ in range(rows - 1)
+    ]
+
+
+class _ContentWatch:
+    """
+    公開先シートの中身が、前回の値でも新しい値でもない（空・書き換え途中の）時間を測る
+    書き込みのたびに中身を読んで比べる。比べるのにかかった時間は結果から差し引く
+    """
+
+    def __init__(self, client, worksheet, old_values, new_values):
+        self.client     = client
+        self.worksheet  = worksheet
+        self.old_values = old_values
+        self.new_values = new_values
+        self.overhead   = 0.0    # 中身の読み取り・比較にかかった時間
+        self.broken_at  = None   # 読み手に壊れた中身が見え始めた時刻（overhead を差し引いた時刻）
+        self.downtime   = 0.0
+
+    def __call__(self, target, ended):
+        if not target or self.worksheet.title not in target.split(','):
+            return
+        started = time.perf_counter()
+        current = self.client._values(self.worksheet.id)
+        at      = ended - self.overhead
+        if current in (self.old_values, self.new_values):
+            if self.broken_at is not None:
+                self.downtime += at - self.broken_at
+                self.broken_at = None
+        elif self.broken_at is None:
+            self.broken_at = at
+        self.overhead += time.perf_counter() - started
+
+    def finish(self, ended):
+        """publish() の終了時刻（overhead を差し引く前）。壊れたまま終わった時間も含める"""
+        if self.broken_at is not None:
+            self.downtime += ended - self.overhead - self.broken_at
+            self.broken_at = None
+        return self.downtime
+
+
+def benchmark(strategies, rows, cols, runs=1, **client_options):
+    import sheets_client
+    import sheets_publisher
+    # python fake_sheets.py で実行した場合も sheets_client と同じ例外クラスを使うため import し直す
+    from fake_sheets import FakeClient
+
+    values  = _synthetic_values(rows, cols)
+    results = []
+    for strategy in strategies:
+        for run in range(runs):
+            # 準備中はエラーを注入しない
+            client = FakeClient(**dict(client_options, error_rate=0.0))
+            sheets_client.set_backend(client)
+            worksheet = sheets_client.open_worksheet('benchmark', 'Presco_bench', rows=1000, cols=10)
+            # 前回分のデータが残っている状態から上書きする
+            worksheet.update(values=[['old'] * 10] * 1000, range_name='A1')
+            client.error_rate = client_options.get('error_rate', 0.0)
+            client.calls.clear()
+            watch = _ContentWatch(client, worksheet, client._values(worksheet.id), values)
+            client.on_commit = watch
+
+            started = time.perf_counter()
+            sheets_publisher.publish(worksheet, values, strategy=strategy)
+            ended   = time.perf_counter()
+            client.on_commit = None
+            downtime = watch.finish(ended)
+            elapsed  = ended - started - watch.overhead
+
+            assert client._values(worksheet.id) == values, "書き込み結果が一致しません"
+            results.append({
+                'strategy':        strategy,
+                'run':             run,
+                'rows':            rows,
+                'cols':            cols,
+                'seconds':         round(elapsed, 4),
+                'api_calls':       len(client.calls),
+                'failed_calls':    sum(1 for call in client.calls if not call[4]),
+                'visible_downtime': round(downtime, 4),
+            })
+    sheets_client.set_backend(None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フェイクSheetsでアップロード方式をベンチマークする")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--cols', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--strategies', nargs='+', default=['direct', 'staged'])
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-per-1k', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = benchmark(
+        args.strategies, args.rows, args.cols, runs=args.runs,
+        latency=args.latency, latency_per_1k=args.latency_per_1k,
+        error_rate=args.error_rate, seed=args.seed,
+    )
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
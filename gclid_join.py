@@ -0,0 +1,289 @@
+# gclid_join.py
+# クリックログの gclid と成果（actionLog）の gclid を突合するレポート
+#
+# presco_kango_cv.py はクリックログのK列から、sync_presco.py は成果のリファラ（row[12]）から
+# gclid を取り出しているが、両者をつなぐ処理がなく、クリック→成果率や成果までの時間は
+# シートの VLOOKUP で出していた。ここではクリック側で gclid のハッシュ表を作り、
+# 成果を1行ずつ流して突合する（どちらの件数にも比例する時間で終わる）。
+#
+# 出力（シート）:
+#   gclid突合_集計   : 件数・クリック→成果率・成果までの時間の分布（全体とサイト別）
+#   gclid突合_一致   : 突合できた成果とクリックの組
+#   gclid突合_未一致 : 成果のないクリック・クリックのない成果
+#
+# 入力は query_store.py の検索用DB（各同期で取り込み済みのもの）。CSVを直接渡すこともできる。
+#
+#   python gclid_join.py --from 2025-01-01 --to 2025-01-31
+#   python gclid_join.py --clicks-csv clicks.csv --actions-csv actions.csv --dry-run
+
+import os
+import bisect
+import argparse
+from datetime import datetime, timedelta
+from collections import namedtuple
+
+import sheets_client
+import sheets_publisher
+import run_metrics
+import local_output
+import query_store
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+# presco_kango_cv.py と同じブックに出力する
+SPREADSHEET_ID = os.environ.get('GCLID_JOIN_SPREADSHEET_ID', '1x7xkMomtb81GXqd5XF0b3_q59BuOSoHypTyyLqFWKow')
+SUMMARY_SHEET   = 'gclid突合_集計'
+PAIRS_SHEET     = 'gclid突合_一致'
+UNMATCHED_SHEET = 'gclid突合_未一致'
+
+# 成果までの時間の分布の区切り（この時間未満, 表示名）
+LATENCY_BUCKETS = [
+    (timedelta(minutes=1),  '1分未満'),
+    (timedelta(minutes=10), '1〜10分'),
+    (timedelta(hours=1),    '10分〜1時間'),
+    (timedelta(hours=6),    '1〜6時間'),
+    (timedelta(days=1),     '6〜24時間'),
+    (timedelta(days=3),     '1〜3日'),
+    (timedelta(days=7),     '3〜7日'),
+    (None,                  '7日以上'),
+]
+NEGATIVE_BUCKET = 'クリックより前'   # 成果日時がクリック日時より前（集計期間のずれなど）
+UNKNOWN_BUCKET  = '日時不明'
+
+Click      = namedtuple('Click', ['click_id', 'gclid', 'clicked_at', 'site_name'])
+Conversion = namedtuple('Conversion', ['action_id', 'gclid', 'action_at', 'site_name', 'reward'])
+
+
+# ============================================================
+#  突合
+# ============================================================
+
+def _parse(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except (ValueError, TypeError):
+        return None
+
+
+def latency_bucket(latency):
+    if latency is None:
+        return UNKNOWN_BUCKET
+    if latency < timedelta(0):
+        return NEGATIVE_BUCKET
+    for upper, label in LATENCY_BUCKETS:
+        if upper is None or latency < upper:
+            return label
+
+
+class JoinResult:
+
+    def __init__(self):
+        self.clicks           = 0
+        self.conversions      = 0
+        self.pairs            = []   # (Click, Conversion, 成果までの時間)
+        self.unmatched_clicks = []
+        self.orphans          = []   # クリックのない成果
+        self.histograms       = {}   # サイト名（全体は ''） → {区分: 件数}
+
+    def _count(self, site_name, bucket):
+        for key in ('', site_name):
+            histogram = self.histograms.setdefault(key, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    @property
+    def matched_gclids(self):
+        return len({conversion.gclid for _, conversion, _ in self.pairs})
+
+
+def join(clicks, conversions):
+    """
+    clicks でハッシュ表を作り、conversions を1件ずつ流して突合する
+    同じ gclid のクリックが複数あるときは、成果日時以前で最も新しいクリックと組にする
+    （成果より前のクリックがなければ最も古いクリック）
+    """
+    result = JoinResult()
+
+    # ── ビルド: gclid → 日時順のクリック ──
+    with run_metrics.span('build') as s:
+        index = {}
+        for row in clicks:
+            click = Click(*row)
+            index.setdefault(click.gclid, []).append(click)
+            result.clicks += 1
+        times = {}
+        for gclid, group in index.items():
+            group.sort(key=lambda c: c.clicked_at)
+            times[gclid] = [c.clicked_at for c in group]
+        s.set('clicks', result.clicks)
+        s.set('gclids', len(index))
+
+    # ── プローブ: 成果を1件ずつ流す ──
+    with run_metrics.span('probe') as s:
+        converted = set()
+        for row in conversions:
+            conversion = Conversion(*row)
+            result.conversions += 1
+            group = index.get(conversion.gclid)
+            if group is None:
+                result.orphans.append(conversion)
+                continue
+
+            position = bisect.bisect_right(times[conversion.gclid], conversion.action_at)
+            click    = group[position - 1] if position else group[0]
+            clicked, acted = _parse(click.clicked_at), _parse(conversion.action_at)
+            latency  = acted - clicked if clicked and acted else None
+
+            result.pairs.append((click, conversion, latency))
+            result._count(conversion.site_name, latency_bucket(latency))
+            converted.add(conversion.gclid)
+
+        result.unmatched_clicks = [click for gclid, group in index.items()
+                                   if gclid not in converted for click in group]
+        s.set('conversions', result.conversions)
+        s.set('pairs', len(result.pairs))
+        s.set('orphans', len(result.orphans))
+        s.set('unmatched_clicks', len(result.unmatched_clicks))
+
+    return result
+
+
+# ============================================================
+#  レポート
+# ============================================================
+
+def _minutes(latency):
+    return '' if latency is None else round(latency.total_seconds() / 60, 1)
+
+
+def summary_values(result, date_from=None, date_to=None):
+    clicked_gclids = result.matched_gclids + len({c.gclid for c in result.unmatched_clicks})
+    rate = result.matched_gclids / clicked_gclids * 100 if clicked_gclids else 0
+
+    values = [
+        ['gclid突合レポート', f"作成日時: {datetime.now().strftime('%Y/%m/%d %H:%M:%S')}",
+         f"期間: {date_from or '指定なし'} 〜 {date_to or '指定なし'}"],
+        [],
+        ['項目', '件数'],
+        ['クリック（gclidあり）', result.clicks],
+        ['成果（gclidあり）', result.conversions],
+        ['突合できた成果', len(result.pairs)],
+        ['成果のないクリック', len(result.unmatched_clicks)],
+        ['クリックのない成果', len(result.orphans)],
+        ['クリック→成果率（gclid単位）', f"{rate:.2f}%"],
+        [],
+    ]
+
+    sites   = sorted(site for site in result.histograms if site)
+    buckets = [label for _, label in LATENCY_BUCKETS] + [NEGATIVE_BUCKET, UNKNOWN_BUCKET]
+    values.append(['成果までの時間', '全体'] + sites)
+    for bucket in buckets:
+        counts = [result.histograms.get(site, {}).get(bucket, 0) for site in [''] + sites]
+        if bucket in (NEGATIVE_BUCKET, UNKNOWN_BUCKET) and not any(counts):
+            continue
+        values.append([bucket] + counts)
+    return values
+
+
+def pairs_values(result):
+    values = [['gclid', 'クリックID', 'クリック日時', '成果ID', '成果発生日時', 'サイト名', '成果報酬', '成果までの時間（分）']]
+    for click, conversion, latency in result.pairs:
+        values.append([conversion.gclid, click.click_id, click.clicked_at, conversion.action_id,
+                       conversion.action_at, conversion.site_name, conversion.reward, _minutes(latency)])
+    return values
+
+
+def unmatched_values(result):
+    values = [['種別', 'gclid', 'ID', '日時', 'サイト名']]
+    for click in result.unmatched_clicks:
+        values.append(['成果のないクリック', click.gclid, click.click_id, click.clicked_at, click.site_name])
+    for conversion in result.orphans:
+        values.append(['クリックのない成果', conversion.gclid, conversion.action_id,
+                       conversion.action_at, conversion.site_name])
+    return values
+
+
+def publish(result, date_from=None, date_to=None):
+    for title, values in (
+        (SUMMARY_SHEET,   summary_values(result, date_from, date_to)),
+        (PAIRS_SHEET,     pairs_values(result)),
+        (UNMATCHED_SHEET, unmatched_values(result)),
+    ):
+        worksheet = sheets_client.open_worksheet(SPREADSHEET_ID, title, rows=1000, cols=10)
+        sheets_publisher.publish(worksheet, values)
+    print(f"[{datetime.now()}] スプレッドシートURL: https://docs.google.com/spreadsheets/d/{SPREADSHEET_ID}")
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="クリックログと成果の gclid 突合レポート")
+    parser.add_argument('--from', dest='date_from', help="YYYY-MM-DD（クリック日時・成果発生日時）")
+    parser.add_argument('--to', dest='date_to', help="YYYY-MM-DD")
+    parser.add_argument('--site', help="サイト名で絞り込む")
+    parser.add_argument('--db', default=query_store.STORE_PATH, help="検索用DBのパス")
+    parser.add_argument('--clicks-csv', metavar='PATH', help="検索用DBの代わりに使うクリックログCSV")
+    parser.add_argument('--actions-csv', metavar='PATH', help="検索用DBの代わりに使う成果CSV")
+    parser.add_argument('--dry-run', action='store_true', help="シートには書き込まず、集計を表示する")
+    parser.add_argument('--output', metavar='PATH', help="--dry-run の出力先CSV（集計のみ）")
+    return parser
+
+
+def sync(args, session=None):
+    """突合してシートに出力する（session は presco_daemon.py から呼ぶための引数で、使わない）"""
+    with run_metrics.pipeline('gclid_join'):
+        if args.clicks_csv or args.actions_csv:
+            # CSVを一時的なDBに取り込んで、同じ正規化（日時の形式・gclidの抽出）を使う
+            store = query_store.Store(':memory:')
+            with run_metrics.span('load'):
+                if args.clicks_csv:
+                    store.load_click_log(query_store.read_csv(args.clicks_csv))
+                if args.actions_csv:
+                    store.load_action_log(query_store.read_csv(args.actions_csv))
+        else:
+            store = query_store.Store(args.db)
+
+        with store:
+            with run_metrics.span('join'):
+                result = join(store.iter_clicks(args.date_from, args.date_to, args.site),
+                              store.iter_conversions(args.date_from, args.date_to, args.site))
+
+        print(f"[{datetime.now()}] 突合結果: 一致 {len(result.pairs)}件 / "
+              f"成果のないクリック {len(result.unmatched_clicks)}件 / クリックのない成果 {len(result.orphans)}件")
+
+        if args.dry_run:
+            local_output.write(summary_values(result, args.date_from, args.date_to), args.output, preview=50)
+            return result
+
+        with run_metrics.span('upload'):
+            publish(result, args.date_from, args.date_to)
+        return result
+
+
+def main():
+    args = build_parser().parse_args()
+
+    try:
+        print("=" * 60)
+        print(f"[{datetime.now()}] gclid突合レポートを作成します")
+        print("=" * 60)
+
+        sync(args)
+
+        print("=" * 60)
+        print(f"[{datetime.now()}] すべての処理が正常に完了しました")
+        print("=" * 60)
+
+    except Exception as e:
+        print("=" * 60)
+        print(f"[{datetime.now()}] エラーが発生しました: {str(e)}")
+        print("=" * 60)
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# local_output.py
+# --from-csv / --dry-run 用: シートに書き込まず、変換結果をローカルに出力する
+#
+#   python presco_kango.py --from-csv /tmp/presco_kango_20250101_120000.csv --dry-run
+#   python presco_kango.py --from-csv saved.csv --dry-run --output /tmp/out.csv
+
+import os
+import csv
+import sys
+from datetime import datetime
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+PREVIEW_ROWS = 10
+
+
+# ============================================================
+#  出力
+# ============================================================
+
+def write(values, output=None, preview=PREVIEW_ROWS):
+    """output を指定したらCSV（UTF-8）に書き出し、なければ先頭 preview 行を表示する"""
+    if output:
+        directory = os.path.dirname(os.path.abspath(output))
+        os.makedirs(directory, exist_ok=True)
+        tmp = output + '.tmp'
+        with open(tmp, 'w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerows(values)
+        os.replace(tmp, output)
+        print(f"[{datetime.now()}] 変換結果を書き出しました: {output}（{len(values)}行）")
+        return
+
+    print(f"[{datetime.now()}] 変換結果（全{len(values)}行のうち先頭{min(preview, len(values))}行）:")
+    writer = csv.writer(sys.stdout)
+    for row in values[:preview]:
+        writer.writerow(row)
+    sys.stdout.flush()
+
+
+# ============================================================
+#  コマンドライン引数
+# ============================================================
+
+def add_arguments(parser):
+    """各スクリプトの argparse に --from-csv / --dry-run / --output を追加する"""
+    parser.add_argument('--from-csv', metavar='PATH',
+                        help="Prescoからダウンロードせず、保存済みのCSVを使う")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="シートには書き込まず、変換結果をローカルに出力する")
+    parser.add_argument('--output', metavar='PATH',
+                        help="--dry-run の出力先CSV（省略時は先頭行を表示）")
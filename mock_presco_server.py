@@ -0,0 +1,306 @@
+# mock_presco_server.py
+# presco.ai パートナー画面のローカル代替サーバー（オフラインでのE2Eベンチマーク用）
+#
+# スクリプトが使う画面・要素だけを再現する
+#   /partner/                 ログインフォーム（input[name="username"]、「ログイン」ボタン）
+#   /partner/home             ログイン後のトップ
+#   /partner/actionLog/list   成果一覧（#dateTimeFrom / #dateTimeTo / 検索ボタン / #csv-link）
+#   /partner/report/search    レポート（サイトの選択肢 searchPartnerSiteId / #report-link / #clickLog-link）
+# CSVは synthetic_presco.py で生成し、指定した件数・文字コード・遅延で返す
+# --throttle-every N で N回に1回 429 を返す（politeness.py の確認用）
+# --ignore-site-param で searchPartnerSiteId を無視して全サイト分のCSVを返す（partner_sites.py の確認用）
+#
+# 使い方:
+#   python mock_presco_server.py --port 8765 --rows 20000 --encoding shift_jis --latency 0.2
+#   PRESCO_BASE_URL=http://127.0.0.1:8765 PRESCO_EMAIL=x PRESCO_PASSWORD=x \
+#   SHEETS_BACKEND=fake python sync_presco.py
+
+import time
+import secrets
+import argparse
+import threading
+from datetime import datetime, timedelta
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+import synthetic_presco
+
+
+# ============================================================
+#  HTML
+# ============================================================
+
+_PAGE = """<!DOCTYPE html>
+<html lang="ja"><head><meta charset="utf-8"><title>{title}</title></head>
+<body>{body}</body></html>"""
+
+_LOGIN_FORM = """
+<form method="post" action="/partner/login">
+  <input type="text" name="username">
+  <input type="password" name="password">
+  <input type="submit" value="ログイン">
+</form>"""
+
+_ACTION_LOG_FORM = """
+<form method="get" action="/partner/actionLog/list">
+  <label><input type="radio" name="dateType" value="actionDate" {action_checked}>成果発生日時</label>
+  <label><input type="radio" name="dateType" value="judgeDate" {judge_checked}>成果判定日時</label>
+  <input type="text" id="dateTimeFrom" name="dateTimeFrom" value="{date_from}">
+  <input type="text" id="dateTimeTo" name="dateTimeTo" value="{date_to}">
+  <button type="submit" class="filter-button--submit">検索条件で絞り込む</button>
+</form>
+<a id="csv-link" href="/partner/actionLog/csv?{query}">CSVダウンロード</a>"""
+
+_REPORT_PAGE = """
+<form method="get" action="/partner/report/search">
+  <select name="searchPartnerSiteId">
+    <option value="">すべてのサイト</option>{site_options}
+  </select>
+</form>
+<a id="report-link" href="/partner/report/csv?{query}">ログ集計CSVダウンロード</a>
+<a id="clickLog-link" href="/partner/report/clickLog?{query}">クリックログCSVダウンロード</a>"""
+
+
+# ============================================================
+#  サーバー
+# ============================================================
+
+class MockPrescoServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, rows=1000, encoding='shift_jis', latency=0.0,
+                 download_latency=0.0, gclid_rate=synthetic_presco.DEFAULT_GCLID_RATE,
+                 site_mix=None, email=None, password=None, seed=0, throttle_every=0, retry_after=1,
+                 ignore_site_param=False):
+        super().__init__(address, _Handler)
+        self.rows              = rows
+        self.encoding          = encoding
+        self.latency           = latency
+        self.download_latency  = download_latency
+        self.gclid_rate        = gclid_rate
+        self.site_mix          = site_mix
+        self.email             = email
+        self.password          = password
+        self.seed              = seed
+        self.throttle_every    = throttle_every   # N回に1回 429 を返す（0 なら返さない）
+        self.retry_after       = retry_after
+        self.ignore_site_param = ignore_site_param   # True なら CSV をサイトで絞り込まない
+        self.throttled         = 0
+        self.sessions          = set()
+        self.request_count     = 0
+        self._csv_cache        = {}
+        self._lock             = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def partner_sites(self):
+        """パートナーサイトの (ID, 名前)。ID は synthetic_presco のサイトIDと同じ振り方"""
+        sites = list(self.site_mix or synthetic_presco.DEFAULT_SITE_MIX)
+        return [(str(37502 + i), site) for i, site in enumerate(sites)]
+
+    def csv_for(self, kind, date_from, date_to, site_id=''):
+        """同じ条件のCSVは同じバイト列を返す（本物のPrescoでデータが増えていない状態を再現）"""
+        key = (kind, date_from, date_to, site_id)
+        with self._lock:
+            body = self._csv_cache.get(key)
+        if body is None:
+            # サイトごとに中身が変わるよう、サイトIDを乱数のシードに混ぜる
+            body = synthetic_presco.csv_bytes(
+                kind, self.rows, encoding=self.encoding, site_mix=self.site_mix,
+                gclid_rate=self.gclid_rate, date_from=date_from, date_to=date_to,
+                seed=self.seed + (int(site_id) if site_id.isdigit() else 0), site_id=site_id,
+            )
+            with self._lock:
+                self._csv_cache[key] = body
+        return body
+
+
+def _parse_date(value, default):
+    try:
+        return datetime.strptime(value, '%Y/%m/%d')
+    except (TypeError, ValueError):
+        return default
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'MockPresco/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    # ── 共通 ──
+
+    def _delay(self, seconds):
+        with self.server._lock:
+            self.server.request_count += 1
+            count = self.server.request_count
+        if seconds:
+            time.sleep(seconds)
+        return count
+
+    def _throttle(self, count):
+        """throttle_every 回に1回、429（Retry-After 付き）を返す"""
+        every = self.server.throttle_every
+        if not every or count % every:
+            return False
+        with self.server._lock:
+            self.server.throttled += 1
+        self._send(429, b'too many requests', headers={'Retry-After': str(self.server.retry_after)})
+        return True
+
+    def _session(self):
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'PRESCO_SESSION' and value in self.server.sessions:
+                return value
+        return None
+
+    def _send(self, status, body=b'', content_type='text/html; charset=utf-8', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _html(self, title, body):
+        self._send(200, _PAGE.format(title=title, body=body).encode('utf-8'))
+
+    def _redirect(self, location, headers=None):
+        self._send(302, headers=dict(headers or {}, Location=location))
+
+    def _csv(self, kind, date_from, date_to, filename, site_id=''):
+        if self.server.download_latency:
+            time.sleep(self.server.download_latency)
+        body = self.server.csv_for(kind, date_from, date_to, site_id)
+        self._send(200, body, content_type=f'text/csv; charset={self.server.encoding}', headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+        })
+
+    # ── ルーティング ──
+
+    def do_POST(self):
+        if self._throttle(self._delay(self.server.latency)):
+            return
+        path = urlsplit(self.path).path
+        if path != '/partner/login':
+            return self._send(404, b'not found')
+
+        length = int(self.headers.get('Content-Length', '0'))
+        form   = parse_qs(self.rfile.read(length).decode('utf-8'))
+        email, password = form.get('username', [''])[0], form.get('password', [''])[0]
+        if (self.server.email and email != self.server.email) or \
+           (self.server.password and password != self.server.password):
+            return self._redirect('/partner/?error=1')
+
+        session = secrets.token_hex(16)
+        with self.server._lock:
+            self.server.sessions.add(session)
+        self._redirect('/partner/home', headers={'Set-Cookie': f'PRESCO_SESSION={session}; Path=/partner'})
+
+    def do_GET(self):
+        if self._throttle(self._delay(self.server.latency)):
+            return
+        url   = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+
+        if url.path in ('/partner', '/partner/'):
+            return self._html('ログイン', _LOGIN_FORM)
+
+        if not url.path.startswith('/partner/'):
+            return self._send(404, b'not found')
+        if self._session() is None:
+            return self._redirect('/partner/')
+
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        if url.path == '/partner/home':
+            return self._html('ホーム', '<h1>パートナー管理画面</h1>')
+
+        if url.path == '/partner/actionLog/list':
+            date_from = query.get('dateTimeFrom') or today.strftime('%Y/%m/%d')
+            date_to   = query.get('dateTimeTo') or today.strftime('%Y/%m/%d')
+            date_type = query.get('dateType', 'actionDate')
+            return self._html('成果一覧', _ACTION_LOG_FORM.format(
+                action_checked='checked' if date_type != 'judgeDate' else '',
+                judge_checked='checked' if date_type == 'judgeDate' else '',
+                date_from=escape(date_from),
+                date_to=escape(date_to),
+                query=escape(urlencode({'dateType': date_type, 'dateTimeFrom': date_from, 'dateTimeTo': date_to})),
+            ))
+
+        if url.path == '/partner/actionLog/csv':
+            date_from = _parse_date(query.get('dateTimeFrom'), today - timedelta(days=1))
+            date_to   = _parse_date(query.get('dateTimeTo'), today) + timedelta(days=1)
+            return self._csv('actionLog', date_from, date_to, 'actionLog.csv')
+
+        if url.path == '/partner/report/search':
+            selected = query.get('searchPartnerSiteId', '')
+            options  = ''.join(
+                f'\n    <option value="{site_id}"{" selected" if site_id == selected else ""}>{escape(name)}</option>'
+                for site_id, name in self.server.partner_sites
+            )
+            return self._html('レポート', _REPORT_PAGE.format(site_options=options, query=escape(url.query)))
+
+        if url.path in ('/partner/report/csv', '/partner/report/clickLog'):
+            date_from = _parse_date(query.get('searchDateTimeFrom'), today - timedelta(days=30))
+            date_to   = _parse_date(query.get('searchDateTimeTo'), today) + timedelta(days=1)
+            kind      = 'report' if url.path.endswith('/csv') else 'clickLog'
+            site_id   = '' if self.server.ignore_site_param else query.get('searchPartnerSiteId', '')
+            return self._csv(kind, date_from, date_to, f'{kind}.csv', site_id)
+
+        self._send(404, b'not found')
+
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """バックグラウンドスレッドで起動して MockPrescoServer を返す（port=0 なら空きポート）"""
+    server = MockPrescoServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのPresco代替サーバー")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rows', type=int, default=1000, help="CSVの行数（ヘッダー含む）")
+    parser.add_argument('--encoding', default='shift_jis', choices=['shift_jis', 'cp932', 'utf-8', 'utf-8-sig'])
+    parser.add_argument('--latency', type=float, default=0.0, help="各リクエストの応答遅延（秒）")
+    parser.add_argument('--download-latency', type=float, default=0.0, help="CSVダウンロードの追加遅延（秒）")
+    parser.add_argument('--gclid-rate', type=float, default=synthetic_presco.DEFAULT_GCLID_RATE)
+    parser.add_argument('--email')
+    parser.add_argument('--password')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--throttle-every', type=int, default=0, metavar='N', help="N回に1回 429 を返す（流量制限の確認用）")
+    parser.add_argument('--retry-after', type=int, default=1, help="429 の Retry-After（秒）")
+    parser.add_argument('--ignore-site-param', action='store_true', help="searchPartnerSiteId を無視する（サイト絞り込みの確認用）")
+    args = parser.parse_args()
+
+    server = MockPrescoServer(
+        (args.host, args.port), rows=args.rows, encoding=args.encoding, latency=args.latency,
+        download_latency=args.download_latency, gclid_rate=args.gclid_rate,
+        email=args.email, password=args.password, seed=args.seed,
+        throttle_every=args.throttle_every, retry_after=args.retry_after,
+        ignore_site_param=args.ignore_site_param,
+    )
+    print(f"[{datetime.now()}] モックPrescoサーバーを起動しました: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
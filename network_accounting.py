@@ -0,0 +1,258 @@
+# network_accounting.py
+# 1回の同期で presco.ai や Google API とやり取りした通信量の計測（有効にしたときだけ）
+#
+#   python sync_presco.py --network-stats
+#   PRESCO_NETWORK_STATS=1 python presco_daemon.py
+#
+# ・ブラウザ（Playwright）はコンテキストの requestfinished / requestfailed イベントで、
+#   Sheets は HTTP セッション（requests.Session）のレスポンスフックで、1リクエストずつ記録する
+# ・記録はその時点で実行中のステージ（run_metrics のスパン）ごとに、ドメイン × 種類
+#   （document / script / image / sheets / drive など）で集計する
+#     件数・送受信バイト数・最初の1バイトまでの時間（TTFB）の合計と最大
+# ・各スパンには net_requests / net_kb を付け、明細は実行レポート（RUN_REPORT_PATH）に
+#   type='network' の行として追記する（どのページ読み込み・API呼び出しが重いかを見る）
+# ・ワーカースレッドからの通信（スパンの外）は「(other threads)」にまとめる
+# enable() を呼ばない限りイベントもフックも登録せず、計測の負荷はかからない。
+
+import os
+import json
+import threading
+import urllib.parse
+from datetime import datetime
+
+import run_metrics
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+ENV_ENABLE  = 'PRESCO_NETWORK_STATS'
+OTHER_STAGE = '(other threads)'
+SUMMARY_TOP = 10   # 要約に出す件数（受信バイト数の多い順）
+
+
+# ============================================================
+#  集計
+# ============================================================
+
+class Traffic:
+    """1つの (ステージ, ドメイン, 種類) の集計"""
+
+    def __init__(self):
+        self.requests = 0
+        self.failed   = 0
+        self.sent     = 0
+        self.received = 0
+        self.ttfb_ms  = 0.0
+        self.max_ttfb = 0.0
+        self.timed    = 0   # TTFB が取れたリクエスト数
+
+    def add(self, sent, received, ttfb_ms, failed):
+        self.requests += 1
+        self.failed   += 1 if failed else 0
+        self.sent     += sent
+        self.received += received
+        if ttfb_ms is not None and ttfb_ms >= 0:
+            self.ttfb_ms  += ttfb_ms
+            self.max_ttfb  = max(self.max_ttfb, ttfb_ms)
+            self.timed    += 1
+
+    def to_record(self):
+        return {
+            'requests':    self.requests,
+            'failed':      self.failed,
+            'bytes_sent':  self.sent,
+            'bytes_recv':  self.received,
+            'avg_ttfb_ms': round(self.ttfb_ms / self.timed, 1) if self.timed else None,
+            'max_ttfb_ms': round(self.max_ttfb, 1) if self.timed else None,
+        }
+
+
+class NetworkAccountant:
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._spans = {}   # span_id → {(ドメイン, 種類): Traffic}
+        self._other = {}   # スパンの外（ワーカースレッド）の通信
+        self._rows  = {}   # run_id → 実行レポートに書く明細
+
+    # ── 記録 ──
+
+    def add(self, url, resource_type, sent, received, ttfb_ms, failed=False):
+        domain = urllib.parse.urlsplit(url).netloc or '(none)'
+        span   = run_metrics.current_span()
+        with self._lock:
+            table   = self._spans.setdefault(span.span_id, {}) if span is not None else self._other
+            traffic = table.get((domain, resource_type))
+            if traffic is None:
+                traffic = table[(domain, resource_type)] = Traffic()
+            traffic.add(sent, received, ttfb_ms, failed)
+
+    # ── run_metrics のフック ──
+
+    def enter(self, span):
+        pass
+
+    def exit(self, span):
+        root = span.parent_id is None
+        with self._lock:
+            own  = self._spans.pop(span.span_id, {})
+            rows = self._rows.setdefault(span.run_id, [])
+            rows += _rows(span.name, own)
+            if root:
+                other, self._other = self._other, {}
+                rows += _rows(OTHER_STAGE, other)
+                rows  = self._rows.pop(span.run_id)
+
+        if own:
+            span.set('net_requests', sum(t.requests for t in own.values()))
+            span.set('net_kb', round(sum(t.sent + t.received for t in own.values()) / 1024, 1))
+        if root and rows:
+            _write(span, rows)
+            _print_summary(rows)
+
+
+def _rows(stage, table):
+    return [dict(stage=stage, domain=domain, resource_type=resource_type, **traffic.to_record())
+            for (domain, resource_type), traffic in sorted(table.items())]
+
+
+def _write(root, rows):
+    if not run_metrics.RUN_REPORT_PATH:
+        return
+    try:
+        with open(run_metrics.RUN_REPORT_PATH, 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(dict(row, type='network', run_id=root.run_id, pipeline=root.name),
+                                   ensure_ascii=False) + '\n')
+    except OSError as e:
+        # レポートの書き込み失敗で同期処理自体を失敗させない
+        print(f"[{datetime.now()}] 警告: 通信量の書き込みに失敗しました - {str(e)}")
+
+
+def _print_summary(rows):
+    total_requests = sum(row['requests'] for row in rows)
+    total_recv     = sum(row['bytes_recv'] for row in rows)
+    total_sent     = sum(row['bytes_sent'] for row in rows)
+    print(f"[{datetime.now()}] 通信量: {total_requests}リクエスト / 受信 {total_recv / 1024:.1f}KB / 送信 {total_sent / 1024:.1f}KB")
+
+    # 同じ名前のステージ（サイトごとの navigate など）はまとめて表示する
+    merged = {}
+    for row in rows:
+        key = (row['stage'], row['domain'], row['resource_type'])
+        requests, received, max_ttfb = merged.get(key, (0, 0, None))
+        if row['max_ttfb_ms'] is not None:
+            max_ttfb = max(max_ttfb or 0, row['max_ttfb_ms'])
+        merged[key] = (requests + row['requests'], received + row['bytes_recv'], max_ttfb)
+
+    for (stage, domain, resource_type), (requests, received, max_ttfb) in \
+            sorted(merged.items(), key=lambda item: item[1][1], reverse=True)[:SUMMARY_TOP]:
+        ttfb = f"TTFB 最大 {max_ttfb}ms" if max_ttfb is not None else ''
+        print(f"  - {stage:<20} {domain:<32} {resource_type:<10} {requests:>5}件 {received / 1024:>10.1f}KB  {ttfb}".rstrip())
+
+
+# ============================================================
+#  Playwright / Sheets への取り付け
+# ============================================================
+
+_accountant = None
+
+
+def watch(target):
+    """Playwright のページまたはコンテキストの通信を記録する（有効でなければ何もしない）"""
+    if _accountant is not None:
+        target.on('requestfinished', lambda request: _record_browser(request, failed=False))
+        target.on('requestfailed', lambda request: _record_browser(request, failed=True))
+    return target
+
+
+def _record_browser(request, failed):
+    accountant = _accountant
+    if accountant is None:
+        return
+    try:
+        sizes  = {} if failed else request.sizes()
+        timing = {} if failed else request.timing or {}
+    except Exception:
+        # ページが閉じられた後など。件数だけ数える
+        sizes, timing = {}, {}
+    sent     = max(sizes.get('requestHeadersSize', 0), 0) + max(sizes.get('requestBodySize', 0), 0)
+    received = max(sizes.get('responseHeadersSize', 0), 0) + max(sizes.get('responseBodySize', 0), 0)
+    ttfb     = timing.get('responseStart', -1)
+    accountant.add(request.url, request.resource_type, sent, received, ttfb if ttfb >= 0 else None, failed)
+
+
+def record(url, resource_type, sent, received, ttfb_ms=None, failed=False):
+    """Playwright・Sheets 以外の通信（partner_sites.py の urllib でのダウンロードなど）を記録する"""
+    accountant = _accountant
+    if accountant is not None:
+        accountant.add(url, resource_type, sent, received, ttfb_ms, failed)
+
+
+def watch_session(session):
+    """Sheets の HTTP セッション（requests.Session）の通信を記録する（有効でなければ何もしない）"""
+    if _accountant is not None:
+        session.hooks['response'].append(_record_http)
+    return session
+
+
+def _api_type(url):
+    """Google API の種類（sheets / drive / oauth2 など）"""
+    parts = urllib.parse.urlsplit(url)
+    host  = parts.netloc.split('.')[0]
+    if host == 'www':
+        segments = [segment for segment in parts.path.split('/') if segment]
+        return segments[0] if segments else host
+    return host
+
+
+def _header_bytes(headers):
+    return sum(len(str(name)) + len(str(value)) + 4 for name, value in headers.items())
+
+
+def _record_http(response, *args, **kwargs):
+    accountant = _accountant
+    if accountant is None:
+        return
+    request  = response.request
+    body     = request.body or b''
+    sent     = _header_bytes(request.headers) + len(body.encode('utf-8') if isinstance(body, str) else body)
+    length   = response.headers.get('Content-Length')
+    received = _header_bytes(response.headers) + (int(length) if length and length.isdigit() else len(response.content))
+    accountant.add(response.url, _api_type(response.url), sent, received,
+                   response.elapsed.total_seconds() * 1000, failed=response.status_code >= 400)
+
+
+# ============================================================
+#  有効化
+# ============================================================
+
+def enable():
+    """以降の通信をステージごとに記録する"""
+    global _accountant
+    if _accountant is not None:
+        return _accountant
+    _accountant = NetworkAccountant()
+    run_metrics.add_hook(_accountant)
+    print(f"[{datetime.now()}] 通信量を計測します")
+    return _accountant
+
+
+def disable():
+    global _accountant
+    if _accountant is None:
+        return
+    run_metrics.remove_hook(_accountant)
+    _accountant = None
+
+
+def add_arguments(parser):
+    """各スクリプトの argparse に --network-stats を追加する"""
+    parser.add_argument('--network-stats', action='store_true', default=os.environ.get(ENV_ENABLE) == '1',
+                        help=f"ステージごとの通信量（件数・バイト数・TTFB）を実行レポートに出力する（環境変数 {ENV_ENABLE}=1 でも有効）")
+
+
+def enable_from_args(args):
+    if args.network_stats:
+        enable()
@@ -0,0 +1,382 @@
+# partner_sites.py
+# レポート系の同期（presco_kango / presco_kango_cv / presco_kango_item5）で、
+# 複数のパートナーサイトのCSVを1回のログインでまとめて取得する
+#
+#   python presco_kango.py --sites 37502 37503
+#   python presco_kango.py --sites all          # レポート画面の searchPartnerSiteId の選択肢をすべて取得
+#   PRESCO_PARTNER_SITE_IDS=37502,37503 python presco_kango.py
+#
+# ・ログインはブラウザで1回だけ行い、レポート画面のCSVリンクを、ログイン済みのCookieを付けて
+#   サイトごとに並列でダウンロードする（サイト数分ブラウザを起動・ログインしない）
+# ・CSVのリンクが取れない画面（JavaScriptでダウンロードする場合など）では、ブラウザで1サイトずつ取得する
+# ・リンクの searchPartnerSiteId を書き換えて取得したCSVは、サイトID列（列がなければサイト間で中身が
+#   同じでないこと）で絞り込みが効いたかを確かめ、効いていなければそのサイトをブラウザで取り直す
+# ・シートは既定のサイトがこれまでどおりのシート、それ以外は「<シート名>_<サイトID>」
+# ・サイトごとのチェックポイント・変更確認・アーカイブ・書き込みの流れは run_sites() にまとめ、
+#   各スクリプトにはレポートごとに違う部分（下の「スクリプト側で用意するもの」）だけを置く
+
+import os
+import csv
+import time
+import hashlib
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import run_metrics
+import checkpoints
+import download_cache
+import raw_archive
+import politeness
+import adaptive_timeouts
+import network_accounting
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+SITES_ENV        = 'PRESCO_PARTNER_SITE_IDS'   # カンマ区切り
+ALL              = 'all'
+SITE_PARAM       = 'searchPartnerSiteId'
+SITE_COLUMN      = 'サイトID'   # CSVのサイトIDの列（絞り込みが効いたかの確認に使う）
+SITE_WORKERS     = int(os.environ.get('PRESCO_SITE_WORKERS', '4'))
+DOWNLOAD_TIMEOUT = 120   # 秒（所要時間の記録があれば adaptive_timeouts.py で決める）
+
+
+# ============================================================
+#  サイトの指定
+# ============================================================
+
+def add_arguments(parser):
+    """各スクリプトの argparse に --sites / --site-workers を追加する"""
+    default = [site.strip() for site in os.environ.get(SITES_ENV, '').split(',') if site.strip()]
+    parser.add_argument('--sites', nargs='+', metavar='ID', default=default or None,
+                        help=f"取得するパートナーサイトID（複数指定可。{ALL} でレポート画面の選択肢すべて）")
+    parser.add_argument('--site-workers', type=int, default=SITE_WORKERS, metavar='N',
+                        help="サイトごとのCSVを同時にダウンロードする数")
+
+
+def requested(args, default_site):
+    """指定されたサイトIDのリスト（{ALL} なら None = 画面から取得する）"""
+    sites = args.sites or [default_site]
+    if ALL in sites:
+        return None
+    return list(dict.fromkeys(sites))
+
+
+def sheet_name(base, site_id, default_site):
+    return base if site_id == default_site else f"{base}_{site_id}"
+
+
+def pipeline_name(base, site_id, default_site):
+    """前回の書き込み内容（download_cache）をサイトごとに分けるための名前"""
+    return base if site_id == default_site else f"{base}_{site_id}"
+
+
+# ============================================================
+#  ダウンロード
+# ============================================================
+
+def discover(page, report_type='report'):
+    """表示中のレポート画面のサイト選択肢から、サイトIDの一覧を取得する"""
+    selector = f'select[name="{SITE_PARAM}"] option'
+    with adaptive_timeouts.step(report_type, 'site_options', 10000) as timeout:
+        page.wait_for_selector(selector, state='attached', timeout=timeout)
+    options = page.eval_on_selector_all(selector, 'els => els.map(e => [e.value, e.textContent.trim()])')
+    sites = [value for value, _ in options if value]
+    if not sites:
+        raise Exception("パートナーサイトの選択肢が見つかりませんでした")
+    print(f"[{datetime.now()}] パートナーサイト {len(sites)}件: "
+          + ', '.join(f"{value}（{label}）" for value, label in options if value))
+    return sites
+
+
+def with_site(url, site_id):
+    """URL の searchPartnerSiteId を site_id に置き換える"""
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    if any(key == SITE_PARAM for key, _ in query):
+        query = [(key, site_id if key == SITE_PARAM else value) for key, value in query]
+    else:
+        query.append((SITE_PARAM, site_id))
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def csv_link(page, selectors, report_type='report'):
+    """表示中の画面のCSVリンクの絶対URL（リンクが取れなければ None）"""
+    for selector in selectors:
+        try:
+            with adaptive_timeouts.step(report_type, 'csv_link', 10000, probe=True) as timeout:
+                page.wait_for_selector(selector, state='visible', timeout=timeout)
+        except Exception:
+            continue
+        href = page.get_attribute(selector, 'href')
+        if href and not href.startswith(('#', 'javascript:')):
+            print(f"[{datetime.now()}] CSVリンクを確認しました: {selector}")
+            return urllib.parse.urljoin(page.url, href)
+    return None
+
+
+def session_headers(page, url):
+    """page のログイン状態（Cookie）で url にアクセスするためのヘッダー"""
+    return {
+        'Cookie':     '; '.join(f"{c['name']}={c['value']}" for c in page.context.cookies(url)),
+        'User-Agent': page.evaluate('navigator.userAgent'),
+        'Referer':    page.url,
+    }
+
+
+def download(url, csv_path, headers, report_type='report'):
+    """
+    ログイン済みのCookieを付けたヘッダーでCSVをダウンロードする（スレッドから呼べる）
+    429 / 503 のときは politeness.py が決めた時間（制限が無効なら Retry-After）だけ待って再試行する
+    """
+    request = urllib.request.Request(url, headers=headers)
+    tmp     = csv_path + '.part'
+    for attempt in range(politeness.THROTTLE_RETRIES + 1):
+        try:
+            ttfb_ms = _fetch(request, tmp, report_type)
+            break
+        except urllib.error.HTTPError as e:
+            if e.code not in politeness.THROTTLE_STATUS or attempt == politeness.THROTTLE_RETRIES:
+                raise
+            print(f"[{datetime.now()}] 警告: CSVのダウンロードで {e.code} が返されました。"
+                  f"待ってから再試行します（{attempt + 1}/{politeness.THROTTLE_RETRIES}）: {url}")
+            if not politeness.ENABLED:
+                # 制限が無効なときは politeness.py が待たないので、ここで待つ（goto と同じ）
+                time.sleep(politeness.retry_delay(e.headers))
+    os.replace(tmp, csv_path)
+
+    file_size = os.path.getsize(csv_path)
+    network_accounting.record(url, 'csv', sum(len(k) + len(v) + 4 for k, v in headers.items()), file_size, ttfb_ms)
+    if file_size == 0:
+        raise Exception(f"ダウンロードしたCSVファイルが空です: {csv_path}")
+    print(f"[{datetime.now()}] CSVダウンロード完了: {csv_path} ({file_size} bytes)")
+    return csv_path
+
+
+def _fetch(request, tmp, report_type):
+    """1回分のダウンロード。最初の1バイトまでの時間（ms）を返す"""
+    with politeness.request(request.full_url, 'export'), \
+            adaptive_timeouts.step(report_type, 'csv_fetch', DOWNLOAD_TIMEOUT * 1000) as timeout:
+        started = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=timeout / 1000) as response:
+            ttfb_ms = (time.perf_counter() - started) * 1000
+            if response.headers.get_content_type() == 'text/html':
+                # ログイン画面に戻された場合など
+                raise Exception(f"CSVではなくHTMLが返されました（ログインが切れた可能性があります）: {request.full_url}")
+            with open(tmp, 'wb') as f:
+                while True:
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+    return ttfb_ms
+
+
+def fetch(page, site_ids, report_url, selectors, path_prefix, download_one, workers=SITE_WORKERS,
+          report_type='report'):
+    """
+    ログイン済みの page を使って各サイトのCSVをダウンロードし、
+    ({サイトID: CSVのパス}, {失敗したサイトID: エラー}) を返す（1サイトの失敗で残りのサイトを止めない）
+      site_ids           : サイトIDのリスト（None ならレポート画面の選択肢すべて）
+      report_url(id)     : サイトのレポート画面のURL
+      selectors          : CSVリンクのセレクター（優先順）
+      path_prefix        : 保存先のパスの先頭（'<prefix>_<サイトID>_<日時>.csv'）
+      download_one(page, id) : ブラウザで1サイト分をダウンロードする関数（リンクが取れないとき用）
+      report_type        : adaptive_timeouts.py で所要時間を記録する単位
+    """
+    if site_ids is not None and len(site_ids) == 1:
+        return _each(site_ids, lambda site_id: download_one(page, site_id))
+
+    with run_metrics.span('navigate', page='report/search'):
+        print(f"[{datetime.now()}] レポートページにアクセスします")
+        politeness.goto(page, report_url(site_ids[0] if site_ids else ''), report_type, 'report_page', 60000)
+        if site_ids is None:
+            site_ids = discover(page, report_type)
+        link = csv_link(page, selectors, report_type)
+
+    if link is None or len(site_ids) == 1:
+        print(f"[{datetime.now()}] ブラウザで1サイトずつダウンロードします")
+        return _each(site_ids, lambda site_id: verify_site(download_one(page, site_id), site_id))
+
+    # ログイン済みのCookieを付けて、サイトごとのCSVを並列でダウンロードする
+    headers = session_headers(page, link)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    with run_metrics.span('export', sites=len(site_ids), workers=workers) as s:
+        print(f"[{datetime.now()}] {len(site_ids)}サイトのCSVを並列でダウンロードします（同時 {workers}件）")
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = {
+                site_id: pool.submit(download, with_site(link, site_id),
+                                     f"{path_prefix}_{site_id}_{stamp}.csv", headers, report_type)
+                for site_id in site_ids
+            }
+            paths, failures = _each(site_ids, lambda site_id: futures[site_id].result())
+        s.set('bytes', sum(os.path.getsize(path) for path in paths.values()))
+
+        # searchPartnerSiteId が効かずに同じ中身・別のサイトの行が返ってきたサイトは、ブラウザで取り直す
+        unfiltered = _unfiltered(paths)
+        if unfiltered:
+            print(f"[{datetime.now()}] 警告: サイトで絞り込まれていないCSVがありました。"
+                  f"ブラウザで取り直します: {', '.join(unfiltered)}")
+            s.set('refetched', len(unfiltered))
+            for site_id in unfiltered:
+                del paths[site_id]
+            retried, retry_failures = _each(unfiltered, lambda site_id: verify_site(download_one(page, site_id), site_id))
+            paths.update(retried)
+            failures.update(retry_failures)
+        if failures:
+            s.set('failed', len(failures))
+    return paths, failures
+
+
+def other_sites(csv_path, site_id):
+    """CSVのサイトID列にある site_id 以外の値（サイトID列がなければ None）"""
+    header, rows = _read_csv(csv_path)
+    return _other_sites(header, rows, site_id)
+
+
+def verify_site(csv_path, site_id):
+    """CSVが site_id の行だけか確かめて csv_path を返す（別のサイトの行があればエラー）"""
+    others = other_sites(csv_path, site_id)
+    if others:
+        raise Exception(f"サイト {site_id} のCSVに別のサイトの行が含まれています"
+                        f"（{SITE_PARAM} で絞り込まれていません）: {', '.join(others[:5])}")
+    return csv_path
+
+
+def _other_sites(header, rows, site_id):
+    if SITE_COLUMN not in header:
+        return None
+    column = header.index(SITE_COLUMN)
+    # 合計行などの空欄は除く
+    return sorted({row[column] for row in rows if len(row) > column and row[column] not in ('', site_id)})
+
+
+def _unfiltered(paths):
+    """
+    絞り込みが効いていないサイトIDのリスト
+    サイトID列があれば別のサイトの行が混ざっているもの、なければ他のサイトとCSVの中身が同じもの
+    """
+    unfiltered = set()
+    seen = {}
+    for site_id, path in paths.items():
+        header, rows = _read_csv(path)
+        others = _other_sites(header, rows, site_id)
+        if others is not None:
+            if others:
+                unfiltered.add(site_id)
+            continue
+        if not rows:
+            # データのないサイトどうしはヘッダーだけの同じ中身になる
+            continue
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if digest in seen:
+            unfiltered.update((site_id, seen[digest]))
+        seen[digest] = site_id
+    return sorted(unfiltered)
+
+
+def _read_csv(csv_path):
+    """(ヘッダー, データ行) を返す（文字コード自動判定）"""
+    for encoding in ['utf-8-sig', 'utf-8', 'shift_jis', 'cp932']:
+        try:
+            with open(csv_path, 'r', encoding=encoding, newline='') as f:
+                rows = list(csv.reader(f))
+            return (rows[0] if rows else []), rows[1:]
+        except UnicodeDecodeError:
+            continue
+    raise Exception(f"CSVファイルの読み込みに失敗しました: {csv_path}")
+
+
+def _each(site_ids, download_site):
+    """サイトごとに download_site(id) を呼び、({サイトID: パス}, {失敗したサイトID: エラー}) を返す"""
+    paths, failures = {}, {}
+    for site_id in site_ids:
+        try:
+            paths[site_id] = download_site(site_id)
+        except Exception as e:
+            print(f"[{datetime.now()}] サイト {site_id} のダウンロードに失敗しました - {str(e)}")
+            failures[site_id] = e
+    return paths, failures
+
+
+# ============================================================
+#  サイトごとの同期
+# ============================================================
+#
+# スクリプト側で用意するもの:
+#   PIPELINE, PARTNER_SITE_ID, ARCHIVE_KIND（raw_archive.py の種類）
+#   open_site_run(args, site_id)                         : サイトごとのチェックポイント
+#   login_and_download_csv(session, site_ids, workers)   : fetch() と同じ (パス, 失敗) の組
+#   read_csv(csv_path) / dry_run(csv_path, output)
+#   upload_site(args, site_id, csv_path, run, pipeline) : 1サイト分の書き込み
+
+def run_sites(module, args, session=None):
+    """1回分の同期処理（session を渡すと、起動済み・ログイン済みのブラウザを使う）"""
+    with run_metrics.pipeline(module.PIPELINE):
+        site_ids = requested(args, module.PARTNER_SITE_ID)
+
+        if args.from_csv:
+            # 保存済みのCSVを使う（ダウンロードもチェックポイントも使わない）
+            publish_site(module, args, (site_ids or [module.PARTNER_SITE_ID])[0], args.from_csv, checkpoints.NONE)
+            return
+
+        # 失敗後の再実行では、完了済みのステージをサイトごとにチェックポイントから再開する
+        runs    = {site_id: module.open_site_run(args, site_id) for site_id in site_ids or []}
+        pending = None if site_ids is None else [site_id for site_id in site_ids if not runs[site_id].fresh('download')]
+
+        with run_metrics.span('scrape', sites=len(site_ids) if site_ids else ALL):
+            # 全サイトのCSVを1回のログインでまとめてダウンロードする
+            downloaded, failed = (module.login_and_download_csv(session, pending, args.site_workers)
+                                  if pending != [] else ({}, {}))
+            for site_id in downloaded:
+                if site_id not in runs:
+                    runs[site_id] = module.open_site_run(args, site_id)
+            # ダウンロードに失敗したサイトは飛ばし、取得できたサイトだけ書き込む
+            csv_paths = {site_id: run.stage('download', downloaded.get, site_id, kind='file')
+                         for site_id, run in runs.items() if site_id not in failed}
+        download_cache.rotate_artifacts(keep=list(csv_paths.values()))
+
+        # サイトごとに変換・書き込みを行う（1サイトの失敗で残りのサイトを止めない）
+        failures = list(failed)
+        for site_id, csv_path in csv_paths.items():
+            with run_metrics.span('site', site=site_id):
+                try:
+                    publish_site(module, args, site_id, csv_path, runs[site_id])
+                except Exception as e:
+                    print(f"[{datetime.now()}] サイト {site_id} の処理に失敗しました - {str(e)}")
+                    failures.append(site_id)
+        if failures:
+            raise Exception(f"{len(failures)}サイトの処理に失敗しました: {', '.join(failures)}")
+
+
+def publish_site(module, args, site_id, csv_path, run):
+    """1サイト分の変換と書き込み（前回書き込んだCSVと内容が同じなら省略する）"""
+    pipeline = pipeline_name(module.PIPELINE, site_id, module.PARTNER_SITE_ID)
+
+    if args.dry_run:
+        with run_metrics.span('dry_run'):
+            module.dry_run(csv_path, args.output)
+        return
+
+    # 前回書き込んだCSVと内容が同じなら、変換と書き込みを省略する
+    with run_metrics.span('content_check'):
+        content_key = download_cache.content_key(csv_path, run.params)
+        unchanged   = download_cache.unchanged(pipeline, content_key)
+
+    if unchanged and not args.force_publish:
+        print(f"[{datetime.now()}] 変更がないため、シートの更新を省略します")
+        run_metrics.set_attr('result', 'no_change')
+    else:
+        if not args.no_archive:
+            # シートは毎回上書きされるため、生データは履歴用のアーカイブに残す
+            with run_metrics.span('archive') as s:
+                s.set('rows', raw_archive.archive_quietly(module.ARCHIVE_KIND, run.stage('parse', module.read_csv, csv_path)))
+        module.upload_site(args, site_id, csv_path, run, pipeline)
+        download_cache.mark_published(pipeline, content_key)
+    run.complete()
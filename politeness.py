@@ -0,0 +1,321 @@
+# politeness.py
+# presco.ai へのページ移動・CSVエクスポートの流量制限（ホストごと・プロセス内のすべてのスレッドで共有）
+#
+# ページの並列化・期間の分割（backfill.py）・複数アカウント（presco_accounts.py）で同時に出すリクエストが
+# 増えたため、Prescoに制限・ブロックされないよう、すべてのページ移動とCSVのダウンロードをここで通す。
+#
+#   response = politeness.goto(page, url, 'login', 'login_page', 60000)
+#
+#   with politeness.request(page.url, 'export'), adaptive_timeouts.step(...) as timeout:
+#       with page.expect_download(timeout=timeout) as download_info:
+#           page.click('#csv-link')
+#
+# ・ホストごとに同時リクエスト数（PRESCO_MAX_CONCURRENCY）と1秒あたりのリクエスト数（PRESCO_MAX_RPS）を上限にする
+# ・AIMD で流量を自動で調整する
+#     429 / 503 が返った      : 流量と同時数を半分にし、Retry-After（なければ数秒）の間は新しいリクエストを出さない
+#     ページ移動が遅くなった  : 流量を少し下げる（直近の平均の SLOW_FACTOR 倍を超えたとき。
+#                               CSVは行数で所要時間が変わるため、遅さの判断にはページ移動だけを使う）
+#     問題なく返った          : 流量を少しずつ上限まで戻す（同時数は INCREASE_EVERY 回ごとに1つ戻す）
+# ・待った時間は実行中のスパンの limiter_wait_ms に加え、パイプライン全体の合計（ワーカースレッドの分も含む）を
+#   limiter_wait_total_ms に付け、ホストごとにまとめて表示する
+# ・制限はプロセスの中だけで共有する（別々に起動したスクリプトどうしでは共有しない）
+# ・待ち時間は adaptive_timeouts.py の所要時間に含めないよう、step() の外側で request() を使う
+
+import os
+import time
+import threading
+import contextlib
+import urllib.error
+import urllib.parse
+import email.utils
+from datetime import datetime
+
+import run_metrics
+import adaptive_timeouts
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+MAX_RPS          = float(os.environ.get('PRESCO_MAX_RPS', '2'))         # ホストごとの1秒あたりのリクエスト数の上限
+MAX_CONCURRENCY  = int(os.environ.get('PRESCO_MAX_CONCURRENCY', '4'))   # ホストごとの同時リクエスト数の上限
+ENABLED          = os.environ.get('PRESCO_POLITENESS', '1') != '0'
+
+MIN_RPS          = 0.05   # 下げすぎないための下限（20秒に1回）
+INCREASE_RPS     = 0.1    # 問題なく返るたびに戻す流量
+INCREASE_EVERY   = 10     # 同時数を1つ戻すまでの、問題なく返った回数
+SLOW_DECREASE    = 0.8    # 遅くなったときに流量に掛ける値
+SLOW_FACTOR      = 3.0    # 直近の平均の何倍を遅いとみなすか
+SLOW_MIN_MS      = 1000   # これより速ければ遅いとはみなさない
+SLOW_SAMPLES     = 5      # 平均がこれだけの回数に基づくまでは遅さを判断しない
+EWMA_ALPHA       = 0.2
+THROTTLE_STATUS  = (429, 503)
+DEFAULT_BACKOFF  = 5.0    # Retry-After がないときの待ち時間（秒）
+MAX_BACKOFF      = 300.0
+THROTTLE_RETRIES = 3     # goto() で 429 / 503 のときに再試行する回数
+
+
+class Throttled(Exception):
+    """Presco が 429 / 503 を返した"""
+
+    def __init__(self, url, status, retry_after):
+        super().__init__(f"Presco から {status} が返されました（{retry_after:.0f}秒待ちます）: {url}")
+        self.status      = status
+        self.retry_after = retry_after
+
+
+# ============================================================
+#  ホストごとの制限
+# ============================================================
+
+class HostLimiter:
+    """1つのホストへの同時数と流量の制限（スレッドから呼べる）"""
+
+    def __init__(self, host, max_rps=MAX_RPS, max_concurrency=MAX_CONCURRENCY):
+        self.host            = host
+        self.max_rps         = max_rps
+        self.max_concurrency = max(max_concurrency, 1)
+        self.rps             = max_rps
+        self.concurrency     = self.max_concurrency
+        self.in_flight       = 0
+        self.baseline_ms     = None   # ページ移動の所要時間の平均（EWMA）
+        self.samples         = 0
+        self.stats           = {'requests': 0, 'wait_s': 0.0, 'throttled': 0, 'slow': 0}
+        self._next_at        = 0.0    # 次のリクエストを出してよい時刻（流量）
+        self._cooldown_until = 0.0    # 429 / 503 のあと新しいリクエストを出さない時刻
+        self._healthy        = 0
+        self._cond           = threading.Condition()
+
+    def acquire(self):
+        """出してよくなるまで待ち、待った秒数を返す"""
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.in_flight < self.concurrency:
+                    ready = max(self._next_at, self._cooldown_until)
+                    if now >= ready:
+                        break
+                    self._cond.wait(ready - now)
+                else:
+                    self._cond.wait()
+            self.in_flight += 1
+            self._next_at   = now + 1 / self.rps
+            waited          = now - started
+            self.stats['requests'] += 1
+            self.stats['wait_s']   += waited
+        return waited
+
+    def release(self, kind, duration_ms=None, status=None, retry_after=None):
+        """結果に応じて流量を調整する（duration_ms / status が None なら調整しない）"""
+        with self._cond:
+            self.in_flight -= 1
+            if status in THROTTLE_STATUS:
+                self._throttled(retry_after)
+            elif duration_ms is not None:
+                self._completed(kind, duration_ms)
+            self._cond.notify_all()
+
+    def _throttled(self, retry_after):
+        self.stats['throttled'] += 1
+        self.rps         = max(self.rps / 2, MIN_RPS)
+        self.concurrency = max(self.concurrency // 2, 1)
+        self._healthy    = 0
+        backoff = min(retry_after if retry_after is not None else DEFAULT_BACKOFF, MAX_BACKOFF)
+        self._cooldown_until = max(self._cooldown_until, time.monotonic() + backoff)
+        print(f"[{datetime.now()}] 警告: {self.host} から制限の応答がありました。"
+              f"{backoff:.0f}秒待ち、{self.rps:.2f}件/秒・同時 {self.concurrency}件に下げます")
+
+    def _completed(self, kind, duration_ms):
+        if kind == 'navigation':
+            slow = (self.samples >= SLOW_SAMPLES and duration_ms > SLOW_MIN_MS
+                    and duration_ms > self.baseline_ms * SLOW_FACTOR)
+            self.baseline_ms = duration_ms if self.baseline_ms is None else \
+                self.baseline_ms * (1 - EWMA_ALPHA) + duration_ms * EWMA_ALPHA
+            self.samples += 1
+            if slow:
+                self.stats['slow'] += 1
+                self.rps      = max(self.rps * SLOW_DECREASE, MIN_RPS)
+                self._healthy = 0
+                return
+        self.rps       = min(self.rps + INCREASE_RPS, self.max_rps)
+        self._healthy += 1
+        if self._healthy >= INCREASE_EVERY and self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            self._healthy     = 0
+
+
+_limiters = {}
+_lock     = threading.Lock()
+
+
+def limiter(url):
+    """url のホストの制限（なければ作る）"""
+    host = urllib.parse.urlsplit(url).netloc or url
+    with _lock:
+        found = _limiters.get(host)
+        if found is None:
+            found = _limiters[host] = HostLimiter(host)
+        return found
+
+
+def set_limits(host, max_rps=None, max_concurrency=None):
+    """ホストの上限を変える（ローカルの検証サーバーなど）"""
+    found = limiter(f"//{host}")
+    with found._cond:
+        if max_rps is not None:
+            found.max_rps = found.rps = max_rps
+        if max_concurrency is not None:
+            found.max_concurrency = found.concurrency = max(max_concurrency, 1)
+        found._cond.notify_all()
+
+
+# ============================================================
+#  リクエスト
+# ============================================================
+
+class Ticket:
+    """request() のブロック内で、応答（ステータス・Retry-After）を伝えるためのもの"""
+
+    def __init__(self, url):
+        self.url         = url
+        self.status      = None
+        self.retry_after = None
+
+    def response(self, response):
+        """Playwright の Response（goto / expect_navigation の結果）を渡す。429 / 503 なら Throttled"""
+        if response is None:
+            return
+        headers = response.headers or {}
+        self.observe(response.status, headers.get('retry-after'))
+
+    def observe(self, status, retry_after=None):
+        self.status      = status
+        self.retry_after = _parse_retry_after(retry_after)
+        if status in THROTTLE_STATUS:
+            raise Throttled(self.url, status, DEFAULT_BACKOFF if self.retry_after is None else self.retry_after)
+
+
+def _parse_retry_after(value):
+    """Retry-After（秒数または日時）を秒数にする"""
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max((email.utils.parsedate_to_datetime(value) - datetime.now().astimezone()).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(headers):
+    """429 / 503 の応答ヘッダーから、再試行までに待つ秒数（Retry-After がなければ DEFAULT_BACKOFF）"""
+    retry_after = _parse_retry_after(headers.get('Retry-After') if headers is not None else None)
+    return DEFAULT_BACKOFF if retry_after is None else retry_after
+
+
+@contextlib.contextmanager
+def request(url, kind='navigation'):
+    """
+    Presco への1リクエスト（ページ移動 kind='navigation' / CSV kind='export'）を制限の中で行う
+    urllib の HTTPError（429 / 503）はそのまま流量の調整に使う
+    """
+    ticket = Ticket(url)
+    if not ENABLED:
+        yield ticket
+        return
+
+    host   = limiter(url)
+    waited = host.acquire()
+    span   = run_metrics.current_span()
+    if waited and span is not None:
+        span.set('limiter_wait_ms', round(span.attrs.get('limiter_wait_ms', 0) + waited * 1000, 1))
+
+    started = time.perf_counter()
+    try:
+        yield ticket
+    except Throttled:
+        host.release(kind, status=ticket.status, retry_after=ticket.retry_after)
+        raise
+    except urllib.error.HTTPError as e:
+        host.release(kind, status=e.code, retry_after=_parse_retry_after(e.headers.get('Retry-After')))
+        raise
+    except BaseException:
+        # タイムアウト・候補セレクターの不一致などは流量の調整に使わない
+        host.release(kind)
+        raise
+    host.release(kind, (time.perf_counter() - started) * 1000, ticket.status)
+
+
+def goto(page, url, report, step, default):
+    """
+    page.goto を制限の中で行い、Response を返す
+    429 / 503 のときは Retry-After だけ待って THROTTLE_RETRIES 回まで再試行する
+    タイムアウトは adaptive_timeouts.step(report, step, default) で決める
+    """
+    for attempt in range(THROTTLE_RETRIES + 1):
+        try:
+            with request(url, 'navigation') as ticket, adaptive_timeouts.step(report, step, default) as timeout:
+                response = page.goto(url, timeout=timeout)
+                ticket.response(response)
+            return response
+        except Throttled as e:
+            if attempt == THROTTLE_RETRIES:
+                raise
+            print(f"[{datetime.now()}] 警告: {str(e)}（再試行 {attempt + 1}/{THROTTLE_RETRIES}）")
+            if not ENABLED:
+                time.sleep(e.retry_after)
+
+
+# ============================================================
+#  待ち時間の要約
+# ============================================================
+
+class _Summary:
+    """パイプラインの終わりに、その間に待った時間をホストごとに表示する（run_metrics のフック）"""
+
+    def __init__(self):
+        self._started = {}   # run_id → 開始時のホストごとの stats
+
+    def enter(self, span):
+        if span.parent_id is None:
+            self._started[span.run_id] = _snapshot()
+
+    def exit(self, span):
+        if span.parent_id is not None:
+            return
+        before  = self._started.pop(span.run_id, {})
+        total_s = 0.0
+        for host, stats in _snapshot().items():
+            prior = before.get(host, {})
+            diff  = {key: value - prior.get(key, 0) for key, value in stats.items()}
+            if not diff['requests']:
+                continue
+            total_s += diff['wait_s']
+            if diff['throttled']:
+                span.incr('throttled', diff['throttled'])
+            found = _limiters[host]
+            print(f"[{datetime.now()}] {host}: {diff['requests']}リクエスト / 待ち {diff['wait_s']:.1f}秒 / "
+                  f"制限の応答 {diff['throttled']}回 / 遅延 {diff['slow']}回 "
+                  f"（現在 {found.rps:.2f}件/秒・同時 {found.concurrency}件）")
+        if total_s:
+            span.set('limiter_wait_total_ms', round(total_s * 1000, 1))
+
+
+# フックは import 時（パイプラインの開始前・メインスレッド）に登録する
+# （最初のリクエストを送ったワーカースレッドで登録すると、実行中のフックの一覧を書き換えてしまう）
+_summary = _Summary()
+if ENABLED:
+    run_metrics.add_hook(_summary)
+
+
+def _snapshot():
+    with _lock:
+        limiters = list(_limiters.values())
+    result = {}
+    for found in limiters:
+        with found._cond:
+            result[found.host] = dict(found.stats)
+    return result
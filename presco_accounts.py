@@ -0,0 +1,349 @@
+# presco_accounts.py
+# 複数のPrescoアカウントのレポート同期（presco_kango / presco_kango_cv / presco_kango_item5）を
+# 1つのブラウザでまとめて実行する
+#
+# ・ブラウザは1つだけ起動し、アカウントごとに分離したコンテキスト（browser.new_context()）でログインする
+# ・ログイン状態はアカウントごとに PRESCO_SESSION_CACHE_DIR/<アカウント名>.json に保存し、
+#   期限内なら次回はログインを省略する
+# ・各アカウント・各サイトのCSVのダウンロードと書き込みを1つのジョブキューに入れ、
+#   アカウントごとの同時実行数（PRESCO_WORKERS_<名前>）を守りながら並列に実行する
+#   → 全アカウントの更新が、いちばん時間のかかるアカウント1つ分の時間で終わる
+#   （Playwright の同期APIは1スレッドでしか使えないため、ログインと画面の操作はこのスレッドで順に行い、
+#     ダウンロードと書き込みはログイン済みのCookieを使ってワーカースレッドで行う）
+#
+# アカウントの指定（環境変数）:
+#   PRESCO_ACCOUNTS=main,sub                        アカウント名（カンマ区切り）
+#   PRESCO_EMAIL_MAIN / PRESCO_PASSWORD_MAIN        アカウントごとのログイン情報
+#   PRESCO_WORKERS_MAIN=2                           同時ダウンロード数（省略時は PRESCO_SITE_WORKERS）
+#   PRESCO_SITES_MAIN=37502,37503                   サイトID（省略時は all = レポート画面の選択肢すべて）
+#   PRESCO_ACCOUNTS を設定しなければ、PRESCO_EMAIL / PRESCO_PASSWORD の1アカウントで実行する
+#
+#   python presco_accounts.py
+#   python presco_accounts.py --jobs presco_kango presco_kango_cv --accounts main
+
+import os
+import time
+import argparse
+import importlib
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import run_metrics
+import partner_sites
+import presco_browser
+import download_cache
+import politeness
+import network_accounting
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+REPORT_JOBS = ('presco_kango', 'presco_kango_cv', 'presco_kango_item5')
+
+SESSION_CACHE_DIR = os.environ.get('PRESCO_SESSION_CACHE_DIR', '/tmp/presco_sessions')
+SESSION_CACHE_TTL = timedelta(minutes=int(os.environ.get('PRESCO_SESSION_CACHE_MINUTES', '30')))
+
+
+# ============================================================
+#  アカウント
+# ============================================================
+
+class Account:
+
+    def __init__(self, name, email, password, workers=partner_sites.SITE_WORKERS, sites=None):
+        self.name     = name
+        self.email    = email
+        self.password = password
+        self.workers  = max(workers, 1)
+        self.sites    = sites     # None なら各スクリプトの既定（--sites / PARTNER_SITE_ID）
+
+    @property
+    def state_path(self):
+        return os.path.join(SESSION_CACHE_DIR, f"{self.name}.json")
+
+
+def load_accounts(names=None):
+    """環境変数からアカウントの一覧を作る（names を指定したらその名前だけ）"""
+    configured = [name.strip() for name in os.environ.get('PRESCO_ACCOUNTS', '').split(',') if name.strip()]
+
+    if not configured:
+        email    = os.environ.get('PRESCO_EMAIL')
+        password = os.environ.get('PRESCO_PASSWORD')
+        if not email or not password:
+            raise Exception("環境変数 PRESCO_EMAIL, PRESCO_PASSWORD が設定されていません")
+        accounts = [Account('default', email, password)]
+    else:
+        accounts = []
+        for name in configured:
+            key      = name.upper()
+            email    = os.environ.get(f'PRESCO_EMAIL_{key}')
+            password = os.environ.get(f'PRESCO_PASSWORD_{key}')
+            if not email or not password:
+                raise Exception(f"環境変数 PRESCO_EMAIL_{key}, PRESCO_PASSWORD_{key} が設定されていません")
+            workers = int(os.environ.get(f'PRESCO_WORKERS_{key}', partner_sites.SITE_WORKERS))
+            sites   = [s.strip() for s in os.environ.get(f'PRESCO_SITES_{key}', partner_sites.ALL).split(',') if s.strip()]
+            accounts.append(Account(name, email, password, workers, sites))
+
+    if names:
+        unknown = set(names) - {account.name for account in accounts}
+        if unknown:
+            raise Exception(f"不明なアカウントです: {', '.join(sorted(unknown))}")
+        accounts = [account for account in accounts if account.name in names]
+    return accounts
+
+
+def open_context(browser, account, base_url=presco_browser.PRESCO_BASE_URL):
+    """アカウント専用のコンテキストを開き、ログイン済みのページと一緒に返す"""
+    path = account.state_path
+    if os.path.exists(path) and datetime.now() - datetime.fromtimestamp(os.path.getmtime(path)) < SESSION_CACHE_TTL:
+        # 保存したログイン状態を使う（ログイン画面に戻されたらログインし直す）
+        context = _new_context(browser, storage_state=path)
+        page    = context.new_page()
+        politeness.goto(page, f'{base_url}/partner/home', 'login', 'home_page', 60000)
+        if presco_browser.is_logged_in_url(page.url):
+            print(f"[{datetime.now()}] {account.name}: 保存したログイン状態を使います")
+            return context, page
+        context.close()
+
+    context = _new_context(browser)
+    page    = context.new_page()
+    print(f"[{datetime.now()}] {account.name}: ログインします")
+    presco_browser.login(page, account.email, account.password, base_url)
+
+    os.makedirs(SESSION_CACHE_DIR, exist_ok=True)
+    context.storage_state(path=path)
+    os.chmod(path, 0o600)   # Cookie を含むので本人だけが読めるようにする
+    return context, page
+
+
+def _new_context(browser, **options):
+    context = browser.new_context(viewport=presco_browser.VIEWPORT, user_agent=presco_browser.USER_AGENT, **options)
+    context.set_default_timeout(presco_browser.DEFAULT_TIMEOUT)
+    network_accounting.watch(context)
+    return context
+
+
+# ============================================================
+#  ジョブキュー
+# ============================================================
+
+class Job:
+    """1アカウント・1スクリプト・1サイト分のダウンロードと書き込み"""
+
+    def __init__(self, account, module, args, site_id, url, headers):
+        self.account = account
+        self.module  = module
+        self.args    = args
+        self.site_id = site_id
+        self.url     = url
+        self.headers = headers
+        self.error   = None
+        self.started = None
+        self.ended   = None
+
+    @property
+    def label(self):
+        return f"{self.account.name}/{self.module.__name__}/{self.site_id}"
+
+    def download(self, csv_path):
+        """サイトを書き換えたリンクでダウンロードし、サイトで絞り込まれているか確かめる"""
+        partner_sites.download(self.url, csv_path, self.headers, self.module.REPORT_TYPE)
+        try:
+            return partner_sites.verify_site(csv_path, self.site_id)
+        except Exception:
+            os.remove(csv_path)
+            raise
+
+    def run(self):
+        stamp    = datetime.now().strftime('%Y%m%d_%H%M%S')
+        csv_path = f"/tmp/{self.module.__name__}_{self.account.name}_{self.site_id}_{stamp}.csv"
+        run      = self.module.open_site_run(self.args, self.site_id)
+        csv_path = run.stage('download', self.download, csv_path, kind='file')
+        partner_sites.publish_site(self.module, self.args, self.site_id, csv_path, run)
+        return csv_path
+
+
+class JobQueue:
+    """
+    全アカウントのジョブを1つのキューで持ち、空いているワーカーに渡す
+    アカウントごとの同時実行数を超えるジョブは飛ばして、別のアカウントのジョブを先に渡す
+    """
+
+    def __init__(self, jobs, limits):
+        self._jobs   = deque(jobs)
+        self._limits = limits
+        self._active = {name: 0 for name in limits}
+        self._cond   = threading.Condition()
+
+    def take(self):
+        with self._cond:
+            while True:
+                if not self._jobs:
+                    return None
+                for job in self._jobs:
+                    name = job.account.name
+                    if self._active[name] < self._limits[name]:
+                        self._jobs.remove(job)
+                        self._active[name] += 1
+                        return job
+                self._cond.wait()
+
+    def done(self, job):
+        with self._cond:
+            self._active[job.account.name] -= 1
+            self._cond.notify_all()
+
+
+def _interleave(groups):
+    """アカウントごとのジョブを交互に並べる（どのアカウントも最初から並行して進むように）"""
+    result = []
+    queues = [deque(group) for group in groups]
+    while any(queues):
+        for queue in queues:
+            if queue:
+                result.append(queue.popleft())
+    return result
+
+
+def _worker(queue, paths):
+    while True:
+        job = queue.take()
+        if job is None:
+            return
+        job.started = time.perf_counter()
+        try:
+            paths.append(job.run())
+        except Exception as e:
+            job.error = e
+            print(f"[{datetime.now()}] {job.label} が失敗しました - {str(e)}")
+        finally:
+            job.ended = time.perf_counter()
+            queue.done(job)
+
+
+# ============================================================
+#  実行
+# ============================================================
+
+def _plan(page, account, module):
+    """アカウントのレポート画面からサイトとCSVリンクを調べ、サイトごとのジョブを作る"""
+    args  = module.build_parser().parse_args([])
+    sites = account.sites if account.sites is not None else (args.sites or [module.PARTNER_SITE_ID])
+    site_ids = None if partner_sites.ALL in sites else list(dict.fromkeys(sites))
+
+    politeness.goto(page, module.report_url(site_ids[0] if site_ids else ''), module.REPORT_TYPE, 'report_page', 60000)
+    if site_ids is None:
+        site_ids = partner_sites.discover(page, module.REPORT_TYPE)
+    link = partner_sites.csv_link(page, module.CSV_SELECTORS, module.REPORT_TYPE)
+    if link is None:
+        page.screenshot(path=f'/tmp/error_accounts_{account.name}.png')
+        raise Exception(f"{account.name}: {module.__name__} のCSVリンクが見つかりませんでした")
+
+    headers = partner_sites.session_headers(page, link)
+    return [Job(account, module, args, site_id, partner_sites.with_site(link, site_id), headers)
+            for site_id in site_ids]
+
+
+def run_all(accounts, job_names=REPORT_JOBS):
+    modules = [importlib.import_module(name) for name in job_names]
+
+    # Playwright はブラウザを起動するときだけ読み込む
+    from playwright.sync_api import sync_playwright
+
+    with run_metrics.pipeline('presco_accounts', accounts=len(accounts), jobs=len(modules)):
+        with sync_playwright() as p:
+            with run_metrics.span('browser_launch'):
+                print(f"[{datetime.now()}] ブラウザを起動します")
+                browser = p.chromium.launch(headless=True, args=presco_browser.LAUNCH_ARGS)
+
+            groups, jobs, paths, failures = [], [], [], []
+            try:
+                # ── アカウントごとにログインしてジョブを作る（画面の操作はこのスレッドで行う） ──
+                for account in accounts:
+                    with run_metrics.span('account', account=account.name) as s:
+                        try:
+                            context, page = open_context(browser, account)
+                            jobs = []
+                            for module in modules:
+                                jobs += _plan(page, account, module)
+                            page.close()
+                            groups.append(jobs)
+                            s.set('jobs', len(jobs))
+                        except Exception as e:
+                            print(f"[{datetime.now()}] {account.name} の準備に失敗しました - {str(e)}")
+                            failures.append(account.name)
+
+                # ── 全アカウントのジョブを1つのキューで並列に実行する ──
+                jobs  = _interleave(groups)
+                queue = JobQueue(jobs, {account.name: account.workers for account in accounts})
+                with run_metrics.span('jobs', jobs=len(jobs)) as s:
+                    print(f"[{datetime.now()}] {len(jobs)}件のジョブを実行します")
+                    threads = [threading.Thread(target=_worker, args=(queue, paths))
+                               for _ in range(sum(account.workers for account in accounts))]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    s.set('failed', sum(1 for job in jobs if job.error))
+            finally:
+                browser.close()
+                print(f"[{datetime.now()}] ブラウザを閉じました")
+
+        download_cache.rotate_artifacts(keep=paths)
+        _print_summary(accounts, jobs)
+
+    failures += [job.label for job in jobs if job.error]
+    if failures:
+        raise Exception(f"{len(failures)}件が失敗しました: {', '.join(failures)}")
+
+
+def _print_summary(accounts, jobs):
+    print("-" * 60)
+    for account in accounts:
+        done = [job for job in jobs if job.account is account and job.started is not None]
+        if not done:
+            print(f"  - {account.name}: ジョブなし")
+            continue
+        elapsed = max(job.ended for job in done) - min(job.started for job in done)
+        failed  = sum(1 for job in done if job.error)
+        print(f"  - {account.name}: {len(done)}件（失敗 {failed}件） {elapsed:.1f}秒 / 同時 {account.workers}件")
+    print("-" * 60)
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="複数アカウントのレポート同期")
+    parser.add_argument('--jobs', nargs='+', choices=REPORT_JOBS, default=list(REPORT_JOBS),
+                        help="実行するスクリプト")
+    parser.add_argument('--accounts', nargs='+', metavar='NAME', help="実行するアカウント名（PRESCO_ACCOUNTS の一部）")
+    network_accounting.add_arguments(parser)
+    args = parser.parse_args()
+    network_accounting.enable_from_args(args)
+
+    accounts = load_accounts(args.accounts)
+    try:
+        print("=" * 60)
+        print(f"[{datetime.now()}] {len(accounts)}アカウントのレポート同期を開始します")
+        print("=" * 60)
+
+        run_all(accounts, args.jobs)
+
+        print("=" * 60)
+        print(f"[{datetime.now()}] すべての処理が正常に完了しました")
+        print("=" * 60)
+
+    except Exception as e:
+        print("=" * 60)
+        print(f"[{datetime.now()}] エラーが発生しました: {str(e)}")
+        print("=" * 60)
+        raise
+
+
+if __name__ == "__main__":
+    main()
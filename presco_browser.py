@@ -0,0 +1,198 @@
+# presco_browser.py
+# ログイン済みのブラウザを起動したまま使い回すためのセッション（presco_daemon.py 用）
+#
+#   session = presco_browser.PrescoSession(email, password)
+#   session.start()
+#   with session.page() as page:
+#       csv_path = presco_kango.download_csv_kango(page)
+#   session.close()
+#
+# ・ブラウザが落ちていたら ensure() で起動し直す
+# ・renew() は新しいコンテキストでログインしてから古いコンテキストと入れ替える
+#   （入れ替えまでの間も、ログイン済みのコンテキストが使える）
+
+import os
+import contextlib
+from datetime import datetime
+
+import run_metrics
+import politeness
+import adaptive_timeouts
+import network_accounting
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+PRESCO_BASE_URL = os.environ.get('PRESCO_BASE_URL', 'https://presco.ai').rstrip('/')   # ローカル検証時は mock_presco_server.py のURL
+
+LAUNCH_ARGS     = ['--no-sandbox', '--disable-setuid-sandbox']
+VIEWPORT        = {'width': 1920, 'height': 1080}
+USER_AGENT      = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+DEFAULT_TIMEOUT = 60000
+
+
+# ============================================================
+#  ログイン
+# ============================================================
+
+def login(page, email, password, base_url=PRESCO_BASE_URL):
+    print(f"[{datetime.now()}] ログインページにアクセスします")
+    politeness.goto(page, f'{base_url}/partner/', 'login', 'login_page', 60000)
+
+    with adaptive_timeouts.step('login', 'login_form', 10000) as timeout:
+        page.wait_for_selector('input[name="username"]', timeout=timeout)
+    page.fill('input[name="username"]', email)
+    page.fill('input[name="password"]', password)
+
+    with politeness.request(page.url) as ticket, adaptive_timeouts.step('login', 'login_submit', 60000) as timeout:
+        with page.expect_navigation(timeout=timeout) as navigation:
+            page.click('input[type="submit"][value="ログイン"]')
+        ticket.response(navigation.value)
+    adaptive_timeouts.settle(page, 'login', 'login_submit_settle', 3000)
+
+    current_url = page.url
+    if not is_logged_in_url(current_url):
+        page.screenshot(path='/tmp/login_error_daemon.png')
+        raise Exception(f"ログインに失敗しました。URL: {current_url}")
+
+    print(f"[{datetime.now()}] ログインに成功しました")
+
+
+def is_logged_in_url(url):
+    return any(x in url for x in ['home', 'actionLog', 'report'])
+
+
+# ============================================================
+#  セッション
+# ============================================================
+
+class PrescoSession:
+
+    def __init__(self, email, password, base_url=PRESCO_BASE_URL):
+        self.email        = email
+        self.password     = password
+        self.base_url     = base_url
+        self.logged_in_at = None
+        self.restarts     = 0
+        self._playwright  = None
+        self._browser     = None
+        self._context     = None
+
+    # ── 起動・終了 ──
+
+    def start(self):
+        if self._playwright is None:
+            # 重い import はデーモンを起動したときだけ行う
+            from playwright.sync_api import sync_playwright
+            self._playwright = sync_playwright().start()
+        self._launch()
+
+    def _launch(self):
+        with run_metrics.span('browser_launch'):
+            print(f"[{datetime.now()}] ブラウザを起動します")
+            self._browser = self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        self._context = self._login_context()
+
+    def _login_context(self):
+        with run_metrics.span('login'):
+            context = self._browser.new_context(viewport=VIEWPORT, user_agent=USER_AGENT)
+            context.set_default_timeout(DEFAULT_TIMEOUT)
+            network_accounting.watch(context)
+            page = context.new_page()
+            try:
+                login(page, self.email, self.password, self.base_url)
+            except Exception:
+                context.close()
+                raise
+            finally:
+                if not page.is_closed():
+                    page.close()
+        self.logged_in_at = datetime.now()
+        return context
+
+    def close(self):
+        for closer in (self._context, self._browser):
+            if closer is None:
+                continue
+            try:
+                closer.close()
+            except Exception:
+                pass
+        self._context = self._browser = None
+        if self._playwright is not None:
+            self._playwright.stop()
+            self._playwright = None
+        print(f"[{datetime.now()}] ブラウザを閉じました")
+
+    # ── 状態の確認と回復 ──
+
+    @property
+    def alive(self):
+        return self._browser is not None and self._browser.is_connected()
+
+    def ensure(self):
+        """ブラウザが落ちていれば起動し直す"""
+        if self.alive and self._context is not None:
+            return
+        self.restart()
+
+    def restart(self):
+        print(f"[{datetime.now()}] ブラウザを再起動します")
+        for closer in (self._context, self._browser):
+            try:
+                if closer is not None:
+                    closer.close()
+            except Exception:
+                pass
+        self._context = self._browser = None
+        self.restarts += 1
+        self._launch()
+
+    def renew(self):
+        """新しいコンテキストでログインし直して入れ替える"""
+        print(f"[{datetime.now()}] セッションを更新します")
+        context = self._login_context()
+        old, self._context = self._context, context
+        if old is not None:
+            try:
+                old.close()
+            except Exception:
+                pass
+
+    def check(self):
+        """ログイン状態が続いているか確認する（ログイン画面に戻されたら False）"""
+        page = self._context.new_page()
+        try:
+            politeness.goto(page, f'{self.base_url}/partner/home', 'login', 'home_page', 60000)
+            return is_logged_in_url(page.url)
+        finally:
+            page.close()
+
+    def age(self):
+        if self.logged_in_at is None:
+            return None
+        return datetime.now() - self.logged_in_at
+
+    # ── ページ ──
+
+    @contextlib.contextmanager
+    def page(self, error_screenshot='/tmp/error_daemon.png'):
+        """ログイン済みコンテキストの新しいタブを開き、終わったら閉じる"""
+        self.ensure()
+        page = self._context.new_page()
+        try:
+            yield page
+        except Exception:
+            try:
+                page.screenshot(path=error_screenshot)
+                print(f"[{datetime.now()}] スクリーンショットを保存しました: {error_screenshot}")
+            except Exception:
+                pass
+            raise
+        finally:
+            try:
+                page.close()
+            except Exception:
+                pass
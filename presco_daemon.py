@@ -0,0 +1,237 @@
+# presco_daemon.py
+# 常駐して5つの同期（と gclid 突合レポート）を定期実行するデーモン
+#
+# ブラウザを起動・ログインしたまま保持し、各同期はダウンロードと書き込みだけを行う。
+#   ・ジョブごとに実行間隔を指定できる（時刻に揃えて実行。例: 10m なら毎時 00,10,20,... 分）
+#   ・待ち時間にセッションを定期的に更新し、ログイン切れを防ぐ
+#   ・ブラウザが落ちたら起動し直し、ログイン切れで失敗したらログインし直して1回だけ再実行する
+#   ・失敗したジョブは間隔を広げて再試行する（最大で本来の実行間隔まで）
+#
+# 使い方:
+#   python presco_daemon.py
+#   python presco_daemon.py --interval presco_kango=5m --interval sync_presco=2m
+#   python presco_daemon.py --only presco_kango presco_kango_cv --once
+
+import os
+import time
+import signal
+import argparse
+import importlib
+from datetime import datetime, timedelta
+
+import presco_browser
+import network_accounting
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+# ジョブ名（＝モジュール名） → 既定の実行間隔
+DEFAULT_INTERVALS = {
+    'sync_presco':        '10m',
+    'presco_gamesverse':  '10m',
+    'presco_kango':       '30m',
+    'presco_kango_cv':    '30m',
+    'presco_kango_item5': '60m',
+    'gclid_join':         '60m',   # ブラウザは使わない（検索用DBから突合レポートを作る）
+}
+
+SESSION_RENEW_AFTER = timedelta(minutes=int(os.environ.get('PRESCO_SESSION_RENEW_MINUTES', '20')))
+RETRY_DELAY         = timedelta(minutes=1)   # 失敗後の最初の再試行までの時間（失敗のたびに倍）
+TICK_SECONDS        = 5                      # 待機中に停止要求・セッション更新を確認する間隔
+
+
+def parse_interval(value):
+    """'90s' / '10m' / '2h' / '600'（秒） → timedelta"""
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    value = value.strip()
+    if value[-1:] in units:
+        seconds = float(value[:-1]) * units[value[-1]]
+    else:
+        seconds = float(value)
+    if seconds <= 0:
+        raise Exception(f"実行間隔が不正です: {value}")
+    return timedelta(seconds=seconds)
+
+
+# ============================================================
+#  ジョブ
+# ============================================================
+
+class Job:
+
+    def __init__(self, name, interval):
+        self.name        = name
+        self.interval    = interval
+        self.module      = importlib.import_module(name)
+        self.args        = self.module.build_parser().parse_args([])
+        self.next_run    = None
+        self.failures    = 0
+        self.runs        = 0
+        self.last_status = None
+
+    def schedule(self, now, aligned=True):
+        """次の実行時刻を決める（aligned なら 0時からの実行間隔の倍数に揃える）"""
+        if not aligned:
+            self.next_run = now + self.interval
+            return
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        step     = self.interval.total_seconds()
+        elapsed  = (now - midnight).total_seconds()
+        self.next_run = midnight + timedelta(seconds=(int(elapsed // step) + 1) * step)
+
+    def schedule_retry(self, now):
+        delay = min(RETRY_DELAY * (2 ** (self.failures - 1)), self.interval)
+        self.next_run = now + delay
+
+
+# ============================================================
+#  デーモン
+# ============================================================
+
+class Daemon:
+
+    def __init__(self, jobs, session):
+        self.jobs     = jobs
+        self.session  = session
+        self.stopping = False
+
+    def stop(self, *_):
+        print(f"[{datetime.now()}] 停止要求を受け付けました（実行中のジョブが終わったら停止します）")
+        self.stopping = True
+
+    def run_job(self, job):
+        print("=" * 60)
+        print(f"[{datetime.now()}] ジョブを実行します: {job.name}")
+        print("=" * 60)
+        job.runs += 1
+        try:
+            try:
+                self.session.ensure()
+                job.module.sync(job.args, self.session)
+            except Exception as e:
+                if not self._recover(e):
+                    raise
+                print(f"[{datetime.now()}] 回復したため {job.name} を再実行します")
+                job.module.sync(job.args, self.session)
+        except Exception as e:
+            job.failures += 1
+            job.last_status = f"エラー: {e}"
+            job.schedule_retry(datetime.now())
+            print(f"[{datetime.now()}] {job.name} が失敗しました（連続{job.failures}回） - {str(e)}")
+            print(f"[{datetime.now()}] 次回: {job.next_run:%H:%M:%S}")
+            return
+
+        job.failures    = 0
+        job.last_status = 'ok'
+        job.schedule(datetime.now())
+        print(f"[{datetime.now()}] {job.name} が完了しました（次回: {job.next_run:%H:%M:%S}）")
+
+    def _recover(self, error):
+        """ブラウザのクラッシュ・ログイン切れなら回復して True を返す"""
+        try:
+            if not self.session.alive:
+                print(f"[{datetime.now()}] ブラウザが応答しません - {str(error)}")
+                self.session.restart()
+                return True
+            if not self.session.check():
+                print(f"[{datetime.now()}] ログインが切れていました")
+                self.session.renew()
+                return True
+        except Exception as e:
+            print(f"[{datetime.now()}] 回復に失敗しました - {str(e)}")
+            try:
+                self.session.restart()
+            except Exception as e:
+                print(f"[{datetime.now()}] ブラウザの再起動に失敗しました - {str(e)}")
+        return False
+
+    def _idle(self, until):
+        """次のジョブまで待つ。待ち時間にセッションを更新する"""
+        while not self.stopping:
+            now = datetime.now()
+            if now >= until:
+                return
+            age = self.session.age()
+            if age is not None and age >= SESSION_RENEW_AFTER:
+                try:
+                    self.session.ensure()
+                    self.session.renew()
+                except Exception as e:
+                    print(f"[{datetime.now()}] 警告: セッションの更新に失敗しました - {str(e)}")
+                    try:
+                        self.session.restart()
+                    except Exception as e:
+                        print(f"[{datetime.now()}] 警告: ブラウザの再起動に失敗しました - {str(e)}")
+                continue
+            time.sleep(min(TICK_SECONDS, max((until - now).total_seconds(), 0)))
+
+    def run(self, once=False):
+        self.session.start()
+        now = datetime.now()
+        for job in self.jobs:
+            job.next_run = now   # 起動直後に1回ずつ実行する
+
+        try:
+            while not self.stopping:
+                job = min(self.jobs, key=lambda j: j.next_run)
+                self._idle(job.next_run)
+                if self.stopping:
+                    break
+                self.run_job(job)
+                if once and all(j.runs for j in self.jobs):
+                    break
+        finally:
+            self.session.close()
+            self._print_status()
+
+    def _print_status(self):
+        print("-" * 60)
+        print(f"[{datetime.now()}] デーモンを停止しました（ブラウザ再起動: {self.session.restarts}回）")
+        for job in self.jobs:
+            print(f"  - {job.name}: 実行 {job.runs}回 / 最後の結果: {job.last_status}")
+        print("-" * 60)
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Presco同期デーモン（ブラウザを起動したまま定期実行）")
+    parser.add_argument('--interval', action='append', default=[], metavar='JOB=INTERVAL',
+                        help="ジョブの実行間隔（例: presco_kango=5m）。複数指定可")
+    parser.add_argument('--only', nargs='+', choices=list(DEFAULT_INTERVALS), help="実行するジョブ")
+    parser.add_argument('--once', action='store_true', help="各ジョブを1回ずつ実行したら終了する")
+    network_accounting.add_arguments(parser)
+    args = parser.parse_args()
+    network_accounting.enable_from_args(args)
+
+    email    = os.environ.get('PRESCO_EMAIL')
+    password = os.environ.get('PRESCO_PASSWORD')
+    if not email or not password:
+        raise Exception("環境変数 PRESCO_EMAIL, PRESCO_PASSWORD が設定されていません")
+
+    intervals = dict(DEFAULT_INTERVALS)
+    for item in args.interval:
+        name, _, value = item.partition('=')
+        if name not in intervals:
+            raise Exception(f"不明なジョブです: {name}")
+        intervals[name] = value
+
+    names = args.only or list(intervals)
+    jobs  = [Job(name, parse_interval(intervals[name])) for name in names]
+
+    print(f"[{datetime.now()}] デーモンを起動します")
+    for job in jobs:
+        print(f"  - {job.name}: {job.interval} ごと")
+
+    daemon = Daemon(jobs, presco_browser.PrescoSession(email, password))
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,25 @@
 # presco_kango_item5.py
 
 import os
-import time
+import sys
+import argparse
 import csv
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from urllib.parse import quote
-from playwright.sync_api import sync_playwright
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
+import sheets_client
+import sheets_publisher
+import run_metrics
+import profiling
+import network_accounting
+import checkpoints
+import download_cache
+import local_output
+import raw_archive
+import partner_sites
+import row_changes
+import politeness
+import adaptive_timeouts
 
 
 # ============================================================
@@ -19,121 +29,114 @@ import json
 SPREADSHEET_ID  = '1x7xkMomtb81GXqd5XF0b3_q59BuOSoHypTyyLqFWKow'
 SHEET_NAME      = 'Presco_kango_item5'
 PARTNER_SITE_ID = '37502'
+PRESCO_BASE_URL = os.environ.get('PRESCO_BASE_URL', 'https://presco.ai').rstrip('/')   # ローカル検証時は mock_presco_server.py のURL
+REPORT_TYPE     = 'report_item5'   # adaptive_timeouts.py で所要時間を記録する単位
+PIPELINE        = 'presco_kango_item5'
+ARCHIVE_KIND    = 'report_item5'   # raw_archive.py の種類
+
+# CSVダウンロードのリンク（優先順）
+CSV_SELECTORS = [
+    '#report-link',
+    'a:has-text("ログ集計CSVダウンロード")',
+    '#csv-link',
+]
 DAYS_BACK       = 180  # 何日前からのデータを取得するか
 
+# 行の変更検出（row_changes.py）のキーにするレポートの軸（CSVのヘッダーの列名）
+# アーカイブの重複判定（raw_archive.NATURAL_KEYS）と同じキー
+CDC_KEY_COLUMNS = raw_archive.REPORT_KEY_COLUMNS
+
 
 # ============================================================
 #  CSVダウンロード
 # ============================================================
 
-def login_and_download_csv():
+def report_period():
+    """レポートの期間（開始日, 終了日）"""
+    today = datetime.now(ZoneInfo("Asia/Tokyo"))
+    return (today - timedelta(days=DAYS_BACK)).strftime("%Y/%m/%d"), today.strftime("%Y/%m/%d")
+
+
+def report_url(site_id=PARTNER_SITE_ID):
+    """サイトのレポート画面のURL"""
+    date_from, date_to = report_period()
+    return (
+        f"{PRESCO_BASE_URL}/partner/report/search"
+        f"?searchDateTimeFrom={quote(date_from, safe='')}"
+        f"&searchDateTimeTo={quote(date_to, safe='')}"
+        f"&searchItemType=5"
+        f"&searchPeriodType=4"
+        f"&searchProgramId="
+        f"&searchDateType=3"
+        f"&searchPartnerSiteId={site_id}"
+        f"&searchProgramUrlId="
+        f"&searchPartnerSitePageId="
+        f"&searchLargeGenreId="
+        f"&searchMediumGenreId="
+        f"&searchSmallGenreId="
+        f"&_searchJoinType=on"
+    )
+
+
+def login_and_download_csv(session=None, site_ids=(PARTNER_SITE_ID,), workers=partner_sites.SITE_WORKERS):
+    """ログインして site_ids（None ならレポート画面の選択肢すべて）のCSVをダウンロードし、({サイトID: パス}, {失敗したサイトID: エラー}) を返す"""
     print(f"[{datetime.now()}] 処理を開始します")
 
+    if session is not None:
+        # デーモンから呼ばれた場合は、ログイン済みのブラウザで新しいタブを開いて使う
+        with session.page() as page:
+            return download_sites(page, site_ids, workers)
+
     email    = os.environ.get('PRESCO_EMAIL')
     password = os.environ.get('PRESCO_PASSWORD')
     if not email or not password:
         raise Exception("環境変数 PRESCO_EMAIL, PRESCO_PASSWORD が設定されていません")
 
-    JST       = ZoneInfo("Asia/Tokyo")
-    today     = datetime.now(JST)
-    date_from = (today - timedelta(days=DAYS_BACK)).strftime("%Y/%m/%d")
-    date_to   = today.strftime("%Y/%m/%d")
+    # Playwright はブラウザを起動するときだけ読み込む（--from-csv では不要）
+    from playwright.sync_api import sync_playwright
 
     with sync_playwright() as p:
-        print(f"[{datetime.now()}] ブラウザを起動します")
-        browser = p.chromium.launch(
-            headless=True,
-            args=['--no-sandbox', '--disable-setuid-sandbox']
-        )
-        context = browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        )
-        context.set_default_timeout(60000)
-        page = context.new_page()
-
-        try:
-            # ── ログイン ──
-            print(f"[{datetime.now()}] ログインページにアクセスします")
-            page.goto('https://presco.ai/partner/', timeout=60000)
-            time.sleep(3)
-
-            page.wait_for_selector('input[name="username"]', timeout=10000)
-            page.fill('input[name="username"]', email)
-            page.fill('input[name="password"]', password)
-
-            with page.expect_navigation(timeout=60000):
-                page.click('input[type="submit"][value="ログイン"]')
-            time.sleep(3)
-
-            current_url = page.url
-            print(f"[{datetime.now()}] 現在のURL: {current_url}")
-            if not any(x in current_url for x in ['home', 'actionLog', 'report']):
-                page.screenshot(path='/tmp/login_error_kango_item5.png')
-                raise Exception(f"ログインに失敗しました。URL: {current_url}")
-
-            print(f"[{datetime.now()}] ログインに成功しました")
-
-            # ── レポートページに直接アクセス ──
-            report_url = (
-                "https://presco.ai/partner/report/search"
-                f"?searchDateTimeFrom={quote(date_from, safe='')}"
-                f"&searchDateTimeTo={quote(date_to, safe='')}"
-                f"&searchItemType=5"
-                f"&searchPeriodType=4"
-                f"&searchProgramId="
-                f"&searchDateType=3"
-                f"&searchPartnerSiteId={PARTNER_SITE_ID}"
-                f"&searchProgramUrlId="
-                f"&searchPartnerSitePageId="
-                f"&searchLargeGenreId="
-                f"&searchMediumGenreId="
-                f"&searchSmallGenreId="
-                f"&_searchJoinType=on"
+        with run_metrics.span('browser_launch'):
+            print(f"[{datetime.now()}] ブラウザを起動します")
+            browser = p.chromium.launch(
+                headless=True,
+                args=['--no-sandbox', '--disable-setuid-sandbox']
             )
+            context = browser.new_context(
+                viewport={'width': 1920, 'height': 1080},
+                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            )
+            context.set_default_timeout(60000)
+            network_accounting.watch(context)
+            page = context.new_page()
 
-            print(f"[{datetime.now()}] レポートページにアクセスします")
-            print(f"[{datetime.now()}] 期間: {date_from} 〜 {date_to}")
-            print(f"[{datetime.now()}] searchItemType=5")
-            page.goto(report_url, timeout=60000)
-            time.sleep(5)
-
-            # ── CSVダウンロード ──
-            csv_selectors = [
-                '#report-link',
-                'a:has-text("ログ集計CSVダウンロード")',
-                '#csv-link',
-            ]
-
-            csv_clicked = False
-            for selector in csv_selectors:
-                try:
-                    page.wait_for_selector(selector, state='visible', timeout=10000)
-                    print(f"[{datetime.now()}] CSVボタンを確認しました: {selector}")
-
-                    with page.expect_download(timeout=60000) as download_info:
-                        page.click(selector)
-
-                    csv_clicked = True
-                    break
-                except Exception:
-                    continue
+        try:
+            with run_metrics.span('login'):
+                # ── ログイン ──
+                print(f"[{datetime.now()}] ログインページにアクセスします")
+                politeness.goto(page, f'{PRESCO_BASE_URL}/partner/', 'login', 'login_page', 60000)
+                adaptive_timeouts.settle(page, 'login', 'login_page_settle', 3000)
 
-            if not csv_clicked:
-                page.screenshot(path='/tmp/error_kango_item5_csv.png')
-                raise Exception("CSVダウンロードボタンが見つかりませんでした")
+                with adaptive_timeouts.step('login', 'login_form', 10000) as timeout:
+                    page.wait_for_selector('input[name="username"]', timeout=timeout)
+                page.fill('input[name="username"]', email)
+                page.fill('input[name="password"]', password)
 
-            download = download_info.value
-            csv_path = f'/tmp/presco_kango_item5_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-            download.save_as(csv_path)
+                with politeness.request(page.url) as ticket, adaptive_timeouts.step('login', 'login_submit', 60000) as timeout:
+                    with page.expect_navigation(timeout=timeout) as navigation:
+                        page.click('input[type="submit"][value="ログイン"]')
+                    ticket.response(navigation.value)
+                adaptive_timeouts.settle(page, 'login', 'login_submit_settle', 3000)
 
-            file_size = os.path.getsize(csv_path)
-            print(f"[{datetime.now()}] CSVダウンロード完了: {csv_path} ({file_size} bytes)")
+                current_url = page.url
+                print(f"[{datetime.now()}] 現在のURL: {current_url}")
+                if not any(x in current_url for x in ['home', 'actionLog', 'report']):
+                    page.screenshot(path='/tmp/login_error_kango_item5.png')
+                    raise Exception(f"ログインに失敗しました。URL: {current_url}")
 
-            if file_size == 0:
-                raise Exception("ダウンロードしたCSVファイルが空です")
+                print(f"[{datetime.now()}] ログインに成功しました")
 
-            return csv_path
+            return download_sites(page, site_ids, workers)
 
         except Exception as e:
             print(f"[{datetime.now()}] エラー: {str(e)}")
@@ -149,6 +152,60 @@ def login_and_download_csv():
             print(f"[{datetime.now()}] ブラウザを閉じました")
 
 
+def download_csv(page, site_id=PARTNER_SITE_ID):
+    """ログイン済みのページからCSVをダウンロードしてパスを返す"""
+    date_from, date_to = report_period()
+
+    with run_metrics.span('navigate', page='report/search'):
+        # ── レポートページに直接アクセス ──
+        print(f"[{datetime.now()}] レポートページにアクセスします")
+        print(f"[{datetime.now()}] サイト: {site_id} / 期間: {date_from} 〜 {date_to}")
+        print(f"[{datetime.now()}] searchItemType=5")
+        politeness.goto(page, report_url(site_id), REPORT_TYPE, 'report_page', 60000)
+        adaptive_timeouts.settle(page, REPORT_TYPE, 'report_page_settle', 5000)
+
+    with run_metrics.span('export') as s:
+        # ── CSVダウンロード ──
+        csv_clicked = False
+        for selector in CSV_SELECTORS:
+            try:
+                with adaptive_timeouts.step(REPORT_TYPE, 'csv_link', 10000, probe=True) as timeout:
+                    page.wait_for_selector(selector, state='visible', timeout=timeout)
+                print(f"[{datetime.now()}] CSVボタンを確認しました: {selector}")
+
+                with politeness.request(page.url, 'export'), adaptive_timeouts.step(REPORT_TYPE, 'csv_download', 60000) as timeout:
+                    with page.expect_download(timeout=timeout) as download_info:
+                        page.click(selector)
+
+                csv_clicked = True
+                break
+            except Exception:
+                continue
+
+        if not csv_clicked:
+            page.screenshot(path='/tmp/error_kango_item5_csv.png')
+            raise Exception("CSVダウンロードボタンが見つかりませんでした")
+
+        download = download_info.value
+        csv_path = f'/tmp/presco_kango_item5_{site_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        download.save_as(csv_path)
+
+        file_size = os.path.getsize(csv_path)
+        print(f"[{datetime.now()}] CSVダウンロード完了: {csv_path} ({file_size} bytes)")
+
+        if file_size == 0:
+            raise Exception("ダウンロードしたCSVファイルが空です")
+        s.set('bytes', file_size)
+
+    return csv_path
+
+
+def download_sites(page, site_ids, workers=partner_sites.SITE_WORKERS):
+    """各サイトのCSVを1回のログインのままダウンロードし、({サイトID: パス}, {失敗したサイトID: エラー}) を返す"""
+    return partner_sites.fetch(page, site_ids, report_url, CSV_SELECTORS, '/tmp/presco_kango_item5',
+                               download_csv, workers, REPORT_TYPE)
+
+
 # ============================================================
 #  CSVデータ整形（F列・G列・K列以降を抽出）
 # ============================================================
@@ -180,79 +237,177 @@ def extract_columns(data):
 
 
 # ============================================================
-#  スプレッドシートへ上書き
+#  CSV読み込み
 # ============================================================
 
-def upload_to_spreadsheet(csv_path):
-    print(f"[{datetime.now()}] スプレッドシートへのアップロードを開始します")
-
-    creds_json = os.environ.get('GOOGLE_CREDENTIALS')
-    if not creds_json:
-        raise Exception("環境変数 GOOGLE_CREDENTIALS が設定されていません")
-
-    creds_dict  = json.loads(creds_json)
-    scope       = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    gc          = gspread.authorize(credentials)
-
-    spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-
-    try:
-        worksheet = spreadsheet.worksheet(SHEET_NAME)
-        print(f"[{datetime.now()}] 既存シート '{SHEET_NAME}' を使用します")
-    except:
-        worksheet = spreadsheet.add_worksheet(title=SHEET_NAME, rows=5000, cols=30)
-        print(f"[{datetime.now()}] 新しいシート '{SHEET_NAME}' を作成しました")
-
-    # CSVを読み込む（文字コード自動判定）
+def read_csv(csv_path):
+    """CSVを読み込む（文字コード自動判定）"""
     encodings = ['utf-8-sig', 'utf-8', 'shift_jis', 'cp932']
-    data = None
     for encoding in encodings:
         try:
             with open(csv_path, 'r', encoding=encoding) as f:
                 data = list(csv.reader(f))
             print(f"[{datetime.now()}] CSVを {encoding} で読み込みました（{len(data)}行）")
-            break
+            run_metrics.set_attr('encoding', encoding)
+            return data
         except UnicodeDecodeError:
             continue
 
-    if data is None:
-        raise Exception("CSVファイルの読み込みに失敗しました")
+    raise Exception("CSVファイルの読み込みに失敗しました")
 
-    # ✅ F列・G列・K列以降を抽出
-    filtered_data = extract_columns(data)
-    print(f"[{datetime.now()}] F列・G列・K列以降を抽出しました（{len(filtered_data)}行）")
+
+# ============================================================
+#  スプレッドシートへ上書き
+# ============================================================
+
+def upload_to_spreadsheet(csv_path, run=checkpoints.NONE, sheet_name=SHEET_NAME, pipeline=None, full=None):
+    """
+    pipeline を渡すと、前回の書き込みから変わった行だけをシートに反映する（row_changes.py）
+    full に理由を渡すと、差分ではなくシート全体を書き直す
+    """
+    print(f"[{datetime.now()}] スプレッドシートへのアップロードを開始します")
+
+    worksheet = sheets_client.open_worksheet(SPREADSHEET_ID, sheet_name, rows=5000, cols=30)
+
+    with run_metrics.span('parse') as s:
+        data = run.stage('parse', read_csv, csv_path)
+        s.set('rows', len(data))
+
+    with run_metrics.span('transform') as s:
+        # ✅ F列・G列・K列以降を抽出
+        filtered_data = run.stage('transform', extract_columns, data)
+        print(f"[{datetime.now()}] F列・G列・K列以降を抽出しました（{len(filtered_data)}行）")
+        s.set('rows', len(filtered_data))
 
     # 先頭行をログで確認
     if filtered_data:
         print(f"[{datetime.now()}] ヘッダー確認: {filtered_data[0]}")
 
-    # シートをクリアして書き込み
-    print(f"[{datetime.now()}] シートをクリアして書き込みます")
-    worksheet.clear()
-
-    if filtered_data:
-        worksheet.update(values=filtered_data, range_name="A1")
-        print(f"[{datetime.now()}] 書き込み完了: {len(filtered_data)}行")
+    if pipeline is None:
+        # シートの中身を置き換え（ステージング経由で差し替え）
+        run.stage('publish', sheets_publisher.publish, worksheet, filtered_data, kind='marker')
+    else:
+        # 前回から追加・更新・削除された行だけを反映する
+        run.stage('publish', publish_changes, worksheet, pipeline, data, filtered_data, full, kind='marker')
 
     print(f"[{datetime.now()}] スプレッドシートURL: https://docs.google.com/spreadsheets/d/{SPREADSHEET_ID}")
 
 
+def cdc_key_columns(header):
+    """CDC_KEY_COLUMNS の列インデックス（ヘッダーにない列があれば None）"""
+    if not all(name in header for name in CDC_KEY_COLUMNS):
+        return None
+    return [header.index(name) for name in CDC_KEY_COLUMNS]
+
+
+def publish_changes(worksheet, pipeline, data, filtered_data, full=None):
+    """前回の書き込みからの差分だけをシートに反映し、変更履歴に残す（初回・変更が多いときは全体を書き直す）"""
+    header      = data[0] if data else []
+    key_columns = cdc_key_columns(header)
+    if key_columns is None:
+        # CSVの列が変わった場合など。行を特定できないので差分は使わず全体を書き直す
+        missing = [name for name in CDC_KEY_COLUMNS if name not in header]
+        print(f"[{datetime.now()}] 警告: 変更の検出に使う列がCSVにありません（{', '.join(missing)}）。"
+              f"シート全体を書き直します")
+        with run_metrics.span('cdc') as s:
+            s.set('full', f"キーの列がありません: {', '.join(missing)}")
+        sheets_publisher.publish(worksheet, filtered_data)
+        with row_changes.Snapshots() as snapshots:
+            # 前回の記録は今のシートと合わなくなるので消す（キーの列が戻ったら全体の書き直しから始める）
+            snapshots.forget(pipeline)
+        return
+
+    with row_changes.Snapshots() as snapshots:
+        with run_metrics.span('cdc') as s:
+            changes = snapshots.diff(pipeline, data, filtered_data, key_columns, full)
+            if not changes.full and worksheet.row_count != changes.previous + 1:
+                # 手で行を足し引きされた場合など。行の位置が記録と合わないので全体を書き直す
+                changes = snapshots.diff(pipeline, data, filtered_data, key_columns,
+                                         f"シートの行数（{worksheet.row_count}行）が前回の記録と合いません")
+            s.set('inserted', len(changes.inserted)).set('updated', len(changes.updated)).set('deleted', len(changes.deleted))
+            if changes.full:
+                s.set('full', changes.full)
+        print(f"[{datetime.now()}] 前回からの変更: 追加 {len(changes.inserted)}行 / 更新 {len(changes.updated)}行 / "
+              f"削除 {len(changes.deleted)}行")
+
+        if changes.full:
+            print(f"[{datetime.now()}] シート全体を書き直します（{changes.full}）")
+            sheets_publisher.publish(worksheet, filtered_data)
+        else:
+            sheets_publisher.apply_changes(worksheet, *changes.patch(), cols=sheets_publisher.grid_size(filtered_data)[1])
+
+        try:
+            snapshots.commit(changes, row_changes.current_run_id())
+        except Exception as e:
+            # シートへの書き込みは済んでいるので同期は失敗させない（記録を消し、次回は全体を書き直す）
+            print(f"[{datetime.now()}] 警告: 変更の記録に失敗しました - {str(e)}")
+            try:
+                snapshots.forget(pipeline)
+            except Exception:
+                pass
+
+
+def dry_run(csv_path, output=None):
+    """シートには書き込まず、変換結果をローカルに出力する"""
+    with run_metrics.span('parse') as s:
+        data = read_csv(csv_path)
+        s.set('rows', len(data))
+
+    with run_metrics.span('transform') as s:
+        filtered_data = extract_columns(data)
+        s.set('rows', len(filtered_data))
+
+    local_output.write(filtered_data, output)
+
+
 # ============================================================
 #  メイン
 # ============================================================
 
+def build_parser():
+    parser = argparse.ArgumentParser(description="Presco看護レポート（itemType=5）同期")
+    profiling.add_arguments(parser)
+    network_accounting.add_arguments(parser)
+    checkpoints.add_arguments(parser)
+    download_cache.add_arguments(parser)
+    local_output.add_arguments(parser)
+    raw_archive.add_arguments(parser)
+    row_changes.add_arguments(parser)
+    partner_sites.add_arguments(parser)
+    return parser
+
+
+def open_site_run(args, site_id):
+    """サイトごとのチェックポイント（レポート条件が同じなら前回の途中から再開する）"""
+    date_from, date_to = report_period()
+    return checkpoints.open_run(PIPELINE, args, report='report', item_type=5, site=site_id,
+                                days_back=DAYS_BACK, date_to=date_to)
+
+
+def sync(args, session=None):
+    """1回分の同期処理（session を渡すと、起動済み・ログイン済みのブラウザを使う）"""
+    partner_sites.run_sites(sys.modules[__name__], args, session)
+
+
+def upload_site(args, site_id, csv_path, run, pipeline):
+    """1サイト分の書き込み（partner_sites.publish_site から呼ばれる）"""
+    with run_metrics.span('upload'):
+        upload_to_spreadsheet(csv_path, run, partner_sites.sheet_name(SHEET_NAME, site_id, PARTNER_SITE_ID),
+                              pipeline=None if args.no_cdc else pipeline,
+                              full='--force-publish が指定されました' if args.force_publish else None)
+
+
 def main():
+    args = build_parser().parse_args()
+    profiling.enable_from_args(args)
+    network_accounting.enable_from_args(args)
+
     try:
         print("=" * 60)
         print(f"[{datetime.now()}] Presco看護レポート（itemType=5）同期を開始します")
         print("=" * 60)
 
-        csv_path = login_and_download_csv()
-        upload_to_spreadsheet(csv_path)
+        sync(args)
 
         print("=" * 60)
         print(f"[{datetime.now()}] すべての処理が正常に完了しました")
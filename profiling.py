@@ -0,0 +1,172 @@
+# profiling.py
+# ステージ（run_metrics のスパン）ごとの cProfile / tracemalloc 計測
+#
+#   python presco_kango.py --profile                 # /tmp/presco_profile に出力
+#   python presco_kango.py --profile ./prof --profile-top 40
+#
+# 出力（run_id ごとのディレクトリ）:
+#   03_upload.parse.pstats       … cProfile の結果（python -m pstats / snakeviz で開く）
+#   03_upload.parse.alloc.txt    … そのステージで増えたメモリの上位N行（tracemalloc）
+#
+# 各ステージの .pstats にはそのステージ自身の処理だけが入る。
+# 子ステージの実行中は親のプロファイラを止め、子が終わったら再開する
+# （cProfile は同時に1つしか動かせないため）。
+# enable() を呼ばない限り run_metrics にフックは登録されず、計測の負荷はかからない。
+
+import os
+import re
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+import run_metrics
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+DEFAULT_PROFILE_DIR = os.environ.get('PRESCO_PROFILE_DIR', '/tmp/presco_profile')
+DEFAULT_TOP         = 25
+
+# 計測自体によるメモリ確保は集計から除く
+_ALLOC_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+]
+
+
+# ============================================================
+#  プロファイラ
+# ============================================================
+
+class StageProfiler:
+
+    def __init__(self, output_dir=DEFAULT_PROFILE_DIR, top=DEFAULT_TOP):
+        self.output_dir = output_dir
+        self.top        = top
+        self.files      = []
+        self._local     = threading.local()   # スレッドごとの計測中ステージのスタック
+        self._lock      = threading.Lock()
+        self._seq       = 0
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, span):
+        stack = self._stack()
+        if stack:
+            stack[-1]['profiler'].disable()
+
+        path = [frame['name'] for frame in stack] + [span.name]
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+
+        frame = {
+            'name':     span.name,
+            'path':     path,
+            'seq':      seq,
+            'snapshot': tracemalloc.take_snapshot().filter_traces(_ALLOC_FILTERS),
+            'traced':   tracemalloc.get_traced_memory()[0],
+            'profiler': cProfile.Profile(),
+        }
+        stack.append(frame)
+        frame['profiler'].enable()
+
+    def exit(self, span):
+        stack = self._stack()
+        frame = stack.pop()
+        frame['profiler'].disable()
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(_ALLOC_FILTERS)
+        traced   = tracemalloc.get_traced_memory()[0]
+        delta    = traced - frame['traced']
+        span.set('mem_delta_kb', round(delta / 1024, 1))
+
+        try:
+            base = self._write(span, frame, snapshot, delta)
+            span.set('profile', os.path.basename(base))
+        except OSError as e:
+            # プロファイルの保存失敗で同期処理自体を失敗させない
+            print(f"[{datetime.now()}] 警告: プロファイルの保存に失敗しました - {str(e)}")
+
+        if stack:
+            stack[-1]['profiler'].enable()
+        elif span.parent_id is None:
+            self._print_summary(span)
+
+    def _write(self, span, frame, snapshot, delta):
+        directory = os.path.join(self.output_dir, span.run_id)
+        os.makedirs(directory, exist_ok=True)
+
+        # ルート（パイプライン名）はファイル名から省く
+        label = '.'.join(frame['path'][1:]) or frame['path'][0]
+        label = re.sub(r'[^0-9A-Za-z_.-]', '_', label)
+        base  = os.path.join(directory, f"{frame['seq']:02d}_{label}")
+
+        frame['profiler'].dump_stats(base + '.pstats')
+
+        stats = snapshot.compare_to(frame['snapshot'], 'lineno')
+        with open(base + '.alloc.txt', 'w', encoding='utf-8') as f:
+            f.write(f"# ステージ: {' > '.join(frame['path'])}\n")
+            f.write(f"# 増加したメモリ（合計）: {delta / 1024:+.1f} KiB\n")
+            f.write(f"# 上位 {self.top} 行\n")
+            for stat in stats[:self.top]:
+                f.write(f"{stat}\n")
+
+        with self._lock:
+            self.files.append(base + '.pstats')
+        return base
+
+    def _print_summary(self, root):
+        directory = os.path.join(self.output_dir, root.run_id)
+        print(f"[{datetime.now()}] プロファイルを保存しました: {directory}（{len(self.files)}ステージ）")
+        print(f"  確認方法: python -m pstats {directory}/<ファイル名>.pstats")
+
+
+_profiler = None
+
+
+def enable(output_dir=DEFAULT_PROFILE_DIR, top=DEFAULT_TOP, frames=1):
+    """以降の run_metrics のスパンを cProfile / tracemalloc で計測する"""
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    _profiler = StageProfiler(output_dir, top)
+    run_metrics.add_hook(_profiler)
+    print(f"[{datetime.now()}] プロファイルモードで実行します（出力先: {output_dir}）")
+    return _profiler
+
+
+def disable():
+    global _profiler
+    if _profiler is None:
+        return
+    run_metrics.remove_hook(_profiler)
+    _profiler = None
+    tracemalloc.stop()
+
+
+# ============================================================
+#  コマンドライン引数
+# ============================================================
+
+def add_arguments(parser):
+    """各スクリプトの argparse に --profile / --profile-top を追加する"""
+    parser.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_DIR, metavar='DIR',
+                        help=f"ステージごとに cProfile / tracemalloc で計測する（出力先の既定: {DEFAULT_PROFILE_DIR}）")
+    parser.add_argument('--profile-top', type=int, default=DEFAULT_TOP, metavar='N',
+                        help="メモリ確保の上位何行を出力するか")
+
+
+def enable_from_args(args):
+    if args.profile:
+        enable(args.profile, args.profile_top)
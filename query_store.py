@@ -0,0 +1,414 @@
+# query_store.py
+# 成果（actionLog）とクリック（clickLog）を検索するためのローカルDB（SQLite）
+#
+# 各同期の実行時にダウンロードした行を取り込み、シートを探さなくても
+# gclid の検索・サイト別日別の件数・成果のないクリックをすぐに調べられるようにする。
+#   ・成果は成果ID、クリックはクリックIDをキーに上書き（期間が重なる取り込みでも重複しない）
+#   ・gclid / サイト名 / 成果発生日時 / 成果判定日時 / クリック日時にインデックスを張る
+#
+#   store = query_store.Store()
+#   store.find_gclid('Cj0KCQ...')
+#   store.daily_counts(site='Fast Baito 看護特化', date_from='2025-01-01', by='judge')
+#
+#   python query_store.py gclid Cj0KCQ...
+#   python query_store.py daily --site "Fast Baito 看護特化" --from 2025-01-01 --by judge
+#   python query_store.py unconverted --from 2025-01-01 --limit 20
+#   python query_store.py load actionLog /tmp/presco_data_20250101_120000.csv
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from datetime import datetime
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+STORE_PATH = os.environ.get('PRESCO_STORE_PATH', '/tmp/presco_store.db')
+
+# actionLog の列（インデックス）
+ACTION_ID       = 0    # A列: 成果ID
+ACTION_CLICKED  = 1    # B列: クリック日時
+ACTION_PROGRAM  = 2    # C列: プログラム名
+ACTION_AT       = 3    # D列: 成果発生日時
+ACTION_JUDGED   = 4    # E列: 成果判定日時
+ACTION_SITE     = 5    # F列: サイト名
+ACTION_STATUS   = 9    # J列: ステータス
+ACTION_REFERRER = 12   # M列: リファラ
+ACTION_REWARD   = 17   # R列: 成果報酬
+
+# clickLog の列（インデックス）
+CLICK_ID        = 0    # A列: クリックID
+CLICK_AT        = 1    # B列: クリック日時
+CLICK_PROGRAM   = 3    # D列: プログラム名
+CLICK_SITE_ID   = 5    # F列: サイトID
+CLICK_SITE      = 6    # G列: サイト名
+CLICK_REFERRER  = 10   # K列: リファラ
+
+KINDS = ('actionLog', 'clickLog')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversions (
+        action_id    TEXT PRIMARY KEY,
+        clicked_at   TEXT NOT NULL,
+        program_name TEXT NOT NULL,
+        action_at    TEXT NOT NULL,
+        judged_at    TEXT NOT NULL,
+        site_name    TEXT NOT NULL,
+        status       TEXT NOT NULL,
+        gclid        TEXT NOT NULL,
+        reward       INTEGER NOT NULL,
+        loaded_at    TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS conversions_gclid     ON conversions (gclid);
+    CREATE INDEX IF NOT EXISTS conversions_site      ON conversions (site_name, action_at);
+    CREATE INDEX IF NOT EXISTS conversions_action_at ON conversions (action_at);
+    CREATE INDEX IF NOT EXISTS conversions_judged_at ON conversions (judged_at);
+
+    CREATE TABLE IF NOT EXISTS clicks (
+        click_id     TEXT PRIMARY KEY,
+        clicked_at   TEXT NOT NULL,
+        program_name TEXT NOT NULL,
+        site_id      TEXT NOT NULL,
+        site_name    TEXT NOT NULL,
+        gclid        TEXT NOT NULL,
+        loaded_at    TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS clicks_gclid      ON clicks (gclid);
+    CREATE INDEX IF NOT EXISTS clicks_site       ON clicks (site_name, clicked_at);
+    CREATE INDEX IF NOT EXISTS clicks_clicked_at ON clicks (clicked_at);
+"""
+
+
+# ============================================================
+#  値の正規化
+# ============================================================
+
+def _cell(row, index):
+    return row[index].strip() if len(row) > index else ''
+
+
+def _timestamp(value):
+    """'2025/01/02 12:34:56' → '2025-01-02 12:34:56'（日付の範囲指定と並べ替えをそのまま行えるように）"""
+    value = (value or '').strip().split('+')[0].strip()
+    for fmt in ('%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    return value
+
+
+def _gclid(url):
+    match = re.search(r'gclid=([^&]+)', url or '')
+    return match.group(1) if match else ''
+
+
+def _reward(value):
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        return 0
+
+
+def _natural_key(row, index):
+    """成果ID・クリックIDがない行は、行全体のハッシュをキーにする"""
+    key = _cell(row, index)
+    return key or 'sha1:' + hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest()[:16]
+
+
+def _date_bounds(date_from, date_to):
+    """'YYYY-MM-DD'（'/' 区切りも可）の範囲 → 日時の文字列で比較する条件の値"""
+    lower = _timestamp(date_from)[:10] if date_from else '0000-00-00'
+    upper = _timestamp(date_to)[:10] + ' 99' if date_to else '9999-99-99'
+    return lower, upper
+
+
+# ============================================================
+#  ストア
+# ============================================================
+
+class Store:
+
+    def __init__(self, path=STORE_PATH):
+        if path != ':memory:':
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._db  = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ── 取り込み ──
+
+    def load(self, kind, rows):
+        """CSVの行（先頭行はヘッダー）を取り込み、追加・更新した行数を返す"""
+        if kind == 'actionLog':
+            return self.load_action_log(rows)
+        if kind == 'clickLog':
+            return self.load_click_log(rows)
+        raise Exception(f"不明な取り込み種別です: {kind}")
+
+    def load_action_log(self, rows):
+        loaded_at = datetime.now().isoformat(timespec='seconds')
+        records = [
+            (
+                _natural_key(row, ACTION_ID),
+                _timestamp(_cell(row, ACTION_CLICKED)),
+                _cell(row, ACTION_PROGRAM),
+                _timestamp(_cell(row, ACTION_AT)),
+                _timestamp(_cell(row, ACTION_JUDGED)),
+                _cell(row, ACTION_SITE),
+                _cell(row, ACTION_STATUS),
+                _gclid(_cell(row, ACTION_REFERRER)),
+                _reward(_cell(row, ACTION_REWARD)),
+                loaded_at,
+            )
+            for row in rows[1:] if row
+        ]
+        # 内容が変わっていない行は書き換えない（重なった期間の再取り込みを安く済ませる）
+        return self._upsert('conversions', 'action_id', [
+            'action_id', 'clicked_at', 'program_name', 'action_at', 'judged_at',
+            'site_name', 'status', 'gclid', 'reward', 'loaded_at',
+        ], records)
+
+    def load_click_log(self, rows):
+        loaded_at = datetime.now().isoformat(timespec='seconds')
+        records = [
+            (
+                _natural_key(row, CLICK_ID),
+                _timestamp(_cell(row, CLICK_AT)),
+                _cell(row, CLICK_PROGRAM),
+                _cell(row, CLICK_SITE_ID),
+                _cell(row, CLICK_SITE),
+                _gclid(_cell(row, CLICK_REFERRER)),
+                loaded_at,
+            )
+            for row in rows[1:] if row
+        ]
+        return self._upsert('clicks', 'click_id', [
+            'click_id', 'clicked_at', 'program_name', 'site_id', 'site_name', 'gclid', 'loaded_at',
+        ], records)
+
+    def _upsert(self, table, key, columns, records):
+        compared = [c for c in columns if c not in (key, 'loaded_at')]
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT ({key}) DO UPDATE SET "
+            + ', '.join(f"{c} = excluded.{c}" for c in columns if c != key)
+            + " WHERE " + ' OR '.join(f"{c} IS NOT excluded.{c}" for c in compared)
+        )
+        with self._db:
+            before = self._db.total_changes
+            self._db.executemany(sql, records)
+            changed = self._db.total_changes - before
+        print(f"[{datetime.now()}] 検索用DBに取り込みました: {table} {len(records)}行（追加・更新 {changed}行）")
+        return changed
+
+    # ── 検索 ──
+
+    def query(self, sql, params=()):
+        """任意のSQLを実行し、(列名のリスト, 行のリスト) を返す"""
+        cursor = self._db.execute(sql, params)
+        names  = [d[0] for d in cursor.description or []]
+        return names, cursor.fetchall()
+
+    def find_gclid(self, gclid):
+        """gclid に一致する成果とクリック"""
+        return {
+            'conversions': self._dicts(
+                'SELECT * FROM conversions WHERE gclid = ? ORDER BY action_at', (gclid,)),
+            'clicks': self._dicts(
+                'SELECT * FROM clicks WHERE gclid = ? ORDER BY clicked_at', (gclid,)),
+        }
+
+    def daily_counts(self, site=None, date_from=None, date_to=None, by='action'):
+        """
+        サイト別・日別の成果件数と報酬合計
+          by='action' : 成果発生日時で集計
+          by='judge'  : 成果判定日時で集計
+        """
+        column = {'action': 'action_at', 'judge': 'judged_at'}.get(by)
+        if column is None:
+            raise Exception(f"不明な集計基準です: {by}")
+        lower, upper = _date_bounds(date_from, date_to)
+        sql = (
+            f"SELECT substr({column}, 1, 10) AS day, site_name, COUNT(*) AS conversions, "
+            f"SUM(reward) AS reward FROM conversions WHERE {column} >= ? AND {column} < ?"
+        )
+        params = [lower, upper]
+        if site:
+            sql += " AND site_name = ?"
+            params.append(site)
+        sql += " GROUP BY day, site_name ORDER BY day, site_name"
+        return self._dicts(sql, params)
+
+    def clicks_without_conversion(self, date_from=None, date_to=None, site=None, limit=None):
+        """gclid があるのに、同じ gclid の成果がないクリック"""
+        lower, upper = _date_bounds(date_from, date_to)
+        sql = (
+            "SELECT k.* FROM clicks k WHERE k.gclid != '' AND k.clicked_at >= ? AND k.clicked_at < ? "
+            "AND NOT EXISTS (SELECT 1 FROM conversions c WHERE c.gclid = k.gclid)"
+        )
+        params = [lower, upper]
+        if site:
+            sql += " AND k.site_name = ?"
+            params.append(site)
+        sql += " ORDER BY k.clicked_at"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._dicts(sql, params)
+
+    def iter_conversions(self, date_from=None, date_to=None, site=None):
+        """gclid がある成果を (action_id, gclid, action_at, site_name, reward) で1行ずつ返す（全件をメモリに載せない）"""
+        lower, upper = _date_bounds(date_from, date_to)
+        sql = ("SELECT action_id, gclid, action_at, site_name, reward FROM conversions "
+               "WHERE gclid != '' AND action_at >= ? AND action_at < ?")
+        params = [lower, upper]
+        if site:
+            sql += " AND site_name = ?"
+            params.append(site)
+        yield from self._db.execute(sql, params)
+
+    def iter_clicks(self, date_from=None, date_to=None, site=None):
+        """gclid があるクリックを (click_id, gclid, clicked_at, site_name) で1行ずつ返す"""
+        lower, upper = _date_bounds(date_from, date_to)
+        sql = ("SELECT click_id, gclid, clicked_at, site_name FROM clicks "
+               "WHERE gclid != '' AND clicked_at >= ? AND clicked_at < ?")
+        params = [lower, upper]
+        if site:
+            sql += " AND site_name = ?"
+            params.append(site)
+        yield from self._db.execute(sql, params)
+
+    def stats(self):
+        result = {'path': self.path}
+        for table, column in (('conversions', 'action_at'), ('clicks', 'clicked_at')):
+            count, first, last = self._db.execute(
+                f"SELECT COUNT(*), MIN({column}), MAX({column}) FROM {table}").fetchone()
+            result[table] = {'rows': count, 'first': first, 'last': last}
+        return result
+
+    def _dicts(self, sql, params=()):
+        names, rows = self.query(sql, params)
+        return [dict(zip(names, row)) for row in rows]
+
+
+# ============================================================
+#  コマンドライン引数（各スクリプト用）
+# ============================================================
+
+def add_arguments(parser):
+    parser.add_argument('--no-store', action='store_true',
+                        help="ダウンロードした行を検索用DBに取り込まない")
+
+
+def read_csv(csv_path):
+    """保存済みのCSVを読み込む（各スクリプトの read_csv と同じく文字コードを順に試す）"""
+    for encoding in ['utf-8-sig', 'utf-8', 'shift_jis', 'cp932']:
+        try:
+            with open(csv_path, encoding=encoding) as f:
+                return list(csv.reader(f))
+        except UnicodeDecodeError:
+            continue
+    raise Exception("CSVファイルの読み込みに失敗しました")
+
+
+def load_quietly(kind, rows, path=STORE_PATH):
+    """同期処理から呼ぶ用。取り込みの失敗で同期自体は失敗させない"""
+    try:
+        with Store(path) as store:
+            return store.load(kind, rows)
+    except Exception as e:
+        print(f"[{datetime.now()}] 警告: 検索用DBへの取り込みに失敗しました - {str(e)}")
+        return 0
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def _print_rows(rows, as_json):
+    if as_json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    if not rows:
+        print("（該当なし）")
+        return
+    writer = csv.writer(sys.stdout)
+    writer.writerow(list(rows[0]))
+    for row in rows:
+        writer.writerow(list(row.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="成果・クリックの検索用DB")
+    parser.add_argument('--db', default=STORE_PATH, help="DBファイルのパス")
+    parser.add_argument('--json', action='store_true', help="結果をJSONで出力する")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('stats', help="件数と期間")
+
+    p = sub.add_parser('gclid', help="gclid に一致する成果とクリック")
+    p.add_argument('gclid')
+
+    p = sub.add_parser('daily', help="サイト別・日別の成果件数")
+    p.add_argument('--site')
+    p.add_argument('--from', dest='date_from', help="YYYY-MM-DD")
+    p.add_argument('--to', dest='date_to', help="YYYY-MM-DD")
+    p.add_argument('--by', choices=['action', 'judge'], default='action',
+                   help="集計に使う日時（action: 成果発生日時 / judge: 成果判定日時）")
+
+    p = sub.add_parser('unconverted', help="成果のないクリック")
+    p.add_argument('--site')
+    p.add_argument('--from', dest='date_from', help="YYYY-MM-DD")
+    p.add_argument('--to', dest='date_to', help="YYYY-MM-DD")
+    p.add_argument('--limit', type=int)
+
+    p = sub.add_parser('sql', help="任意のSQLを実行する")
+    p.add_argument('statement')
+
+    p = sub.add_parser('load', help="保存済みのCSVを取り込む")
+    p.add_argument('kind', choices=KINDS)
+    p.add_argument('csv_path')
+
+    args = parser.parse_args()
+
+    with Store(args.db) as store:
+        started = time.perf_counter()
+        if args.command == 'stats':
+            print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+        elif args.command == 'gclid':
+            print(json.dumps(store.find_gclid(args.gclid), ensure_ascii=False, indent=2))
+        elif args.command == 'daily':
+            _print_rows(store.daily_counts(args.site, args.date_from, args.date_to, args.by), args.json)
+        elif args.command == 'unconverted':
+            _print_rows(store.clicks_without_conversion(args.date_from, args.date_to, args.site, args.limit),
+                        args.json)
+        elif args.command == 'sql':
+            names, rows = store.query(args.statement)
+            _print_rows([dict(zip(names, row)) for row in rows], args.json)
+        elif args.command == 'load':
+            store.load(args.kind, read_csv(args.csv_path))
+        print(f"[{datetime.now()}] {(time.perf_counter() - started) * 1000:.1f}ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
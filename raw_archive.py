@@ -0,0 +1,396 @@
+# raw_archive.py
+# ダウンロードした生データ（CSVの全行）を蓄積するローカルの列指向アーカイブ
+#
+# シートは毎回上書きされるため、過去の推移を見るには Presco から取り直すしかなかった。
+# 各実行の生データをここに追記しておき、履歴の分析はアーカイブだけで行えるようにする。
+#
+# 構成:
+#   PRESCO_ARCHIVE_DIR/<種別>/date=YYYY-MM-DD/part-<日時>-<乱数>.pcol
+#   ・種別（actionLog / report / report_item5 / clickLog）と日付でパーティションを分ける
+#   ・.pcol は列ごとに zlib 圧縮したファイル。必要な列だけを読める
+#   ・行は種別ごとの自然キー（NATURAL_KEYS: 成果ID・クリックID など）で同じ行とみなす
+#     追記時に、同じキーの最新の版と全列が同じ行は取り除き、変わった行（ステータスの変更など）は新しい版として追記する
+#   ・scan() は同じキーの行のうち最後に追記された版だけを返す（all_versions=True なら全版）
+#
+#   rows = raw_archive.scan('actionLog', columns=['サイト名', '成果報酬'],
+#                           date_from='2025-01-01', date_to='2025-03-31')
+#
+#   python raw_archive.py stats
+#   python raw_archive.py scan actionLog --from 2025-01-01 --to 2025-03-31 --columns サイト名 成果報酬
+#   python raw_archive.py compact actionLog
+
+import os
+import csv
+import sys
+import json
+import zlib
+import struct
+import hashlib
+import secrets
+import argparse
+from datetime import datetime
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+ARCHIVE_DIR = os.environ.get('PRESCO_ARCHIVE_DIR', '/tmp/presco_archive')
+
+# 種別ごとの、パーティションの日付に使う列（インデックス）
+DATE_COLUMNS = {
+    'actionLog':    3,   # D列: 成果発生日時
+    'report':       0,   # A列: 集計期間
+    'report_item5': 0,
+    'clickLog':     1,   # B列: クリック日時
+}
+
+# レポートの1行を特定する軸（列名）。presco_kango_item5.py の変更検出（CDC_KEY_COLUMNS）も同じキーを使う
+REPORT_KEY_COLUMNS = ['集計期間', 'プログラムID', '広告ID', 'サイトID', 'ページID']
+
+# 種別ごとの、同じ行（の新しい版）とみなすキーの列（列名）
+# キーの列がないCSVは、全列が同じ行だけを同じ行とみなす
+NATURAL_KEYS = {
+    'actionLog':    ['成果ID'],
+    'report':       REPORT_KEY_COLUMNS,
+    'report_item5': REPORT_KEY_COLUMNS,
+    'clickLog':     ['クリックID'],
+}
+
+UNKNOWN_DATE = 'unknown'
+KEY_COLUMN   = '_key'    # 重複判定用に保存する行のハッシュ
+
+MAGIC          = b'PCOL1\n'
+COMPRESS_LEVEL = 6
+
+
+# ============================================================
+#  列指向ファイル（.pcol）
+# ============================================================
+# [MAGIC][ヘッダー長 8バイト][ヘッダーJSON][列1][列2]...
+# ヘッダー: {"columns": [...], "rows": N, "created_at": ..., "chunks": [[offset, length], ...]}
+# 各列は値のリストを JSON にして zlib で圧縮したもの（offset はヘッダーの直後から数える）
+
+def _write_segment(path, columns, column_values):
+    blobs  = [zlib.compress(json.dumps(values, ensure_ascii=False).encode('utf-8'), COMPRESS_LEVEL)
+              for values in column_values]
+    chunks = []
+    offset = 0
+    for blob in blobs:
+        chunks.append([offset, len(blob)])
+        offset += len(blob)
+
+    header = json.dumps({
+        'columns':    columns,
+        'rows':       len(column_values[0]) if column_values else 0,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'chunks':     chunks,
+    }, ensure_ascii=False).encode('utf-8')
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('>Q', len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+
+
+class Segment:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception(f"アーカイブのファイル形式が不正です: {path}")
+            (length,) = struct.unpack('>Q', f.read(8))
+            self.header = json.loads(f.read(length).decode('utf-8'))
+        self.data_start = len(MAGIC) + 8 + length
+        self.columns    = self.header['columns']
+        self.rows       = self.header['rows']
+
+    def read(self, names):
+        """指定した列だけを読み込む（ファイルにない列は空文字で埋める）"""
+        result = []
+        with open(self.path, 'rb') as f:
+            for name in names:
+                if name not in self.columns:
+                    result.append([''] * self.rows)
+                    continue
+                offset, length = self.header['chunks'][self.columns.index(name)]
+                f.seek(self.data_start + offset)
+                result.append(json.loads(zlib.decompress(f.read(length)).decode('utf-8')))
+        return result
+
+
+# ============================================================
+#  パーティション
+# ============================================================
+
+def _kind_dir(kind, base_dir=ARCHIVE_DIR):
+    return os.path.join(base_dir, kind)
+
+
+def _partition_date(value):
+    """'2025/01/02 12:34:56' / '2025/01/02' / '2025-01-02' → '2025-01-02'"""
+    day = (value or '').strip().split(' ')[0].replace('/', '-')
+    try:
+        return datetime.strptime(day, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return UNKNOWN_DATE
+
+
+def partitions(kind, date_from=None, date_to=None, base_dir=ARCHIVE_DIR):
+    """日付の範囲に入るパーティション（日付, ディレクトリ）を返す（範囲外のディレクトリは読まない）"""
+    directory = _kind_dir(kind, base_dir)
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in sorted(os.listdir(directory)):
+        if not name.startswith('date='):
+            continue
+        day = name[len('date='):]
+        if day != UNKNOWN_DATE:
+            if date_from and day < date_from:
+                continue
+            if date_to and day > date_to:
+                continue
+        elif date_from or date_to:
+            continue
+        result.append((day, os.path.join(directory, name)))
+    return result
+
+
+def _segments(partition_dir):
+    return [Segment(os.path.join(partition_dir, name))
+            for name in sorted(os.listdir(partition_dir)) if name.endswith('.pcol')]
+
+
+def _segment_name():
+    # 同じ秒に追記しても、名前の順が追記の順になるようにマイクロ秒まで入れる
+    return f"part-{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{secrets.token_hex(4)}.pcol"
+
+
+def _row_key(row):
+    return hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest()[:16]
+
+
+def _key_columns(kind, columns):
+    """自然キーの列のインデックス（キーの列が揃っていなければ None）"""
+    names = NATURAL_KEYS.get(kind)
+    if not names or not all(name in columns for name in names):
+        return None
+    return [columns.index(name) for name in names]
+
+
+def _versions(kind, segment):
+    """セグメントの各行の (自然キー, 全列のハッシュ)"""
+    keys = segment.read([KEY_COLUMN])[0]
+    if _key_columns(kind, segment.columns) is None:
+        return [(key, key) for key in keys]
+    return list(zip(zip(*segment.read(NATURAL_KEYS[kind])), keys))
+
+
+# ============================================================
+#  追記
+# ============================================================
+
+def append(kind, rows, base_dir=ARCHIVE_DIR):
+    """
+    CSVの行（先頭行はヘッダー）をアーカイブに追記する
+    同じパーティションにある同じ自然キーの最新の版と、全列が同じ行は追記しない。追記した行数を返す
+    """
+    if kind not in DATE_COLUMNS:
+        raise Exception(f"不明なアーカイブ種別です: {kind}")
+    if not rows:
+        return 0
+
+    header   = list(rows[0])
+    date_col = DATE_COLUMNS[kind]
+    width    = len(header)
+    key_cols = _key_columns(kind, header)
+
+    grouped = {}
+    for row in rows[1:]:
+        if not row:
+            continue
+        row = (list(row) + [''] * width)[:width]
+        day = _partition_date(row[date_col] if date_col < len(row) else '')
+        grouped.setdefault(day, []).append(row)
+
+    added   = 0
+    updated = 0
+    skipped = 0
+    for day, day_rows in sorted(grouped.items()):
+        partition_dir = os.path.join(_kind_dir(kind, base_dir), f'date={day}')
+        os.makedirs(partition_dir, exist_ok=True)
+
+        # 重複判定は自然キーとハッシュの列だけを読む（自然キーごとの最新の版のハッシュ）
+        latest = {}
+        for segment in _segments(partition_dir):
+            latest.update(_versions(kind, segment))
+
+        new_rows = []
+        new_keys = []
+        for row in day_rows:
+            key    = _row_key(row)
+            row_id = key if key_cols is None else tuple(row[i] for i in key_cols)
+            if latest.get(row_id) == key:
+                skipped += 1
+                continue
+            if row_id in latest:
+                updated += 1
+            latest[row_id] = key
+            new_rows.append(row)
+            new_keys.append(key)
+        if not new_rows:
+            continue
+
+        column_values = [list(col) for col in zip(*new_rows)] + [new_keys]
+        _write_segment(os.path.join(partition_dir, _segment_name()), header + [KEY_COLUMN], column_values)
+        added += len(new_rows)
+
+    print(f"[{datetime.now()}] アーカイブに追記しました: {kind} {added}行"
+          f"（うち更新 {updated}行。変更のない {skipped}行を除外）")
+    return added
+
+
+# ============================================================
+#  読み出し
+# ============================================================
+
+def scan(kind, columns=None, date_from=None, date_to=None, base_dir=ARCHIVE_DIR, all_versions=False):
+    """
+    アーカイブの行を返すジェネレーター
+      columns      : 読む列名のリスト（None なら全列。指定した列以外は読み込まない）
+      date_from    : 'YYYY-MM-DD'（これより前のパーティションは読まない）
+      date_to      : 'YYYY-MM-DD'（これより後のパーティションは読まない）
+      all_versions : True なら同じ自然キーの古い版も返す（既定は最後に追記された版だけ）
+    各行は columns の順に並んだ値のリスト（columns を省略したときは column_names() の順）
+    """
+    names = columns or column_names(kind, base_dir)
+    for day, partition_dir in partitions(kind, date_from, date_to, base_dir):
+        if all_versions:
+            for segment in _segments(partition_dir):
+                for row in zip(*segment.read(names)):
+                    yield list(row)
+            continue
+        # 同じ自然キーの行は、後のファイル・後の行ほど新しい版
+        latest = {}
+        for segment in _segments(partition_dir):
+            for (row_id, _), row in zip(_versions(kind, segment), zip(*segment.read(names))):
+                latest[row_id] = list(row)
+        yield from latest.values()
+
+
+def column_names(kind, base_dir=ARCHIVE_DIR):
+    """アーカイブにある列名（最初に見つかったファイルのヘッダー）"""
+    for _, partition_dir in partitions(kind, base_dir=base_dir):
+        for segment in _segments(partition_dir):
+            return [c for c in segment.columns if c != KEY_COLUMN]
+    return []
+
+
+def compact(kind, base_dir=ARCHIVE_DIR):
+    """パーティションごとに複数のファイルを1つにまとめる"""
+    merged = 0
+    for day, partition_dir in partitions(kind, base_dir=base_dir):
+        segments = _segments(partition_dir)
+        if len(segments) < 2:
+            continue
+        names = []
+        for segment in segments:
+            names += [c for c in segment.columns if c not in names]
+        column_values = [[] for _ in names]
+        for segment in segments:
+            for values, col in zip(segment.read(names), column_values):
+                col.extend(values)
+        _write_segment(os.path.join(partition_dir, _segment_name()), names, column_values)
+        for segment in segments:
+            os.remove(segment.path)
+        merged += 1
+    print(f"[{datetime.now()}] {kind}: {merged}パーティションをまとめました")
+    return merged
+
+
+def stats(base_dir=ARCHIVE_DIR):
+    result = {}
+    if not os.path.isdir(base_dir):
+        return result
+    for kind in sorted(os.listdir(base_dir)):
+        parts = partitions(kind, base_dir=base_dir)
+        rows, size, files = 0, 0, 0
+        for _, partition_dir in parts:
+            for segment in _segments(partition_dir):
+                rows  += segment.rows
+                size  += os.path.getsize(segment.path)
+                files += 1
+        result[kind] = {
+            'partitions': len(parts),
+            'files':      files,
+            'rows':       rows,
+            'bytes':      size,
+            'first':      parts[0][0] if parts else None,
+            'last':       parts[-1][0] if parts else None,
+        }
+    return result
+
+
+# ============================================================
+#  コマンドライン引数（各スクリプト用）
+# ============================================================
+
+def add_arguments(parser):
+    parser.add_argument('--no-archive', action='store_true',
+                        help="ダウンロードした生データをアーカイブに追記しない")
+
+
+def archive_quietly(kind, rows):
+    """同期処理から呼ぶ用。アーカイブの失敗で同期自体は失敗させない"""
+    try:
+        return append(kind, rows)
+    except Exception as e:
+        print(f"[{datetime.now()}] 警告: アーカイブへの追記に失敗しました - {str(e)}")
+        return 0
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="生データアーカイブの参照")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('stats', help="種別ごとの行数・サイズ")
+
+    p = sub.add_parser('scan', help="行をCSVで出力する")
+    p.add_argument('kind', choices=list(DATE_COLUMNS))
+    p.add_argument('--from', dest='date_from', help="YYYY-MM-DD")
+    p.add_argument('--to', dest='date_to', help="YYYY-MM-DD")
+    p.add_argument('--columns', nargs='+', help="出力する列名")
+    p.add_argument('--limit', type=int)
+    p.add_argument('--all-versions', action='store_true', help="同じキーの古い版も出力する")
+
+    p = sub.add_parser('compact', help="パーティション内のファイルをまとめる")
+    p.add_argument('kind', choices=list(DATE_COLUMNS))
+
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print(json.dumps(stats(), ensure_ascii=False, indent=2))
+    elif args.command == 'scan':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(args.columns or column_names(args.kind))
+        for i, row in enumerate(scan(args.kind, args.columns, args.date_from, args.date_to,
+                                     all_versions=args.all_versions)):
+            if args.limit is not None and i >= args.limit:
+                break
+            writer.writerow(row)
+    elif args.command == 'compact':
+        compact(args.kind)
+
+
+if __name__ == "__main__":
+    main()
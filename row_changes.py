@@ -0,0 +1,317 @@
+# row_changes.py
+# レポートの行単位の変更検出（CDC）。前回シートに書き込んだ内容と比べ、追加・更新・削除された行だけを取り出す
+#
+# presco_kango_item5.py は毎回180日分を出し直すが、ほとんどの行は前回と同じ。ここでは前回の各行の指紋（sha1）を
+# レポートの軸（集計期間・プログラム・広告・サイト・ページ）をキーにして持ち、
+#   ・変わった行だけを sheets_publisher.apply_changes() でシートに反映する（1回の batch_update）
+#   ・追加・更新・削除を実行ごとに変更履歴に残す（後段の処理は changes_since() で読む）
+#
+#   with row_changes.Snapshots() as snapshots:
+#       changes = snapshots.diff('presco_kango_item5', data, values, KEY_COLUMNS)
+#       if changes.full:
+#           sheets_publisher.publish(worksheet, values)
+#       else:
+#           sheets_publisher.apply_changes(worksheet, *changes.patch())
+#       snapshots.commit(changes)
+#
+# ・次のときは差分ではなくシート全体を書き直す（changes.full に理由が入る）
+#     前回の記録がない / CSVのヘッダーが変わった / 変更が全体の FULL_RATIO を超えた / 指定された（--force-publish）
+# ・差分で書き込んだ後のシートの行順は「前回の順（削除した行を詰める）+ 追加した行」で、記録にも同じ順を残す
+# ・同じキーの行が複数あるときは、2つめ以降のキーに出現順の番号を付ける
+# ・状態は PRESCO_CDC_PATH（SQLite）に保存する
+#
+#   python row_changes.py runs presco_kango_item5                  # 実行ごとの追加・更新・削除の件数
+#   python row_changes.py log presco_kango_item5 --run <run_id>    # 変更された行
+
+import os
+import sys
+import csv
+import json
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+import run_metrics
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+CDC_PATH   = os.environ.get('PRESCO_CDC_PATH', '/tmp/presco_cdc.db')
+FULL_RATIO = 0.5   # 変更がこの割合を超えたらシート全体を書き直す
+KEEP_DAYS  = int(os.environ.get('PRESCO_CDC_KEEP_DAYS', '90'))   # 変更履歴を残す日数
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS snapshot_rows (
+        pipeline    TEXT NOT NULL,
+        row_key     TEXT NOT NULL,
+        position    INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        PRIMARY KEY (pipeline, row_key)
+    );
+    CREATE TABLE IF NOT EXISTS snapshots (
+        pipeline     TEXT PRIMARY KEY,
+        header       TEXT NOT NULL,
+        rows         INTEGER NOT NULL,
+        run_id       TEXT,
+        published_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS row_changes (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        pipeline    TEXT NOT NULL,
+        run_id      TEXT,
+        op          TEXT NOT NULL,
+        row_key     TEXT NOT NULL,
+        row         TEXT,
+        recorded_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS row_changes_run ON row_changes (pipeline, run_id);
+"""
+
+
+# ============================================================
+#  差分
+# ============================================================
+
+def _fingerprint(row):
+    return hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest()
+
+
+def _keys(rows, key_columns):
+    """各行のキー（キー列の値の JSON。同じキーの2つめ以降は出現順の番号を付ける）"""
+    seen = {}
+    keys = []
+    for row in rows:
+        dims  = [row[i] if i < len(row) else '' for i in key_columns]
+        base  = json.dumps(dims, ensure_ascii=False)
+        count = seen.get(base, 0)
+        seen[base] = count + 1
+        keys.append(base if count == 0 else json.dumps(dims + [f"#{count + 1}"], ensure_ascii=False))
+    return keys
+
+
+class Changes:
+    """1回分の差分（diff() が作り、commit() で記録する）"""
+
+    def __init__(self, pipeline, header, values):
+        self.pipeline     = pipeline
+        self.header       = header   # CSVのヘッダー行
+        self.values       = values   # シートに書く全体（先頭行はヘッダー。全体を書き直すとき用）
+        self.inserted     = []       # [(キー, CSVの行)]
+        self.updated      = []       # [(キー, CSVの行)]
+        self.deleted      = []       # [(キー, 前回の位置)]
+        self.layout       = []       # 書き込み後のシートの行順（キー）
+        self.fingerprints = {}       # キー → 指紋
+        self.published    = {}       # 追加・更新したキー → シートに書く行
+        self.full         = None     # シート全体を書き直す理由（差分で書くなら None）
+        self.previous     = 0        # 前回書き込んだ行数（ヘッダーを除く）
+
+    @property
+    def count(self):
+        return len(self.inserted) + len(self.updated) + len(self.deleted)
+
+    def patch(self, header_rows=1):
+        """
+        sheets_publisher.apply_changes() に渡す (削除する行, {行: 値}, 追加する行)
+        行はシートの0始まりのインデックス（先頭の header_rows 行はヘッダー）
+        """
+        deletes  = [header_rows + position for _, position in self.deleted]
+        appended = {key for key, _ in self.inserted}
+        updates  = {}
+        appends  = []
+        for position, key in enumerate(self.layout):
+            if key in appended:
+                appends.append(self.published[key])
+            elif key in self.published:
+                updates[header_rows + position] = self.published[key]
+        return deletes, updates, appends
+
+
+class Snapshots:
+    """パイプラインごとの前回の行の指紋と変更履歴（SQLite）"""
+
+    def __init__(self, path=CDC_PATH):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def diff(self, pipeline, rows, values, key_columns, full=None):
+        """
+        rows（CSV。先頭行はヘッダー）を前回の記録と比べる
+        values は rows と1行ずつ対応するシートに書く値（変換後）。full に理由を渡すと全体を書き直す
+        """
+        header, body = (rows[0], rows[1:]) if rows else ([], [])
+        changes  = Changes(pipeline, header, values)
+        previous = self._db.execute("SELECT header FROM snapshots WHERE pipeline = ?", (pipeline,)).fetchone()
+        old      = {
+            key: (position, fingerprint) for key, position, fingerprint in self._db.execute(
+                "SELECT row_key, position, fingerprint FROM snapshot_rows WHERE pipeline = ?", (pipeline,))
+        }
+
+        keys = _keys(body, key_columns)
+        for key, row, value in zip(keys, body, values[1:]):
+            fingerprint = _fingerprint(row)
+            changes.fingerprints[key] = fingerprint
+            before = old.get(key)
+            if before is None:
+                changes.inserted.append((key, row))
+            elif before[1] != fingerprint:
+                changes.updated.append((key, row))
+            else:
+                continue
+            changes.published[key] = value
+        changes.deleted = sorted(
+            ((key, position) for key, (position, _) in old.items() if key not in changes.fingerprints),
+            key=lambda item: item[1])
+
+        if full is None:
+            if previous is None:
+                full = '前回の記録がありません'
+            elif json.loads(previous[0]) != header:
+                full = 'CSVのヘッダーが変わりました'
+            elif changes.count > FULL_RATIO * max(len(body), 1):
+                full = f"変更が多いため（{changes.count}/{len(body)}行）"
+        changes.full     = full
+        changes.previous = len(old)
+
+        if full:
+            changes.layout = keys
+        else:
+            kept = sorted((position, key) for key, (position, _) in old.items() if key in changes.fingerprints)
+            changes.layout = [key for _, key in kept] + [key for key, _ in changes.inserted]
+        return changes
+
+    def commit(self, changes, run_id=None):
+        """シートへの書き込みが終わった後に、今回の指紋と変更履歴を記録する"""
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._db:
+            self._db.execute("DELETE FROM snapshot_rows WHERE pipeline = ?", (changes.pipeline,))
+            self._db.executemany(
+                "INSERT INTO snapshot_rows VALUES (?, ?, ?, ?)",
+                [(changes.pipeline, key, position, changes.fingerprints[key])
+                 for position, key in enumerate(changes.layout)])
+            self._db.execute(
+                "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?) ON CONFLICT (pipeline) DO UPDATE SET "
+                "header = excluded.header, rows = excluded.rows, run_id = excluded.run_id, "
+                "published_at = excluded.published_at",
+                (changes.pipeline, json.dumps(changes.header, ensure_ascii=False), len(changes.layout), run_id, now))
+            self._db.executemany(
+                "INSERT INTO row_changes (pipeline, run_id, op, row_key, row, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(changes.pipeline, run_id, INSERT, key, json.dumps(row, ensure_ascii=False), now)
+                 for key, row in changes.inserted]
+                + [(changes.pipeline, run_id, UPDATE, key, json.dumps(row, ensure_ascii=False), now)
+                   for key, row in changes.updated]
+                + [(changes.pipeline, run_id, DELETE, key, None, now) for key, _ in changes.deleted])
+            cutoff = (datetime.now() - timedelta(days=KEEP_DAYS)).isoformat(timespec='seconds')
+            self._db.execute("DELETE FROM row_changes WHERE recorded_at < ?", (cutoff,))
+
+    def forget(self, pipeline):
+        """記録を消す（次回はシート全体を書き直す）"""
+        with self._db:
+            self._db.execute("DELETE FROM snapshot_rows WHERE pipeline = ?", (pipeline,))
+            self._db.execute("DELETE FROM snapshots WHERE pipeline = ?", (pipeline,))
+
+    # ── 変更履歴 ──
+
+    def changes_since(self, pipeline, after_id=0, run_id=None, limit=None):
+        """変更履歴（id の昇順）。後段の処理は最後に読んだ id を after_id に渡して続きを読む"""
+        sql    = "SELECT id, run_id, op, row_key, row, recorded_at FROM row_changes WHERE pipeline = ? AND id > ?"
+        params = [pipeline, after_id]
+        if run_id is not None:
+            sql += " AND run_id = ?"
+            params.append(run_id)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [
+            {'id': id_, 'run_id': run, 'op': op, 'key': json.loads(key),
+             'row': json.loads(row) if row is not None else None, 'recorded_at': recorded_at}
+            for id_, run, op, key, row, recorded_at in self._db.execute(sql, params)
+        ]
+
+    def runs(self, pipeline, limit=20):
+        """実行ごとの追加・更新・削除の件数（新しい順）"""
+        return [
+            {'run_id': run_id, 'recorded_at': recorded_at, INSERT: inserted, UPDATE: updated, DELETE: deleted}
+            for run_id, recorded_at, inserted, updated, deleted in self._db.execute(
+                "SELECT run_id, MAX(recorded_at), SUM(op = 'insert'), SUM(op = 'update'), SUM(op = 'delete') "
+                "FROM row_changes WHERE pipeline = ? GROUP BY run_id ORDER BY MAX(id) DESC LIMIT ?",
+                (pipeline, limit))
+        ]
+
+
+# ============================================================
+#  各スクリプト用
+# ============================================================
+
+def add_arguments(parser):
+    parser.add_argument('--no-cdc', action='store_true',
+                        help="前回からの差分ではなく、毎回シート全体を書き直す（変更履歴も残さない）")
+
+
+def current_run_id():
+    span = run_metrics.current_span()
+    return span.run_id if span is not None else None
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="行単位の変更履歴の確認")
+    parser.add_argument('--db', default=CDC_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('runs', help="実行ごとの追加・更新・削除の件数")
+    p.add_argument('pipeline')
+    p.add_argument('--limit', type=int, default=20)
+
+    p = sub.add_parser('log', help="変更された行をCSVで出力する")
+    p.add_argument('pipeline')
+    p.add_argument('--run', dest='run_id')
+    p.add_argument('--after', type=int, default=0, help="この id より後の変更だけ")
+    p.add_argument('--limit', type=int)
+
+    p = sub.add_parser('forget', help="記録を消す（次回はシート全体を書き直す）")
+    p.add_argument('pipeline')
+
+    args = parser.parse_args()
+
+    with Snapshots(args.db) as snapshots:
+        if args.command == 'runs':
+            print(f"{'run_id':<26}{'記録日時':<22}{'追加':>8}{'更新':>8}{'削除':>8}")
+            for run in snapshots.runs(args.pipeline, args.limit):
+                print(f"{run['run_id'] or '-':<26}{run['recorded_at']:<22}"
+                      f"{run[INSERT]:>8}{run[UPDATE]:>8}{run[DELETE]:>8}")
+        elif args.command == 'log':
+            writer = csv.writer(sys.stdout)
+            writer.writerow(['id', 'run_id', 'op', 'key', 'row'])
+            for change in snapshots.changes_since(args.pipeline, args.after, args.run_id, args.limit):
+                writer.writerow([change['id'], change['run_id'], change['op'],
+                                 json.dumps(change['key'], ensure_ascii=False),
+                                 json.dumps(change['row'], ensure_ascii=False) if change['row'] is not None else ''])
+        elif args.command == 'forget':
+            snapshots.forget(args.pipeline)
+
+
+if __name__ == "__main__":
+    main()
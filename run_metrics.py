@@ -0,0 +1,245 @@
+# run_metrics.py
+# 処理ステージごとの計測（スパン）と実行レポート
+#
+#   with run_metrics.pipeline('presco_kango'):
+#       with run_metrics.span('login'):
+#           ...
+#       with run_metrics.span('download') as s:
+#           s.set('bytes', file_size)
+#
+# スパンは入れ子にでき、行数・バイト数・キャッシュヒットなどを属性として持てる。
+# pipeline() を抜けるとき、全スパンを JSON Lines で RUN_REPORT_PATH に追記し、
+# 人が読むための要約を標準出力に出す。
+#
+# add_hook() でスパンの開始・終了時に呼ばれるフックを登録できる（profiling.py が使う）。
+# フックが1つもなければ追加の処理はしない。
+
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+from datetime import datetime
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+RUN_REPORT_PATH = os.environ.get('RUN_REPORT_PATH', '/tmp/presco_run_report.jsonl')
+
+
+_local = threading.local()   # スレッドごとのスパンのスタック
+_lock  = threading.Lock()
+_runs  = {}                  # run_id -> 実行中のパイプラインの情報
+_hooks = []                  # enter(span) / exit(span) を持つオブジェクト
+
+
+# ============================================================
+#  スパン
+# ============================================================
+
+class Span:
+
+    def __init__(self, name, parent, run_id, attrs):
+        self.name       = name
+        self.span_id    = uuid.uuid4().hex[:16]
+        self.parent_id  = parent.span_id if parent else None
+        self.depth      = parent.depth + 1 if parent else 0
+        self.run_id     = run_id
+        self.attrs      = dict(attrs)
+        self.status     = 'ok'
+        self.error      = None
+        self.started_at = datetime.now()
+        self._started   = time.perf_counter()
+        self.duration   = None
+
+    def set(self, key, value):
+        self.attrs[key] = value
+        return self
+
+    def incr(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+        return self
+
+    def to_record(self, pipeline):
+        return {
+            'type':        'span',
+            'run_id':      self.run_id,
+            'pipeline':    pipeline,
+            'span_id':     self.span_id,
+            'parent_id':   self.parent_id,
+            'name':        self.name,
+            'depth':       self.depth,
+            'started_at':  self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'status':      self.status,
+            'error':       self.error,
+            'attrs':       self.attrs,
+        }
+
+
+class _NullSpan:
+    """pipeline() の外で span() を使った場合のダミー（計測しない）"""
+    name = None
+
+    def set(self, key, value):
+        return self
+
+    def incr(self, key, amount=1):
+        return self
+
+
+def add_hook(hook):
+    """スパンの開始・終了時に hook.enter(span) / hook.exit(span) を呼ぶようにする"""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def _enter(s):
+    for hook in _hooks:
+        hook.enter(s)
+
+
+def _exit(s):
+    for hook in reversed(_hooks):
+        hook.exit(s)
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """ステージを計測する。pipeline() の外では何もしない"""
+    parent = current_span()
+    if parent is None:
+        yield _NullSpan()
+        return
+
+    s = Span(name, parent, parent.run_id, attrs)
+    stack = _stack()
+    stack.append(s)
+    if _hooks:
+        _enter(s)
+        s._started = time.perf_counter()   # フック自体の時間は含めない
+    try:
+        yield s
+    except BaseException as e:
+        s.status = 'error'
+        s.error  = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.duration = time.perf_counter() - s._started
+        if _hooks:
+            _exit(s)
+        stack.pop()
+        with _lock:
+            _runs[s.run_id]['spans'].append(s)
+
+
+def current_pipeline():
+    """実行中のパイプライン名（pipeline() の外なら None）"""
+    s = current_span()
+    if s is None:
+        return None
+    with _lock:
+        run = _runs.get(s.run_id)
+    return run['pipeline'] if run else None
+
+
+def set_attr(key, value):
+    """実行中のスパンに属性を付ける"""
+    s = current_span()
+    if s is not None:
+        s.set(key, value)
+
+
+def incr(key, amount=1):
+    """実行中のスパンのカウンターを増やす"""
+    s = current_span()
+    if s is not None:
+        s.incr(key, amount)
+
+
+# ============================================================
+#  パイプライン（1回の実行）
+# ============================================================
+
+@contextlib.contextmanager
+def pipeline(name, **attrs):
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+    root   = Span(name, None, run_id, attrs)
+    with _lock:
+        _runs[run_id] = {'pipeline': name, 'root': root, 'spans': []}
+
+    stack = _stack()
+    stack.append(root)
+    if _hooks:
+        _enter(root)
+        root._started = time.perf_counter()   # フック自体の時間は含めない
+    try:
+        yield root
+    except BaseException as e:
+        root.status = 'error'
+        root.error  = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        root.duration = time.perf_counter() - root._started
+        if _hooks:
+            _exit(root)
+        stack.pop()
+        with _lock:
+            run = _runs.pop(run_id)
+        spans = [root] + run['spans']
+        _write_report(name, spans)
+        _print_summary(name, root, spans)
+
+
+def _write_report(pipeline_name, spans):
+    if not RUN_REPORT_PATH:
+        return
+    try:
+        directory = os.path.dirname(RUN_REPORT_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(RUN_REPORT_PATH, 'a', encoding='utf-8') as f:
+            for s in sorted(spans, key=lambda s: s._started):
+                f.write(json.dumps(s.to_record(pipeline_name), ensure_ascii=False, default=str) + '\n')
+    except OSError as e:
+        # レポートの書き込み失敗で同期処理自体を失敗させない
+        print(f"[{datetime.now()}] 警告: 実行レポートの書き込みに失敗しました - {str(e)}")
+
+
+def _print_summary(pipeline_name, root, spans):
+    children = {}
+    for s in spans:
+        children.setdefault(s.parent_id, []).append(s)
+
+    print("-" * 60)
+    print(f"[{datetime.now()}] 実行サマリー: {pipeline_name}（run_id: {root.run_id}）")
+
+    def walk(s):
+        attrs = ' '.join(f"{k}={v}" for k, v in s.attrs.items())
+        mark  = '' if s.status == 'ok' else ' ✗'
+        print(f"  {'  ' * s.depth}{s.name:<{max(28 - 2 * s.depth, 1)}} {s.duration * 1000:>10.1f}ms{mark}  {attrs}".rstrip())
+        for child in sorted(children.get(s.span_id, []), key=lambda c: c._started):
+            walk(child)
+
+    walk(root)
+    if RUN_REPORT_PATH:
+        print(f"  レポート: {RUN_REPORT_PATH}")
+    print("-" * 60)
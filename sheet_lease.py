@@ -0,0 +1,275 @@
+# sheet_lease.py
+# スプレッドシートへの書き込み（sheets_publisher.publish）をプロセスをまたいで1つずつにするためのリース
+#
+# 看護系の3つの同期を同時に起動すると、同じスプレッドシートへの clear() / update() / batch_update が
+# 入り混じり、ある実行のクリアが隣のシートへの書き込みを消すことがあったため、順番に実行していた。
+# ここでは書き込みの間だけリースを取り、ダウンロード・変換は並列のまま、短い書き込みだけを1つずつにする。
+#
+#   with sheet_lease.lease(spreadsheet_id, worksheet.title):
+#       ...（clear / update / batch_update）
+#
+# ・範囲（PRESCO_LEASE_SCOPE）
+#     spreadsheet : スプレッドシート単位（既定。シートの追加・差し替えが入り混じらない）
+#     worksheet   : シート単位（別のシートへの書き込みは並列に行う）
+# ・仕組み（PRESCO_LEASE_BACKEND、set_backend() で差し替え可）
+#     file  : PRESCO_LEASE_DIR のロックファイルを fcntl.flock でロックする（既定）
+#             プロセスが落ちるとロックは自動で外れる。ファイルには持ち主（pid・パイプライン）を書く
+#     local : 同じプロセス内のスレッドの間だけ（fcntl のない環境・テスト用）
+#     none  : リースを取らない
+# ・同じスレッドで同じリースを入れ子で取ったときは、外側のリースをそのまま使う
+#
+#   python sheet_lease.py        # 現在のリースの持ち主を表示
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import contextlib
+from datetime import datetime
+
+import run_metrics
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+LEASE_BACKEND = os.environ.get('PRESCO_LEASE_BACKEND', 'file')
+LEASE_SCOPE   = os.environ.get('PRESCO_LEASE_SCOPE', 'spreadsheet')
+LEASE_DIR     = os.environ.get('PRESCO_LEASE_DIR', '/tmp/presco_leases')
+LEASE_TIMEOUT = float(os.environ.get('PRESCO_LEASE_TIMEOUT', '600'))   # 秒。これ以上待ったら失敗させる
+
+POLL_INTERVAL = 0.2    # 秒（最初の待ち時間。POLL_MAX まで倍にしていく）
+POLL_MAX      = 2.0
+
+
+# ============================================================
+#  仕組み（バックエンド）
+# ============================================================
+
+class FileLeases:
+    """ロックファイル + fcntl.flock（同じマシンの別プロセス・別スレッドの間で排他）"""
+
+    def __init__(self, directory=LEASE_DIR):
+        import fcntl   # Linux / macOS のみ
+        self._fcntl    = fcntl
+        self.directory = directory
+
+    def path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{digest}.lock")
+
+    def try_acquire(self, key, owner):
+        """取れたらトークン、ほかが持っていれば None"""
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # 持ち主を書いておく（待っている側の表示と、python sheet_lease.py 用）
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps(dict(owner, key=key), ensure_ascii=False).encode('utf-8'))
+        return fd
+
+    def release(self, fd):
+        try:
+            os.ftruncate(fd, 0)
+            self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def holder(self, key):
+        return self.holder_at(self.path(key))
+
+    def holder_at(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            return json.loads(text) if text else None
+        except (OSError, ValueError):
+            return None
+
+    def holders(self):
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            fd   = os.open(path, os.O_RDONLY)
+            try:
+                # ロックが取れるなら持ち主はいない（落ちたプロセスの書き残しは無視する）
+                self._fcntl.flock(fd, self._fcntl.LOCK_SH | self._fcntl.LOCK_NB)
+                self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+                continue
+            except BlockingIOError:
+                pass
+            finally:
+                os.close(fd)
+            holder = self.holder_at(path)
+            if holder:
+                result.append(holder)
+        return result
+
+
+class LocalLeases:
+    """同じプロセス内のスレッドの間だけで排他する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = {}   # key → 持ち主
+
+    def try_acquire(self, key, owner):
+        with self._lock:
+            if key in self._held:
+                return None
+            self._held[key] = dict(owner, key=key)
+            return key
+
+    def release(self, key):
+        with self._lock:
+            self._held.pop(key, None)
+
+    def holder(self, key):
+        with self._lock:
+            return self._held.get(key)
+
+    def holders(self):
+        with self._lock:
+            return list(self._held.values())
+
+
+class NoLeases:
+    """リースを取らない"""
+
+    def try_acquire(self, key, owner):
+        return key
+
+    def release(self, token):
+        pass
+
+    def holder(self, key):
+        return None
+
+    def holders(self):
+        return []
+
+
+_backend = None
+_local   = threading.local()   # スレッドごとの取得中のリース（入れ子用）
+
+
+def _build_backend(name=LEASE_BACKEND):
+    if name == 'file':
+        try:
+            return FileLeases()
+        except ImportError:
+            print(f"[{datetime.now()}] 警告: fcntl が使えないため、リースは同じプロセス内だけで行います")
+            return LocalLeases()
+    if name == 'local':
+        return LocalLeases()
+    if name == 'none':
+        return NoLeases()
+    raise Exception(f"不明なリースの仕組みです: {name}")
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = _build_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """リースの仕組みを差し替える（try_acquire / release / holder / holders を持つオブジェクト）"""
+    global _backend
+    _backend = backend
+
+
+# ============================================================
+#  リース
+# ============================================================
+
+def lease_key(spreadsheet_id, worksheet_title=None, scope=None):
+    scope = scope or LEASE_SCOPE
+    if scope == 'spreadsheet' or worksheet_title is None:
+        return f"spreadsheet:{spreadsheet_id}"
+    if scope == 'worksheet':
+        return f"worksheet:{spreadsheet_id}/{worksheet_title}"
+    raise Exception(f"不明なリースの範囲です: {scope}")
+
+
+@contextlib.contextmanager
+def lease(spreadsheet_id, worksheet_title=None, timeout=None):
+    """書き込みの間、スプレッドシート（またはシート）のリースを持つ"""
+    key  = lease_key(spreadsheet_id, worksheet_title)
+    held = getattr(_local, 'held', None)
+    if held is None:
+        held = _local.held = set()
+    if key in held:
+        # 同じスレッドで取得済み（入れ子）
+        yield
+        return
+
+    backend = get_backend()
+    timeout = LEASE_TIMEOUT if timeout is None else timeout
+    owner   = {
+        'pid':         os.getpid(),
+        'thread':      threading.current_thread().name,
+        'pipeline':    run_metrics.current_pipeline(),
+        'sheet':       worksheet_title,
+        'acquired_at': None,
+    }
+
+    with run_metrics.span('lease', key=key) as s:
+        started   = time.perf_counter()
+        interval  = POLL_INTERVAL
+        announced = False
+        while True:
+            owner['acquired_at'] = datetime.now().isoformat(timespec='seconds')
+            token = backend.try_acquire(key, owner)
+            if token is not None:
+                break
+            waited = time.perf_counter() - started
+            if waited >= timeout:
+                raise Exception(f"書き込みのリースを {timeout:.0f}秒待っても取得できませんでした: {key}"
+                                f"（持ち主: {_describe(backend.holder(key))}）")
+            if not announced:
+                print(f"[{datetime.now()}] ほかの実行が書き込み中のため待ちます: {key}（持ち主: {_describe(backend.holder(key))}）")
+                announced = True
+            time.sleep(min(interval, timeout - waited))
+            interval = min(interval * 2, POLL_MAX)
+        s.set('wait_ms', round((time.perf_counter() - started) * 1000, 1))
+
+    held.add(key)
+    try:
+        yield
+    finally:
+        held.discard(key)
+        backend.release(token)
+
+
+def _describe(holder):
+    if not holder:
+        return '不明'
+    return f"pid {holder.get('pid')} / {holder.get('pipeline') or '-'} / {holder.get('acquired_at')} から"
+
+
+# ============================================================
+#  メイン
+# ============================================================
+
+def main():
+    argparse.ArgumentParser(description="書き込みのリースの持ち主を表示する").parse_args()
+    holders = get_backend().holders()
+    if not holders:
+        print("リースを持っている実行はありません")
+    for holder in holders:
+        print(f"{holder.get('key')}: {_describe(holder)}（シート: {holder.get('sheet') or '-'}）")
+
+
+if __name__ == "__main__":
+    main()
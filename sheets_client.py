@@ -0,0 +1,241 @@
+# sheets_client.py
+# Google Sheets クライアントのプロセス内キャッシュ
+# 認証情報ごとに認証済みクライアント（HTTPセッション）を1つだけ作り、
+# Spreadsheet / Worksheet のハンドルも使い回す
+#
+# SHEETS_BACKEND でバックエンドを切り替えられる
+#   gspread（デフォルト）  本物の Google Sheets
+#   fake / sqlite:PATH    fake_sheets.py のローカル実装（オフライン検証用）
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+import run_metrics
+import network_accounting
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+SHEETS_BACKEND = os.environ.get('SHEETS_BACKEND', 'gspread')
+
+SCOPE = [
+    'https://spreadsheets.google.com/feeds',
+    'https://www.googleapis.com/auth/drive'
+]
+
+# アクセストークンの有効期限がこの時間を切ったら事前に更新する
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# keep-alive 用のコネクションプール
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE     = 16
+
+# 429（クォータ超過）のときの再試行
+MAX_RETRIES   = 5
+RETRY_BACKOFF = float(os.environ.get('SHEETS_RETRY_BACKOFF', '2'))   # 秒（2, 4, 8, ... と倍にしていく）
+
+
+_lock         = threading.Lock()
+_backend      = None   # set_backend() で差し替えたクライアント
+_clients      = {}   # 認証情報ハッシュ -> gspread.Client
+_spreadsheets = {}   # (認証情報ハッシュ, spreadsheet_id) -> Spreadsheet
+_worksheets   = {}   # (認証情報ハッシュ, spreadsheet_id, シート名) -> Worksheet
+
+
+# ============================================================
+#  クライアント
+# ============================================================
+
+def _credentials_key(creds_json):
+    return hashlib.sha256(creds_json.encode('utf-8')).hexdigest()
+
+
+def _build_client(creds_json):
+    import gspread
+    import requests
+    from oauth2client.service_account import ServiceAccountCredentials
+    from requests.adapters import HTTPAdapter
+
+    creds_dict  = json.loads(creds_json)
+    credentials = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+    gc          = gspread.authorize(credentials)
+
+    # 同一ホストへのリクエストは1つのプールで keep-alive させる
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    gc.session.mount('https://', adapter)
+    network_accounting.watch_session(gc.session)
+
+    # トークンの更新用。gc.session（AuthorizedSession）を通すと更新のリクエスト自体にも
+    # 認証がかかって二重に更新が走るため、認証なしのセッションでプールだけを共有する
+    gc.token_session = requests.Session()
+    gc.token_session.mount('https://', adapter)
+    network_accounting.watch_session(gc.token_session)
+    return gc
+
+
+def _ensure_token(gc):
+    """アクセストークンが無い・期限間近の場合のみ更新する"""
+    auth   = gc.auth
+    now    = datetime.now(timezone.utc).replace(tzinfo=None)   # google-auth の expiry は naive UTC
+    expiry = getattr(auth, 'expiry', None)
+
+    if auth.token and expiry and expiry - now > TOKEN_REFRESH_MARGIN:
+        return
+
+    from google.auth.transport.requests import Request
+    with run_metrics.span('sheets_token_refresh'):
+        auth.refresh(Request(gc.token_session))
+    print(f"[{datetime.now()}] Googleのアクセストークンを取得しました（有効期限: {auth.expiry} UTC）")
+
+
+def _get_client(creds_json=None):
+    if _backend is not None:
+        return 'backend', _backend
+    if SHEETS_BACKEND != 'gspread':
+        return _get_fake_client()
+
+    if creds_json is None:
+        creds_json = os.environ.get('GOOGLE_CREDENTIALS')
+    if not creds_json:
+        raise Exception("環境変数 GOOGLE_CREDENTIALS が設定されていません")
+
+    key = _credentials_key(creds_json)
+    with _lock:
+        gc = _clients.get(key)
+        if gc is None:
+            gc = _build_client(creds_json)
+            _clients[key] = gc
+            print(f"[{datetime.now()}] Google Sheetsクライアントを作成しました")
+        _ensure_token(gc)
+    return key, gc
+
+
+def _get_fake_client():
+    import fake_sheets
+
+    key = SHEETS_BACKEND
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = fake_sheets.FakeClient.from_spec(SHEETS_BACKEND)
+            _clients[key] = client
+            print(f"[{datetime.now()}] ローカルのシートバックエンドを使用します: {SHEETS_BACKEND}")
+    return key, client
+
+
+def _worksheet_not_found():
+    if _backend is None and SHEETS_BACKEND == 'gspread':
+        from gspread.exceptions import WorksheetNotFound
+    else:
+        from fake_sheets import WorksheetNotFound
+    return WorksheetNotFound
+
+
+def set_backend(client):
+    """
+    バックエンドのクライアントを直接差し替える（ベンチマーク・テスト用）
+    None を渡すと SHEETS_BACKEND の設定に戻る
+    """
+    global _backend
+    invalidate()
+    _backend = client
+
+
+def get_client(creds_json=None):
+    """認証済みの gspread.Client を返す（プロセス内で使い回す）"""
+    return _get_client(creds_json)[1]
+
+
+# ============================================================
+#  Spreadsheet / Worksheet ハンドル
+# ============================================================
+
+def open_spreadsheet(spreadsheet_id, creds_json=None):
+    key, gc = _get_client(creds_json)
+    cache_key = (key, spreadsheet_id)
+
+    with _lock:
+        spreadsheet = _spreadsheets.get(cache_key)
+    if spreadsheet is None:
+        spreadsheet = with_retry(gc.open_by_key, spreadsheet_id)
+        with _lock:
+            _spreadsheets[cache_key] = spreadsheet
+    return spreadsheet
+
+
+def open_worksheet(spreadsheet_id, title, rows, cols, creds_json=None):
+    """
+    シートを取得する（無ければ rows × cols で作成）
+    取得したハンドルはキャッシュし、2回目以降はAPIを呼ばない
+    """
+    with run_metrics.span('open_worksheet', sheet=title) as s:
+        key, _ = _get_client(creds_json)
+        cache_key = (key, spreadsheet_id, title)
+
+        with _lock:
+            worksheet = _worksheets.get(cache_key)
+        s.set('cache_hit', worksheet is not None)
+        if worksheet is not None:
+            return worksheet
+
+        spreadsheet = open_spreadsheet(spreadsheet_id, creds_json)
+        try:
+            worksheet = with_retry(spreadsheet.worksheet, title)
+            print(f"[{datetime.now()}] 既存シート '{title}' を使用します")
+        except _worksheet_not_found():
+            worksheet = with_retry(spreadsheet.add_worksheet, title=title, rows=rows, cols=cols)
+            print(f"[{datetime.now()}] 新しいシート '{title}' を作成しました")
+            s.set('created', True)
+
+        with _lock:
+            _worksheets[cache_key] = worksheet
+        return worksheet
+
+
+# ============================================================
+#  再試行
+# ============================================================
+
+def _is_quota_error(e):
+    response = getattr(e, 'response', None)
+    return getattr(response, 'status_code', None) == 429
+
+
+def with_retry(fn, *args, **kwargs):
+    """
+    429 のときだけ指数バックオフで再試行する
+    （batch_update は全体が1トランザクションなので再送しても安全）
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not _is_quota_error(e) or attempt == MAX_RETRIES:
+                raise
+            wait = RETRY_BACKOFF * (2 ** attempt)
+            run_metrics.incr('quota_retries')
+            print(f"[{datetime.now()}] 警告: APIのクォータ超過（429）。{wait}秒後に再試行します（{attempt + 1}/{MAX_RETRIES}）")
+            time.sleep(wait)
+
+
+def invalidate(spreadsheet_id=None):
+    """
+    キャッシュしたハンドルを破棄する
+    spreadsheet_id を省略した場合はクライアントも含めてすべて破棄する
+    """
+    with _lock:
+        if spreadsheet_id is None:
+            _clients.clear()
+            _spreadsheets.clear()
+            _worksheets.clear()
+            return
+        for cache_key in [k for k in _spreadsheets if k[1] == spreadsheet_id]:
+            del _spreadsheets[cache_key]
+        for cache_key in [k for k in _worksheets if k[1] == spreadsheet_id]:
+            del _worksheets[cache_key]
@@ -0,0 +1,258 @@
+# sheets_publisher.py
+# シートへのデータ反映（公開）処理
+#
+#   staged : 非表示のステージングシートに書き込んでから、
+#            1回の batch_update で本番シートに差し替える（デフォルト）
+#   direct : 従来どおり clear() → update() で直接書き込む
+#
+# apply_changes() は行単位の差分（row_changes.py）だけを1回の batch_update で反映する
+#
+# staged では clear() から update() 完了までの「空・書きかけ」の状態が
+# 本番シートに現れないため、Google広告のスケジュールインポートなどの
+# 読み手は常に旧データか新データのどちらかを読むことになる
+#
+# どちらの方式でもグリッドは出力データぴったりのサイズに拡張・縮小する
+# （サイズ変更は書き込みと同じ batch_update に含める）
+#
+# 書き込みの間は sheet_lease.py のリースを持つ（同じスプレッドシートに同時に書き込む
+# 別の実行とは、ダウンロード・変換は並列のまま、書き込みだけを1つずつ行う）
+
+import os
+from datetime import datetime
+
+import sheets_client
+import sheet_lease
+import run_metrics
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+PUBLISH_STRATEGY = os.environ.get('SHEETS_PUBLISH_STRATEGY', 'staged')
+STAGING_SUFFIX   = '__staging'
+
+
+# ============================================================
+#  公開
+# ============================================================
+
+def publish(worksheet, values, strategy=None):
+    """values（2次元リスト）でシートの中身を置き換える"""
+    strategy = strategy or PUBLISH_STRATEGY
+    rows, cols = grid_size(values)
+
+    if strategy not in ('direct', 'staged'):
+        raise Exception(f"不明な公開方式です: {strategy}")
+
+    with run_metrics.span('publish', sheet=worksheet.title, strategy=strategy, rows=rows, cols=cols):
+        with sheet_lease.lease(worksheet.spreadsheet.id, worksheet.title):
+            if strategy == 'direct':
+                _publish_direct(worksheet, values)
+            else:
+                _publish_staged(worksheet, values)
+
+
+def _publish_direct(worksheet, values):
+    rows, cols = grid_size(values)
+    print(f"[{datetime.now()}] シート '{worksheet.title}' をクリアして書き込みます（{rows}行 × {cols}列）")
+
+    # グリッドの調整とクリアを1回の batch_update で行う
+    with run_metrics.span('clear'):
+        sheets_client.with_retry(worksheet.spreadsheet.batch_update, {'requests': [
+            _grid_request(worksheet, rows, cols),
+            _clear_request(worksheet),
+        ]})
+    _set_grid(worksheet, rows, cols)
+
+    with run_metrics.span('update'):
+        if values:
+            sheets_client.with_retry(worksheet.update, values=values, range_name="A1")
+    print(f"[{datetime.now()}] 書き込み完了: {len(values)}行")
+
+
+def _publish_staged(worksheet, values):
+    rows, cols = grid_size(values)
+
+    # ── ステージングシートに書き込む（非表示なので読み手には見えない） ──
+    # グリッドを出力データぴったりに合わせ、値の書き込みと同じ batch_update で送る
+    staging = _staging_worksheet(worksheet, rows, cols)
+    print(f"[{datetime.now()}] ステージングシート '{staging.title}' に書き込みます（{rows}行 × {cols}列）")
+
+    with run_metrics.span('staging_write'):
+        sheets_client.with_retry(staging.spreadsheet.batch_update, {'requests': [
+            _grid_request(staging, rows, cols, hidden=True),
+            {
+                'updateCells': {
+                    'range':  _grid_range(staging, rows, cols),
+                    'rows':   _row_data(values),
+                    'fields': 'userEnteredValue',
+                }
+            },
+        ]})
+    _set_grid(staging, rows, cols)
+    staging._properties['hidden'] = True
+
+    # ── 1回の batch_update で本番シートへ差し替える ──
+    # 本番シートも同じサイズに拡張・縮小し、値をすべて消してからステージングの値を貼り付ける
+    with run_metrics.span('swap'):
+        print(f"[{datetime.now()}] シート '{worksheet.title}' に差し替えます")
+        sheets_client.with_retry(worksheet.spreadsheet.batch_update, {'requests': [
+            _grid_request(worksheet, rows, cols),
+            _clear_request(worksheet),
+            {
+                'copyPaste': {
+                    'source':      _grid_range(staging, rows, cols),
+                    'destination': _grid_range(worksheet, rows, cols),
+                    'pasteType':   'PASTE_VALUES',
+                }
+            },
+        ]})
+    _set_grid(worksheet, rows, cols)
+    print(f"[{datetime.now()}] 書き込み完了: {len(values)}行")
+
+
+def apply_changes(worksheet, deletes, updates, appends, cols=None):
+    """
+    行単位の変更だけをシートに反映する（row_changes.py の差分用）
+      deletes : 削除する行のインデックス（0始まり・変更前の位置）
+      updates : {行のインデックス（削除した後の位置）: 行の値}
+      appends : 末尾に追加する行
+    削除・グリッドの調整・書き込みを1回の batch_update で送るため、読み手に途中の状態は見えない
+    """
+    cols = cols or worksheet.col_count
+    rows = max(worksheet.row_count - len(deletes) + len(appends), 1)
+
+    # 追加する行は、削除した後の末尾から書く
+    changed = dict(updates)
+    for offset, row in enumerate(appends):
+        changed[rows - len(appends) + offset] = row
+
+    with run_metrics.span('publish', sheet=worksheet.title, strategy='changes',
+                          deleted=len(deletes), updated=len(updates), appended=len(appends)):
+        with sheet_lease.lease(worksheet.spreadsheet.id, worksheet.title):
+            requests = [
+                {
+                    'deleteDimension': {
+                        'range': {'sheetId': worksheet.id, 'dimension': 'ROWS', 'startIndex': start, 'endIndex': end},
+                    }
+                }
+                # 後ろから削除する（前の行のインデックスがずれないように）
+                for start, end in reversed(_ranges(sorted(deletes)))
+            ]
+            if appends or cols != worksheet.col_count:
+                requests.append(_grid_request(worksheet, rows, cols))
+            # 連続する行はまとめて1つの updateCells にする
+            for start, end in _ranges(sorted(changed)):
+                requests.append({
+                    'updateCells': {
+                        'range':  dict(_grid_range(worksheet, end - start, cols), startRowIndex=start, endRowIndex=end),
+                        'rows':   _row_data([changed[i] for i in range(start, end)]),
+                        'fields': 'userEnteredValue',
+                    }
+                })
+            if not requests:
+                print(f"[{datetime.now()}] シート '{worksheet.title}' に反映する変更はありません")
+                return
+
+            print(f"[{datetime.now()}] シート '{worksheet.title}' に変更を反映します"
+                  f"（削除 {len(deletes)}行 / 更新 {len(updates)}行 / 追加 {len(appends)}行）")
+            sheets_client.with_retry(worksheet.spreadsheet.batch_update, {'requests': requests})
+            _set_grid(worksheet, rows, cols)
+    print(f"[{datetime.now()}] 書き込み完了: {len(requests)}リクエスト")
+
+
+def grid_size(values):
+    """
+    出力データがちょうど収まるグリッドサイズ（行数, 列数）を返す
+    シートは0行・0列にできないため最小は 1 × 1
+    """
+    rows = len(values)
+    cols = max((len(row) for row in values), default=0)
+    return max(rows, 1), max(cols, 1)
+
+
+# ============================================================
+#  ヘルパー
+# ============================================================
+
+def _staging_worksheet(worksheet, rows, cols):
+    spreadsheet = worksheet.spreadsheet
+    return sheets_client.open_worksheet(
+        spreadsheet.id,
+        f"{worksheet.title}{STAGING_SUFFIX}",
+        rows=rows,
+        cols=cols,
+    )
+
+
+def _grid_range(worksheet, rows, cols):
+    return {
+        'sheetId':          worksheet.id,
+        'startRowIndex':    0,
+        'endRowIndex':      rows,
+        'startColumnIndex': 0,
+        'endColumnIndex':   cols,
+    }
+
+
+def _grid_request(worksheet, rows, cols, hidden=None):
+    """グリッドサイズを rows × cols に変更する（拡張・縮小の両方）"""
+    properties = {
+        'sheetId':        worksheet.id,
+        'gridProperties': {'rowCount': rows, 'columnCount': cols},
+    }
+    fields = 'gridProperties.rowCount,gridProperties.columnCount'
+    if hidden is not None:
+        properties['hidden'] = hidden
+        fields += ',hidden'
+
+    return {
+        'updateSheetProperties': {
+            'properties': properties,
+            'fields':     fields,
+        }
+    }
+
+
+def _clear_request(worksheet):
+    """シート全体の値を消す（書式は残す。worksheet.clear() と同じ）"""
+    return {
+        'updateCells': {
+            'range':  {'sheetId': worksheet.id},
+            'fields': 'userEnteredValue',
+        }
+    }
+
+
+def _cell_value(value):
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def _row_data(values):
+    """2次元リストを updateCells 用の RowData に変換する（update() の RAW 入力と同じ扱い）"""
+    return [{'values': [_cell_value(v) for v in row]} for row in values]
+
+
+def _ranges(indexes):
+    """昇順のインデックスを連続する範囲 [(start, end), ...] にまとめる"""
+    ranges = []
+    for index in indexes:
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+    return [tuple(r) for r in ranges]
+
+
+def _set_grid(worksheet, rows, cols):
+    """batch_update でサイズを変えた後、キャッシュしているハンドルの行数・列数を合わせる"""
+    grid = worksheet._properties['gridProperties']
+    grid['rowCount']    = rows
+    grid['columnCount'] = cols
@@ -1,15 +1,30 @@
 import os
+import argparse
 import time
 import csv
 import re
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from playwright.sync_api import sync_playwright
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import json
+import sheets_client
+import sheets_publisher
+import run_metrics
+import profiling
+import network_accounting
+import checkpoints
+import download_cache
+import local_output
+import raw_archive
+import query_store
+import daily_rollup
+import ads_export
+import politeness
+import adaptive_timeouts
 
-def login_and_download_csv():
+# ローカル検証時は mock_presco_server.py のURLを指定する
+PRESCO_BASE_URL = os.environ.get('PRESCO_BASE_URL', 'https://presco.ai').rstrip('/')
+
+
+def login_and_download_csv(session=None):
     """
     Presco.aiにログインしてCSVをダウンロード
     集計基準：成果判定日時、期間：昨日〜今日で検索
@@ -17,6 +32,11 @@ def login_and_download_csv():
     
     print(f"[{datetime.now()}] 処理を開始します")
     
+    if session is not None:
+        # デーモンから呼ばれた場合は、ログイン済みのブラウザで新しいタブを開いて使う
+        with session.page() as page:
+            return download_csv(page)
+
     email = os.environ.get('PRESCO_EMAIL')
     password = os.environ.get('PRESCO_PASSWORD')
     
@@ -25,151 +45,58 @@ def login_and_download_csv():
     
     print(f"[{datetime.now()}] 認証情報を確認しました")
     
+    # Playwright はブラウザを起動するときだけ読み込む（--from-csv では不要）
+    from playwright.sync_api import sync_playwright
+
     with sync_playwright() as p:
-        print(f"[{datetime.now()}] ブラウザを起動します")
-        browser = p.chromium.launch(
-            headless=True,
-            args=['--no-sandbox', '--disable-setuid-sandbox']
-        )
-        context = browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        )
+        with run_metrics.span('browser_launch'):
+            print(f"[{datetime.now()}] ブラウザを起動します")
+            browser = p.chromium.launch(
+                headless=True,
+                args=['--no-sandbox', '--disable-setuid-sandbox']
+            )
+            context = browser.new_context(
+                viewport={'width': 1920, 'height': 1080},
+                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            )
         
-        context.set_default_timeout(60000)
-        page = context.new_page()
+            context.set_default_timeout(60000)
+        
+            network_accounting.watch(context)
+            page = context.new_page()
         
         try:
-            print(f"[{datetime.now()}] ログインページにアクセスします")
-            page.goto('https://presco.ai/partner/', timeout=60000)
-            time.sleep(3)
-            
-            page.wait_for_selector('input[name="username"]', timeout=10000)
-            print(f"[{datetime.now()}] ログインフォームを確認しました")
-            
-            print(f"[{datetime.now()}] ログイン情報を入力します")
-            page.fill('input[name="username"]', email)
-            page.fill('input[name="password"]', password)
-            
-            print(f"[{datetime.now()}] ログインボタンをクリックします")
-            with page.expect_navigation(timeout=60000):
-                page.click('input[type="submit"][value="ログイン"]')
-            
-            time.sleep(3)
-            
-            current_url = page.url
-            print(f"[{datetime.now()}] 現在のURL: {current_url}")
-            
-            if 'home' not in current_url and 'actionLog' not in current_url:
-                page.screenshot(path='/tmp/login_error.png')
-                raise Exception(f"ログインに失敗しました。URL: {current_url}")
-            
-            print(f"[{datetime.now()}] ログインに成功しました")
-            
-            print(f"[{datetime.now()}] 成果一覧ページに移動します")
-            page.goto('https://presco.ai/partner/actionLog/list', timeout=60000)
-            time.sleep(5)
-            
-            # ===== 集計基準を「成果判定日時」に変更 =====
-            print(f"[{datetime.now()}] 集計基準を「成果判定日時」に変更します")
-            try:
-                selectors = [
-                    'input[name="dateType"][value="judgeDate"]',
-                    'input[type="radio"][value="judgeDate"]',
-                    'label:has-text("成果判定日時")'
-                ]
-                
-                clicked = False
-                for selector in selectors:
-                    try:
-                        page.click(selector, timeout=3000)
-                        clicked = True
-                        print(f"[{datetime.now()}] 集計基準を変更しました")
-                        break
-                    except:
-                        continue
-                
-                if not clicked:
-                    print(f"[{datetime.now()}] 警告: 集計基準の変更に失敗（デフォルトのまま続行）")
-            except Exception as e:
-                print(f"[{datetime.now()}] 警告: 集計基準の変更中にエラー - {str(e)}")
+            with run_metrics.span('login'):
+                print(f"[{datetime.now()}] ログインページにアクセスします")
+                politeness.goto(page, f'{PRESCO_BASE_URL}/partner/', 'login', 'login_page', 60000)
+                adaptive_timeouts.settle(page, 'login', 'login_page_settle', 3000)
             
-            time.sleep(1)
+                with adaptive_timeouts.step('login', 'login_form', 10000) as timeout:
+                    page.wait_for_selector('input[name="username"]', timeout=timeout)
+                print(f"[{datetime.now()}] ログインフォームを確認しました")
             
-            # ===== 期間を「昨日〜今日」に変更（動的取得） =====
-            print(f"[{datetime.now()}] 期間を「昨日〜今日」に変更します")
-            try:
-                JST = ZoneInfo("Asia/Tokyo")
-                today = datetime.now(JST)
-                yesterday = today - timedelta(days=1)
-                
-                date_from = yesterday.strftime("%Y/%m/%d")
-                date_to = today.strftime("%Y/%m/%d")
-
-                # カレンダーUIを無視して直接inputのvalueを書き換える
-                page.evaluate(f'document.getElementById("dateTimeFrom").value = "{date_from}"')
-                page.evaluate(f'document.getElementById("dateTimeTo").value = "{date_to}"')
-                
-                print(f"[{datetime.now()}] 期間を {date_from} 〜 {date_to} に設定しました")
-            except Exception as e:
-                print(f"[{datetime.now()}] 警告: 期間の変更中にエラー - {str(e)}")
-            
-            time.sleep(1)
-            
-            # ===== 「検索条件で絞り込む」ボタンをクリック =====
-            print(f"[{datetime.now()}] 検索条件で絞り込むをクリックします")
-            try:
-                selectors = [
-                    'button:has-text("検索条件で絞り込む")',
-                    'input[type="submit"][value="検索条件で絞り込む"]',
-                    'button.filter-button--submit',
-                    '.filter-button--submit',
-                    'button[type="submit"]'
-                ]
-                
-                clicked = False
-                for selector in selectors:
-                    try:
-                        page.click(selector, timeout=3000)
-                        clicked = True
-                        print(f"[{datetime.now()}] 検索ボタンをクリックしました")
-                        break
-                    except:
-                        continue
-                
-                if clicked:
-                    time.sleep(5)
-                    print(f"[{datetime.now()}] 検索条件を適用しました")
-                else:
-                    print(f"[{datetime.now()}] 警告: 検索ボタンのクリックに失敗")
-                    
-            except Exception as e:
-                print(f"[{datetime.now()}] 警告: 検索ボタンのクリック中にエラー - {str(e)}")
+                print(f"[{datetime.now()}] ログイン情報を入力します")
+                page.fill('input[name="username"]', email)
+                page.fill('input[name="password"]', password)
             
-            # ===== CSVダウンロード =====
-            page.wait_for_selector('#csv-link', state='visible', timeout=30000)
-            print(f"[{datetime.now()}] CSVダウンロードボタンを確認しました")
-            
-            print(f"[{datetime.now()}] CSVダウンロードを開始します")
-            
-            with page.expect_download(timeout=60000) as download_info:
-                page.click('#csv-link')
-                print(f"[{datetime.now()}] CSVダウンロードボタンをクリックしました")
+                print(f"[{datetime.now()}] ログインボタンをクリックします")
+                with politeness.request(page.url) as ticket, adaptive_timeouts.step('login', 'login_submit', 60000) as timeout:
+                    with page.expect_navigation(timeout=timeout) as navigation:
+                        page.click('input[type="submit"][value="ログイン"]')
+                    ticket.response(navigation.value)
             
-            download = download_info.value
-            csv_path = f'/tmp/presco_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-            download.save_as(csv_path)
+                adaptive_timeouts.settle(page, 'login', 'login_submit_settle', 3000)
             
-            print(f"[{datetime.now()}] CSVをダウンロードしました: {csv_path}")
+                current_url = page.url
+                print(f"[{datetime.now()}] 現在のURL: {current_url}")
             
-            import os as os_module
-            file_size = os_module.path.getsize(csv_path)
-            print(f"[{datetime.now()}] ファイルサイズ: {file_size} bytes")
+                if 'home' not in current_url and 'actionLog' not in current_url:
+                    page.screenshot(path='/tmp/login_error.png')
+                    raise Exception(f"ログインに失敗しました。URL: {current_url}")
             
-            if file_size == 0:
-                raise Exception("ダウンロードしたCSVファイルが空です")
+                print(f"[{datetime.now()}] ログインに成功しました")
             
-            return csv_path
+            return download_csv(page)
             
         except Exception as e:
             print(f"[{datetime.now()}] エラーが発生しました: {str(e)}")
@@ -185,6 +112,134 @@ def login_and_download_csv():
             print(f"[{datetime.now()}] ブラウザを閉じました")
 
 
+def download_csv(page, date_from=None, date_to=None, csv_path=None):
+    """
+    ログイン済みのページからCSVをダウンロードしてパスを返す
+    date_from / date_to（YYYY/MM/DD）を省略したら「昨日〜今日」で検索する（backfill.py は期間を指定する）
+    """
+    with run_metrics.span('navigate', page='actionLog/list'):
+        print(f"[{datetime.now()}] 成果一覧ページに移動します")
+        politeness.goto(page, f'{PRESCO_BASE_URL}/partner/actionLog/list', 'actionLog', 'list_page', 60000)
+        adaptive_timeouts.settle(page, 'actionLog', 'list_page_settle', 5000)
+
+    with run_metrics.span('search_filter'):
+        # ===== 集計基準を「成果判定日時」に変更 =====
+        print(f"[{datetime.now()}] 集計基準を「成果判定日時」に変更します")
+        try:
+            selectors = [
+                'input[name="dateType"][value="judgeDate"]',
+                'input[type="radio"][value="judgeDate"]',
+                'label:has-text("成果判定日時")'
+            ]
+
+            clicked = False
+            for selector in selectors:
+                try:
+                    with adaptive_timeouts.step('actionLog', 'date_type_click', 3000, probe=True) as timeout:
+                        page.click(selector, timeout=timeout)
+                    clicked = True
+                    print(f"[{datetime.now()}] 集計基準を変更しました")
+                    break
+                except:
+                    continue
+
+            if not clicked:
+                print(f"[{datetime.now()}] 警告: 集計基準の変更に失敗（デフォルトのまま続行）")
+        except Exception as e:
+            print(f"[{datetime.now()}] 警告: 集計基準の変更中にエラー - {str(e)}")
+
+        time.sleep(1)
+
+        # ===== 期間を変更（省略時は「昨日〜今日」を動的取得） =====
+        print(f"[{datetime.now()}] 期間を変更します")
+        try:
+            JST = ZoneInfo("Asia/Tokyo")
+            today = datetime.now(JST)
+            yesterday = today - timedelta(days=1)
+
+            date_from = date_from or yesterday.strftime("%Y/%m/%d")
+            date_to = date_to or today.strftime("%Y/%m/%d")
+
+            # カレンダーUIを無視して直接inputのvalueを書き換える
+            page.evaluate(f'document.getElementById("dateTimeFrom").value = "{date_from}"')
+            page.evaluate(f'document.getElementById("dateTimeTo").value = "{date_to}"')
+
+            print(f"[{datetime.now()}] 期間を {date_from} 〜 {date_to} に設定しました")
+        except Exception as e:
+            print(f"[{datetime.now()}] 警告: 期間の変更中にエラー - {str(e)}")
+
+        time.sleep(1)
+
+        # ===== 「検索条件で絞り込む」ボタンをクリック =====
+        print(f"[{datetime.now()}] 検索条件で絞り込むをクリックします")
+        try:
+            selectors = [
+                'button:has-text("検索条件で絞り込む")',
+                'input[type="submit"][value="検索条件で絞り込む"]',
+                'button.filter-button--submit',
+                '.filter-button--submit',
+                'button[type="submit"]'
+            ]
+
+            clicked = False
+            for selector in selectors:
+                # ボタンを探す試行では流量制限の枠を使わず、画面が切り替わるクリックだけを制限の中で行う
+                try:
+                    with adaptive_timeouts.step('actionLog', 'search_button', 3000, probe=True) as timeout:
+                        page.wait_for_selector(selector, state='visible', timeout=timeout)
+                except:
+                    continue
+                # 検索結果はフォーム送信後のページ移動で返るので、移動の完了まで待つ
+                # （通信が落ち着くのを待つだけでは、送信前の結果のままCSVをダウンロードしてしまう）
+                try:
+                    with politeness.request(page.url) as ticket, adaptive_timeouts.step('actionLog', 'search_submit', 60000) as timeout:
+                        with page.expect_navigation(timeout=timeout) as navigation:
+                            page.click(selector, timeout=timeout)
+                        ticket.response(navigation.value)
+                    clicked = True
+                    print(f"[{datetime.now()}] 検索ボタンをクリックしました")
+                    break
+                except:
+                    continue
+
+            if clicked:
+                print(f"[{datetime.now()}] 検索条件を適用しました")
+            else:
+                print(f"[{datetime.now()}] 警告: 検索ボタンのクリックに失敗")
+
+        except Exception as e:
+            print(f"[{datetime.now()}] 警告: 検索ボタンのクリック中にエラー - {str(e)}")
+
+    with run_metrics.span('export') as s:
+        # ===== CSVダウンロード =====
+        with adaptive_timeouts.step('actionLog', 'csv_link', 30000) as timeout:
+            page.wait_for_selector('#csv-link', state='visible', timeout=timeout)
+        print(f"[{datetime.now()}] CSVダウンロードボタンを確認しました")
+
+        print(f"[{datetime.now()}] CSVダウンロードを開始します")
+
+        with politeness.request(page.url, 'export'), adaptive_timeouts.step('actionLog', 'csv_download', 60000) as timeout:
+            with page.expect_download(timeout=timeout) as download_info:
+                page.click('#csv-link')
+                print(f"[{datetime.now()}] CSVダウンロードボタンをクリックしました")
+
+        download = download_info.value
+        csv_path = csv_path or f'/tmp/presco_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        download.save_as(csv_path)
+
+        print(f"[{datetime.now()}] CSVをダウンロードしました: {csv_path}")
+
+        import os as os_module
+        file_size = os_module.path.getsize(csv_path)
+        print(f"[{datetime.now()}] ファイルサイズ: {file_size} bytes")
+
+        if file_size == 0:
+            raise Exception("ダウンロードしたCSVファイルが空です")
+        s.set('bytes', file_size)
+
+    return csv_path
+
+
 def extract_gclid(referrer_url):
     """リファラURLからgclidを抽出"""
     if not referrer_url:
@@ -236,16 +291,9 @@ def is_after_cutoff_date(date_string, cutoff_datetime):
         return False
 
 
-def transform_csv_data(csv_path, existing_gclids):
-    """CSVデータを変換して出力フォーマットに整形"""
-    
-    print(f"[{datetime.now()}] CSVデータの変換を開始します")
-    
-    cutoff_datetime = get_date_filter_range()
-    print(f"[{datetime.now()}] カットオフ日時: {cutoff_datetime.strftime('%Y/%m/%d %H:%M:%S')} 以降のデータを抽出")
-    
+def read_csv(csv_path):
+    """CSVを読み込む（文字コード自動判定）"""
     encodings = ['utf-8-sig', 'utf-8', 'shift_jis', 'cp932']
-    data = None
     
     for encoding in encodings:
         try:
@@ -253,12 +301,30 @@ def transform_csv_data(csv_path, existing_gclids):
                 csv_reader = csv.reader(f)
                 data = list(csv_reader)
             print(f"[{datetime.now()}] CSVを {encoding} エンコーディングで読み込みました")
-            break
+            run_metrics.set_attr('encoding', encoding)
+            return data
         except UnicodeDecodeError:
             continue
     
-    if data is None:
-        raise Exception("CSVファイルの読み込みに失敗しました")
+    raise Exception("CSVファイルの読み込みに失敗しました")
+
+
+def transform_csv_data(csv_path, existing_gclids):
+    """CSVデータを変換して出力フォーマットに整形"""
+    with run_metrics.span('parse') as s:
+        data = read_csv(csv_path)
+        s.set('rows', len(data))
+    
+    return transform_rows(data, existing_gclids)
+
+
+def transform_rows(data, existing_gclids, cutoff_datetime=None):
+    """読み込んだCSVの行を出力フォーマットに整形（cutoff_datetime を省略したら get_date_filter_range()）"""
+    
+    print(f"[{datetime.now()}] CSVデータの変換を開始します")
+    
+    cutoff_datetime = cutoff_datetime or get_date_filter_range()
+    print(f"[{datetime.now()}] カットオフ日時: {cutoff_datetime.strftime('%Y/%m/%d %H:%M:%S')} 以降のデータを抽出")
     
     # 1行目: TimeZoneパラメータ
     parameter_row = ["Parameters:TimeZone=Asia/Tokyo", "", "", "", ""]
@@ -290,59 +356,66 @@ def transform_csv_data(csv_path, existing_gclids):
     date_filtered_count = 0
     new_count = 0
     
-    for row in data_rows:
-        # ★修正箇所1: インデックス17(18列目)にアクセスするため、18未満はスキップ
-        if len(row) < 18:
-            continue
+    with run_metrics.span('transform') as s:
+        for row in data_rows:
+            # ★修正箇所1: インデックス17(18列目)にアクセスするため、18未満はスキップ
+            if len(row) < 18:
+                continue
         
-        site_name = row[5] if len(row) > 5 else ""
+            site_name = row[5] if len(row) > 5 else ""
         
-        # サイト名フィルタリング
-        if site_name != target_site_name:
-            filtered_count += 1
-            continue
+            # サイト名フィルタリング
+            if site_name != target_site_name:
+                filtered_count += 1
+                continue
         
-        # D列（インデックス3）: 成果発生日時
-        action_datetime = row[3] if len(row) > 3 else ""
+            # D列（インデックス3）: 成果発生日時
+            action_datetime = row[3] if len(row) > 3 else ""
         
-        # 日付フィルタリング: カットオフ日時以降のみ
-        if not is_after_cutoff_date(action_datetime, cutoff_datetime):
-            date_filtered_count += 1
-            continue
+            # 日付フィルタリング: カットオフ日時以降のみ
+            if not is_after_cutoff_date(action_datetime, cutoff_datetime):
+                date_filtered_count += 1
+                continue
         
-        referrer = row[12] if len(row) > 12 else ""
-        gclid = extract_gclid(referrer)
+            referrer = row[12] if len(row) > 12 else ""
+            gclid = extract_gclid(referrer)
         
-        if not gclid:
-            no_gclid_count += 1
-            continue
+            if not gclid:
+                no_gclid_count += 1
+                continue
         
-        if gclid in existing_gclids:
-            duplicate_count += 1
-            continue
+            if gclid in existing_gclids:
+                duplicate_count += 1
+                continue
         
-        conversion_name = "看護オフラインCV"
-        conversion_time = format_datetime_for_google(action_datetime)
+            conversion_name = "看護オフラインCV"
+            conversion_time = format_datetime_for_google(action_datetime)
         
-        # ★修正箇所2: 成果報酬(18列目・インデックス17)を動的に取得
-        try:
-            conversion_value = str(int(float(row[17])))
-        except (ValueError, TypeError):
-            conversion_value = "0"
+            # ★修正箇所2: 成果報酬(18列目・インデックス17)を動的に取得
+            try:
+                conversion_value = str(int(float(row[17])))
+            except (ValueError, TypeError):
+                conversion_value = "0"
             
-        conversion_currency = "JPY"
+            conversion_currency = "JPY"
         
-        output_row = [
-            gclid,
-            conversion_name,
-            conversion_time,
-            conversion_value,
-            conversion_currency
-        ]
+            output_row = [
+                gclid,
+                conversion_name,
+                conversion_time,
+                conversion_value,
+                conversion_currency
+            ]
         
-        transformed_data.append(output_row)
-        existing_gclids.add(gclid)
-        new_count += 1
+            transformed_data.append(output_row)
+            existing_gclids.add(gclid)
+            new_count += 1
+        s.set('rows_in', total_count)
+        s.set('rows_out', new_count)
+        s.set('site_filtered', filtered_count)
+        s.set('date_filtered', date_filtered_count)
+        s.set('no_gclid', no_gclid_count)
+        s.set('duplicates', duplicate_count)
     
     print(f"[{datetime.now()}] 変換結果:")
     print(f"  - 総データ数: {total_count}行")
@@ -356,63 +429,164 @@ def transform_csv_data(csv_path, existing_gclids):
     return [parameter_row, output_header] + transformed_data
 
 
-def upload_to_spreadsheet(csv_path):
+def upload_to_spreadsheet(csv_path, run=checkpoints.NONE):
     """CSVをGoogle Spreadsheetsに上書き（毎回リセット）"""
     
     print(f"[{datetime.now()}] Google Sheetsへのアップロードを開始します")
     
-    creds_json = os.environ.get('GOOGLE_CREDENTIALS')
-    if not creds_json:
-        raise Exception("環境変数 GOOGLE_CREDENTIALS が設定されていません")
-    
-    creds_dict = json.loads(creds_json)
-    
-    scope = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    gc = gspread.authorize(credentials)
-    
     spreadsheet_id = os.environ.get('SPREADSHEET_ID')
     if not spreadsheet_id:
         raise Exception("環境変数 SPREADSHEET_ID が設定されていません")
     
-    spreadsheet = gc.open_by_key(spreadsheet_id)
-    
     sheet_name = '成果情報_看護特化'
-    try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        print(f"[{datetime.now()}] 既存のワークシート '{sheet_name}' を使用します")
-    except:
-        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=1000, cols=10)
-        print(f"[{datetime.now()}] 新しいワークシート '{sheet_name}' を作成しました")
+    worksheet = sheets_client.open_worksheet(spreadsheet_id, sheet_name, rows=1000, cols=10)
     
     # リセット方式なので既存GCLIDは空の状態で渡す（CSV内での重複のみ弾く）
     existing_gclids = set()
     
-    new_data = transform_csv_data(csv_path, existing_gclids)
+    with run_metrics.span('parse') as s:
+        data = run.stage('parse', read_csv, csv_path)
+        s.set('rows', len(data))
     
-    print(f"[{datetime.now()}] シートの中身をクリア（リセット）します")
-    worksheet.clear()
+    new_data = run.stage('transform', transform_rows, data, existing_gclids)
     
-    if new_data and len(new_data) > 0:
-        print(f"[{datetime.now()}] 新しいデータ（{len(new_data)}行）を書き込みます")
-        worksheet.update(values=new_data, range_name="A1")
+    print(f"[{datetime.now()}] シートの中身を新しいデータ（{len(new_data)}行）に置き換えます")
+    run.stage('publish', sheets_publisher.publish, worksheet, new_data, kind='marker')
     
     print(f"[{datetime.now()}] Google Sheetsの更新が完了しました")
     print(f"[{datetime.now()}] スプレッドシートURL: https://docs.google.com/spreadsheets/d/{spreadsheet_id}")
 
 
+
+def upload_rollup():
+    """日別・サイト別の集計表（看護特化のみ）を別シートに上書き（ダッシュボード用）"""
+    
+    spreadsheet_id = os.environ.get('SPREADSHEET_ID')
+    if not spreadsheet_id:
+        raise Exception("環境変数 SPREADSHEET_ID が設定されていません")
+    
+    daily_rollup.publish(spreadsheet_id, '日別集計_看護特化', "Fast Baito 看護特化")
+
+
+def upload_backfill(new_data):
+    """過去分の再取得（backfill.py）の結果を別シートに上書き（通常の同期のリセットで消されないように）"""
+    
+    spreadsheet_id = os.environ.get('SPREADSHEET_ID')
+    if not spreadsheet_id:
+        raise Exception("環境変数 SPREADSHEET_ID が設定されていません")
+    
+    worksheet = sheets_client.open_worksheet(spreadsheet_id, '成果情報_看護特化_過去分', rows=1000, cols=10)
+    sheets_publisher.publish(worksheet, new_data)
+    print(f"[{datetime.now()}] スプレッドシートURL: https://docs.google.com/spreadsheets/d/{spreadsheet_id}")
+
+
+def export_ads_csv(csv_path, output, run=checkpoints.NONE, compress=False, max_bytes=None):
+    """Google広告のオフラインCV取り込み形式のCSVをローカルに書き出す（Sheetsを経由しない）"""
+    
+    with run_metrics.span('parse') as s:
+        data = run.stage('parse', read_csv, csv_path)
+        s.set('rows', len(data))
+    
+    new_data = run.stage('transform', transform_rows, data, set())
+    
+    paths = run.stage('ads_export', ads_export.write, new_data, output,
+                      compress=compress, max_bytes=max_bytes)
+    run_metrics.set_attr('files', len(paths))
+    return paths
+
+
+def dry_run(csv_path, output=None):
+    """シートには書き込まず、変換結果をローカルに出力する"""
+    new_data = transform_csv_data(csv_path, set())
+    local_output.write(new_data, output)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Presco自動同期（看護特化・上書きモード）")
+    profiling.add_arguments(parser)
+    network_accounting.add_arguments(parser)
+    checkpoints.add_arguments(parser)
+    download_cache.add_arguments(parser)
+    local_output.add_arguments(parser)
+    raw_archive.add_arguments(parser)
+    query_store.add_arguments(parser)
+    daily_rollup.add_arguments(parser)
+    ads_export.add_arguments(parser)
+    return parser
+
+
+def sync(args, session=None):
+    """1回分の同期処理（session を渡すと、起動済み・ログイン済みのブラウザを使う）"""
+    with run_metrics.pipeline('sync_presco'):
+        if args.from_csv:
+            # 保存済みのCSVを使う（ダウンロードもチェックポイントも使わない）
+            run      = checkpoints.NONE
+            csv_path = args.from_csv
+        else:
+            # 失敗後の再実行では、完了済みのステージをチェックポイントから再開する
+            # 検索期間は「昨日〜今日」
+            today = datetime.now(ZoneInfo("Asia/Tokyo"))
+            run = checkpoints.open_run('sync_presco', args, report='actionLog', date_type='judgeDate',
+                                       date_from=(today - timedelta(days=1)).strftime("%Y/%m/%d"),
+                                       date_to=today.strftime("%Y/%m/%d"))
+            with run_metrics.span('scrape'):
+                csv_path = run.stage('download', login_and_download_csv, session, kind='file')
+            download_cache.rotate_artifacts(keep=[csv_path])
+
+        if args.dry_run:
+            with run_metrics.span('dry_run'):
+                dry_run(csv_path, args.output)
+            return
+
+        # 前回書き込んだCSVと内容が同じなら、変換と書き込みを省略する
+        # 変換は日付のカットオフ（ローカル時刻の前日0時）にも依存するので、キーに含める
+        with run_metrics.span('content_check'):
+            content_key = download_cache.content_key(
+                csv_path, dict(run.params, sink=args.sink, cutoff=get_date_filter_range().isoformat()))
+            unchanged   = download_cache.unchanged('sync_presco', content_key)
+
+        if unchanged and not args.force_publish:
+            print(f"[{datetime.now()}] 変更がないため、変換と出力を省略します")
+            run_metrics.set_attr('result', 'no_change')
+        else:
+            if not args.no_archive:
+                # シートは毎回上書きされるため、生データは履歴用のアーカイブに残す
+                with run_metrics.span('archive') as s:
+                    s.set('rows', raw_archive.archive_quietly('actionLog', run.stage('parse', read_csv, csv_path)))
+            if not args.no_store:
+                # gclid やサイト別の件数をシートを探さずに調べられるよう、検索用DBにも取り込む
+                with run_metrics.span('store') as s:
+                    s.set('rows', query_store.load_quietly('actionLog', run.stage('parse', read_csv, csv_path)))
+            if not args.no_rollup:
+                # 日別集計は新しい行・変わった行の分だけ足し引きする
+                with run_metrics.span('rollup') as s:
+                    s.set('rows', daily_rollup.update_quietly(run.stage('parse', read_csv, csv_path)))
+            if args.sink in ('sheets', 'both'):
+                with run_metrics.span('upload'):
+                    upload_to_spreadsheet(csv_path, run)
+                if not args.no_rollup:
+                    with run_metrics.span('rollup_publish'):
+                        run.stage('rollup_publish', upload_rollup, kind='marker')
+            if args.sink in ('ads-csv', 'both'):
+                with run_metrics.span('ads_export'):
+                    export_ads_csv(csv_path, args.ads_output or ads_export.default_path('sync_presco'), run,
+                                   compress=args.ads_gzip, max_bytes=args.ads_max_bytes)
+            download_cache.mark_published('sync_presco', content_key)
+        run.complete()
+
+
 def main():
     """メイン処理"""
+    args = build_parser().parse_args()
+    profiling.enable_from_args(args)
+    network_accounting.enable_from_args(args)
+
     try:
         print("=" * 60)
         print(f"[{datetime.now()}] Presco自動同期を開始します（看護特化・上書きモード）")
         print("=" * 60)
         
-        csv_path = login_and_download_csv()
-        upload_to_spreadsheet(csv_path)
+        sync(args)
         
         print("=" * 60)
         print(f"[{datetime.now()}] すべての処理が正常に完了しました")
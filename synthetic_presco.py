@@ -0,0 +1,219 @@
+# synthetic_presco.py
+# Prescoのエクスポートに似せた合成CSVの生成
+#   actionLog : 成果一覧CSV（sync_presco.py / presco_gamesverse.py の入力）
+#   report    : レポート（ログ集計）CSV（presco_kango.py / presco_kango_item5.py の入力）
+#   clickLog  : クリックログCSV（presco_kango_cv.py の入力）
+#
+# 期間と seed を含めて同じ引数なら、毎回バイト単位で同じCSVになる
+
+import io
+import csv
+import base64
+import random
+from datetime import datetime, timedelta
+
+
+# ============================================================
+#  設定
+# ============================================================
+
+# サイト名 → 出現比率
+DEFAULT_SITE_MIX = {
+    'Fast Baito 看護特化': 0.5,
+    'GAMES VERSE':         0.3,
+    'Fast Baito':          0.2,
+}
+DEFAULT_GCLID_RATE = 0.7
+
+ACTION_LOG_HEADER = [
+    '成果ID', 'クリック日時', 'プログラム名', '成果発生日時', '成果判定日時',
+    'サイト名', 'サイトURL', '広告名', '成果地点', 'ステータス',
+    'デバイス', 'OS', 'リファラ', 'IPアドレス', 'ユーザーエージェント',
+    '成果条件', '件数', '成果報酬',
+]
+
+REPORT_HEADER = [
+    '集計期間', 'プログラムID', 'プログラム名', '広告ID', '広告名',
+    'サイトID', 'サイト名', 'ページID', 'ページ名', 'ジャンル',
+    '表示回数', 'クリック数', 'CTR', '発生件数', '発生報酬',
+    '承認件数', '承認報酬', 'CVR',
+]
+
+CLICK_LOG_HEADER = [
+    'クリックID', 'クリック日時', 'プログラムID', 'プログラム名', '広告ID',
+    'サイトID', 'サイト名', 'デバイス', 'OS', 'IPアドレス',
+    'リファラ', 'ユーザーエージェント',
+]
+
+KINDS = ('actionLog', 'report', 'clickLog')
+
+_PROGRAMS = ['看護師求人A', '看護師求人B', '介護職求人', 'ゲームアプリX', '短期バイトY']
+_DEVICES  = [('PC', 'Windows'), ('SP', 'iOS'), ('SP', 'Android')]
+_STATUSES = ['承認', '未承認', '否認']
+
+
+# ============================================================
+#  行の生成
+# ============================================================
+
+class _Generator:
+
+    def __init__(self, site_mix, gclid_rate, date_from, date_to, seed, only_site=None):
+        self.rng        = random.Random(seed)
+        self.sites      = list(site_mix)
+        self.only_site  = only_site
+        self.site_urls  = {site: f"https://{site_slug(site)}.example.jp/" for site in self.sites}
+        self.weights    = list(site_mix.values())
+        self.gclid_rate = gclid_rate
+        self.start      = date_from
+        self.span       = max(int((date_to - date_from).total_seconds()), 1)
+
+    def site(self):
+        if self.only_site is not None:
+            return self.only_site
+        return self.rng.choices(self.sites, self.weights)[0]
+
+    def site_id(self, site):
+        return str(37502 + self.sites.index(site))
+
+    def timestamp(self):
+        return self.start + timedelta(seconds=self.rng.randrange(self.span))
+
+    def referrer(self):
+        url = f"https://example.com/lp/{self.rng.randrange(100)}?utm_source=google"
+        if self.rng.random() < self.gclid_rate:
+            # 実際の gclid と同じく英数字と - _ からなる40文字
+            gclid = base64.urlsafe_b64encode(self.rng.getrandbits(240).to_bytes(30, 'big')).decode('ascii')
+            url += f"&gclid={gclid}&utm_medium=cpc"
+        return url
+
+    def ip(self):
+        return '.'.join(str(self.rng.randrange(1, 255)) for _ in range(4))
+
+    def action_log_row(self, i):
+        site    = self.site()
+        clicked = self.timestamp()
+        acted   = clicked + timedelta(minutes=self.rng.randrange(1, 600))
+        judged  = acted + timedelta(hours=self.rng.randrange(0, 48))
+        device, os_name = self.rng.choice(_DEVICES)
+        return [
+            f"A{i:09d}",
+            clicked.strftime('%Y/%m/%d %H:%M:%S'),
+            self.rng.choice(_PROGRAMS),
+            acted.strftime('%Y/%m/%d %H:%M:%S'),
+            judged.strftime('%Y/%m/%d %H:%M:%S'),
+            site,
+            self.site_urls[site],
+            f"広告{self.rng.randrange(1, 20)}",
+            '応募完了',
+            self.rng.choice(_STATUSES),
+            device,
+            os_name,
+            self.referrer(),
+            self.ip(),
+            'Mozilla/5.0',
+            '新規応募',
+            '1',
+            str(self.rng.choice([500, 1000, 1500, 3000, 8000])),
+        ]
+
+    def report_row(self, i):
+        site    = self.site()
+        program = self.rng.randrange(len(_PROGRAMS))
+        day     = self.start + timedelta(days=i // 50)
+        shows   = self.rng.randrange(100, 100000)
+        clicks  = self.rng.randrange(0, max(shows // 20, 1))
+        occur   = self.rng.randrange(0, max(clicks // 10, 1))
+        approve = self.rng.randrange(0, occur + 1)
+        return [
+            day.strftime('%Y/%m/%d'),
+            str(1000 + program),
+            _PROGRAMS[program],
+            str(5000 + i % 50),
+            f"広告{i % 50}",
+            self.site_id(site),
+            site,
+            '',
+            '',
+            '求人',
+            str(shows),
+            str(clicks),
+            f"{clicks / shows * 100:.2f}%",
+            str(occur),
+            str(occur * 1500),
+            str(approve),
+            str(approve * 1500),
+            f"{(occur / clicks * 100) if clicks else 0:.2f}%",
+        ]
+
+    def click_log_row(self, i):
+        site    = self.site()
+        program = self.rng.randrange(len(_PROGRAMS))
+        device, os_name = self.rng.choice(_DEVICES)
+        return [
+            f"C{i:010d}",
+            self.timestamp().strftime('%Y/%m/%d %H:%M:%S'),
+            str(1000 + program),
+            _PROGRAMS[program],
+            str(5000 + self.rng.randrange(50)),
+            self.site_id(site),
+            site,
+            device,
+            os_name,
+            self.ip(),
+            self.referrer(),
+            'Mozilla/5.0',
+        ]
+
+
+def site_slug(site):
+    return ''.join(ch for ch in site.lower() if ch.isascii() and ch.isalnum()) or 'site'
+
+
+def generate_rows(kind, rows, site_mix=None, gclid_rate=DEFAULT_GCLID_RATE,
+                  date_from=None, date_to=None, seed=0, site_id=None):
+    """
+    ヘッダー行を含めて rows 行（ヘッダー + rows-1 行のデータ）を順に返す
+    site_id を指定すると、そのサイトの行だけにする（searchPartnerSiteId で絞り込んだCSV）
+    """
+    if kind not in KINDS:
+        raise Exception(f"不明なCSV種別です: {kind}")
+
+    date_to   = date_to or datetime.now().replace(microsecond=0)
+    date_from = date_from or date_to - timedelta(days=1)
+    site_mix  = site_mix or DEFAULT_SITE_MIX
+    sites     = list(site_mix)
+    index     = int(site_id) - 37502 if site_id and site_id.isdigit() else -1
+    gen = _Generator(site_mix, gclid_rate, date_from, date_to, seed,
+                     only_site=sites[index] if 0 <= index < len(sites) else None)
+
+    header, make_row = {
+        'actionLog': (ACTION_LOG_HEADER, gen.action_log_row),
+        'report':    (REPORT_HEADER,     gen.report_row),
+        'clickLog':  (CLICK_LOG_HEADER,  gen.click_log_row),
+    }[kind]
+
+    yield list(header)
+    for i in range(max(rows - 1, 0)):
+        yield make_row(i)
+
+
+# ============================================================
+#  CSV出力
+# ============================================================
+
+def write_csv(path, kind, rows, encoding='shift_jis', **options):
+    """合成CSVをファイルに書き出す（行単位で書くので大きな行数でもメモリを使わない）"""
+    with open(path, 'w', encoding=encoding, errors='replace', newline='') as f:
+        writer = csv.writer(f)
+        for row in generate_rows(kind, rows, **options):
+            writer.writerow(row)
+    return path
+
+
+def csv_bytes(kind, rows, encoding='shift_jis', **options):
+    buf = io.StringIO(newline='')
+    writer = csv.writer(buf)
+    for row in generate_rows(kind, rows, **options):
+        writer.writerow(row)
+    return buf.getvalue().encode(encoding, errors='replace')
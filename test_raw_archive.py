@@ -0,0 +1,48 @@
+# test_raw_archive.py
+# raw_archive.append() / scan() の自然キーによる重複判定を確かめる
+#
+#   python -m pytest -q test_raw_archive.py
+
+import raw_archive
+
+
+HEADER = ['集計期間', 'プログラムID', 'プログラム名', '広告ID', 'サイトID', 'ページID', '成果数']
+
+
+def _report(*rows):
+    return [HEADER] + [list(row) for row in rows]
+
+
+def test_programs_with_the_same_ad_id_are_different_rows(tmp_path):
+    base_dir = str(tmp_path)
+    rows     = _report(['2026/10/01', 'P001', 'プログラムA', 'AD1', 'S1', '0', '3'],
+                       ['2026/10/01', 'P002', 'プログラムB', 'AD1', 'S1', '0', '5'])
+
+    # 同じ2行を3回追記しても、最初の1回だけが保存される
+    assert raw_archive.append('report_item5', rows, base_dir) == 2
+    assert raw_archive.append('report_item5', rows, base_dir) == 0
+    assert raw_archive.append('report_item5', rows, base_dir) == 0
+
+    assert sorted(raw_archive.scan('report_item5', base_dir=base_dir)) == sorted(rows[1:])
+    assert len(list(raw_archive.scan('report_item5', base_dir=base_dir, all_versions=True))) == 2
+
+
+def test_changed_row_replaces_only_its_own_program(tmp_path):
+    base_dir = str(tmp_path)
+    raw_archive.append('report', _report(['2026/10/01', 'P001', 'プログラムA', 'AD1', 'S1', '0', '3'],
+                                         ['2026/10/01', 'P002', 'プログラムB', 'AD1', 'S1', '0', '5']), base_dir)
+
+    # P002 の成果数だけが変わった
+    added = raw_archive.append('report', _report(['2026/10/01', 'P001', 'プログラムA', 'AD1', 'S1', '0', '3'],
+                                                 ['2026/10/01', 'P002', 'プログラムB', 'AD1', 'S1', '0', '6']), base_dir)
+
+    assert added == 1
+    assert sorted(raw_archive.scan('report', columns=['プログラムID', '成果数'], base_dir=base_dir)) == [
+        ['P001', '3'], ['P002', '6']]
+    assert len(list(raw_archive.scan('report', base_dir=base_dir, all_versions=True))) == 3
+
+
+def test_report_key_matches_the_cdc_key():
+    import presco_kango_item5
+
+    assert raw_archive.NATURAL_KEYS['report_item5'] == presco_kango_item5.CDC_KEY_COLUMNS
@@ -0,0 +1,243 @@
+# test_sheets_publisher.py
+# sheets_publisher.publish() / apply_changes() を fake_sheets.FakeClient に対して実行し、シートの最終的な中身を確かめる
+# （row_changes.py の差分 → apply_changes() / 全体の書き直しへの切り替えも含む）
+#
+#   python -m pytest -q test_sheets_publisher.py
+
+import pytest
+
+import fake_sheets
+import row_changes
+import sheet_lease
+import sheets_client
+import sheets_publisher
+
+
+SPREADSHEET_ID = 'test-spreadsheet'
+HEADER         = ['キー', '値', '備考']
+
+
+@pytest.fixture
+def client():
+    client = fake_sheets.FakeClient()
+    sheets_client.set_backend(client)
+    sheet_lease.set_backend(sheet_lease.LocalLeases())
+    yield client
+    sheets_client.set_backend(None)
+    sheet_lease.set_backend(None)
+
+
+@pytest.fixture
+def requests_sent(monkeypatch):
+    """batch_update に渡されたリクエストのリスト（呼び出しごと）"""
+    sent = []
+    original = fake_sheets.FakeSpreadsheet.batch_update
+
+    def batch_update(self, body):
+        sent.append(body['requests'])
+        return original(self, body)
+
+    monkeypatch.setattr(fake_sheets.FakeSpreadsheet, 'batch_update', batch_update)
+    return sent
+
+
+def _worksheet(rows=20, cols=5, values=None, title='テスト'):
+    worksheet = sheets_client.open_worksheet(SPREADSHEET_ID, title, rows=rows, cols=cols)
+    if values:
+        worksheet.update(values=values, range_name='A1')
+    return worksheet
+
+
+def _rows(count, start=0, suffix=''):
+    return [[f"k{i:03d}", f"v{i}{suffix}", ''] if i % 3 else [f"k{i:03d}", f"v{i}{suffix}", f"備考{i}"]
+            for i in range(start, start + count)]
+
+
+def _padded(values, cols):
+    return [row + [''] * (cols - len(row)) for row in values]
+
+
+# ============================================================
+#  publish()
+# ============================================================
+
+@pytest.mark.parametrize('strategy', ['staged', 'direct'])
+def test_publish_replaces_contents_and_fits_grid(client, strategy):
+    worksheet = _worksheet(rows=30, cols=8, values=[[f"old{r}-{c}" for c in range(8)] for r in range(30)])
+    values    = [HEADER] + _rows(12)
+
+    sheets_publisher.publish(worksheet, values, strategy)
+
+    assert worksheet.get_all_values() == values
+    assert (worksheet.row_count, worksheet.col_count) == (13, 3)
+    fresh = client.open_by_key(SPREADSHEET_ID).worksheet('テスト')
+    assert (fresh.row_count, fresh.col_count) == (13, 3)
+
+
+def test_publish_staged_swaps_through_hidden_staging_sheet(client, requests_sent):
+    worksheet = _worksheet(values=[['old']])
+    values    = [HEADER] + _rows(5)
+
+    sheets_publisher.publish(worksheet, values, 'staged')
+
+    staging = client.open_by_key(SPREADSHEET_ID).worksheet('テスト' + sheets_publisher.STAGING_SUFFIX)
+    assert staging.isSheetHidden
+    assert staging.get_all_values() == values
+    # 本番シートへの反映は、グリッドの調整・クリア・貼り付けを1回の batch_update で行う
+    swap = requests_sent[-1]
+    assert [next(iter(request)) for request in swap] == ['updateSheetProperties', 'updateCells', 'copyPaste']
+    assert worksheet.get_all_values() == values
+
+
+def test_publish_empty_values_leaves_minimal_grid(client):
+    worksheet = _worksheet(values=[['a', 'b'], ['c', 'd']])
+
+    sheets_publisher.publish(worksheet, [])
+
+    assert worksheet.get_all_values() == []
+    assert (worksheet.row_count, worksheet.col_count) == (1, 1)
+
+
+# ============================================================
+#  apply_changes()
+# ============================================================
+
+def test_apply_changes_deletes_updates_and_appends_in_one_batch(client, requests_sent):
+    before    = [HEADER] + _rows(10)
+    worksheet = _worksheet(rows=len(before), cols=3, values=before)
+    requests_sent.clear()
+
+    # 行3・4と行8を削除（削除前の位置）。削除後の行2と、連続する行5・6を更新し、2行を追加する
+    deletes = [3, 4, 8]
+    after   = [row[:] for i, row in enumerate(before) if i not in deletes]
+    updates = {2: ['k001', '更新1', ''], 5: ['k006', '更新6', '備考6'], 6: ['k007', '更新7', '']}
+    appends = [['k100', '追加1', ''], ['k101', '追加2', '備考']]
+    for index, row in updates.items():
+        after[index] = row
+    after += appends
+
+    sheets_publisher.apply_changes(worksheet, deletes, updates, appends)
+
+    assert worksheet.get_all_values() == after
+    assert (worksheet.row_count, worksheet.col_count) == (len(after), 3)
+
+    # 1回の batch_update で、削除は後ろの範囲から、連続する行は1つの updateCells にまとめて送る
+    assert len(requests_sent) == 1
+    kinds = [next(iter(request)) for request in requests_sent[0]]
+    assert kinds == ['deleteDimension', 'deleteDimension', 'updateSheetProperties',
+                     'updateCells', 'updateCells', 'updateCells']
+    deleted = [(r['deleteDimension']['range']['startIndex'], r['deleteDimension']['range']['endIndex'])
+               for r in requests_sent[0][:2]]
+    assert deleted == [(8, 9), (3, 5)]
+    written = [(r['updateCells']['range']['startRowIndex'], r['updateCells']['range']['endRowIndex'])
+               for r in requests_sent[0][3:]]
+    assert written == [(2, 3), (5, 7), (len(after) - 2, len(after))]
+
+
+def test_apply_changes_resizes_columns(client):
+    before    = [HEADER] + _rows(4)
+    worksheet = _worksheet(rows=len(before), cols=3, values=before)
+
+    # 列を増やす（追加行なし）
+    wide = ['k002', 'v2', '', '追加列']
+    sheets_publisher.apply_changes(worksheet, [], {3: wide}, [], cols=4)
+    expected = _padded(before, 4)
+    expected[3] = wide
+    assert worksheet.get_all_values() == expected
+    assert (worksheet.row_count, worksheet.col_count) == (5, 4)
+
+    # 列を減らすと、はみ出した値は消える
+    sheets_publisher.apply_changes(worksheet, [], {}, [], cols=2)
+    assert worksheet.get_all_values() == [row[:2] for row in expected]
+    assert worksheet.col_count == 2
+
+
+def test_apply_changes_without_changes_sends_nothing(client, requests_sent):
+    before    = [HEADER] + _rows(3)
+    worksheet = _worksheet(rows=len(before), cols=3, values=before)
+    requests_sent.clear()
+
+    sheets_publisher.apply_changes(worksheet, [], {}, [])
+
+    assert requests_sent == []
+    assert worksheet.get_all_values() == before
+
+
+# ============================================================
+#  row_changes.py の差分からの反映（全体の書き直しへの切り替え）
+# ============================================================
+
+PIPELINE = 'test_pipeline'
+
+
+@pytest.fixture
+def snapshots(tmp_path):
+    with row_changes.Snapshots(str(tmp_path / 'cdc.db')) as snapshots:
+        yield snapshots
+
+
+def _sync(snapshots, worksheet, rows):
+    """presco_kango_item5.publish_changes() と同じ流れ（差分を反映するか、全体を書き直す）"""
+    changes = snapshots.diff(PIPELINE, rows, rows, [0])
+    if changes.full:
+        sheets_publisher.publish(worksheet, rows)
+    else:
+        sheets_publisher.apply_changes(worksheet, *changes.patch(), cols=sheets_publisher.grid_size(rows)[1])
+    snapshots.commit(changes)
+    return changes
+
+
+def test_small_changes_are_applied_as_a_patch(client, snapshots, requests_sent):
+    worksheet = _worksheet()
+    rows      = [HEADER] + _rows(20)
+    first     = _sync(snapshots, worksheet, rows)
+    assert first.full == '前回の記録がありません'
+    assert worksheet.get_all_values() == rows
+
+    # 1行更新・2行削除・1行追加（末尾）→ 差分で反映される
+    changed = [row[:] for row in rows]
+    changed[5][1] = '更新'
+    del changed[12]
+    del changed[3]
+    changed.append(['k999', '追加', ''])
+    requests_sent.clear()
+
+    changes = _sync(snapshots, worksheet, changed)
+
+    assert changes.full is None
+    assert (len(changes.inserted), len(changes.updated), len(changes.deleted)) == (1, 1, 2)
+    assert len(requests_sent) == 1
+    assert worksheet.get_all_values() == changed
+    assert worksheet.row_count == len(changed)
+
+
+def test_header_change_falls_back_to_full_publish(client, snapshots):
+    worksheet = _worksheet()
+    rows      = [HEADER] + _rows(10)
+    _sync(snapshots, worksheet, rows)
+
+    renamed = [['キー', '値', 'メモ']] + rows[1:]
+    changes = _sync(snapshots, worksheet, renamed)
+
+    assert changes.full == 'CSVのヘッダーが変わりました'
+    assert worksheet.get_all_values() == renamed
+
+
+def test_changing_more_than_full_ratio_falls_back_to_full_publish(client, snapshots):
+    worksheet = _worksheet()
+    rows      = [HEADER] + _rows(10)
+    _sync(snapshots, worksheet, rows)
+
+    # 10行中6行を更新（FULL_RATIO = 0.5 を超える）
+    changed = [HEADER] + _rows(6, suffix='改') + rows[7:]
+    changes = _sync(snapshots, worksheet, changed)
+
+    assert changes.full.startswith('変更が多いため')
+    assert worksheet.get_all_values() == changed
+    assert (worksheet.row_count, worksheet.col_count) == (11, 3)
+
+    # ちょうど半分なら差分のまま
+    half    = [HEADER] + _rows(5, suffix='再') + changed[6:]
+    changes = _sync(snapshots, worksheet, half)
+    assert changes.full is None
+    assert worksheet.get_all_values() == half